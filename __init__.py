@@ -1,3 +1,10 @@
-from pyssrs import SSRSReport
-from parse_xlsx_xml import ParseXlsx
-from xlsx_rc_convertor import convert_rc_formula
\ No newline at end of file
+from pyssrs import SSRSReport, SSRSClient
+from parse_xlsx_xml import ParseXlsx, process_many
+from xlsx_rc_convertor import convert_rc_formula, convert_rc_formulas
+from ssrs_cache import ReportCache
+from report_metrics import Metrics
+from xlsx_merge import merge_workbooks
+from ssrs_soap import ReportExecutionClient, ReportExecutionError
+from ssrs_pipeline import ReportPipeline
+from xlsx_styles_cache import StylesCache
+from xlsx_export import export_workbook
\ No newline at end of file
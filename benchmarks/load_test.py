@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+    Load test of SSRSReport's URL access path against local stub of Reporting Services.
+    Runs many concurrent report requests and reports p50/p99 latency, requests/s,
+    errors, connections opened on server and peak memory of client process.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python load_test.py --requests 2000 --concurrency 16 --payload-size 1048576
+           python load_test.py --no-session --latency 0.05 --chunked
+    Notice: Stub runs in its own process, so peak memory is client's one only.
+            Peak memory is measured on Unix only.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import sys
+import time
+from multiprocessing import Process, Queue
+from multiprocessing.pool import ThreadPool
+
+import requests
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from pyssrs import SSRSReport, SSRSClient
+from run_benchmarks import get_peak_memory
+from ssrs_stub import StubReportServer, STATS_PATH
+
+# Report requested by load test
+REPORT_PATH = '/LoadTest/Report'
+
+
+class DiscardFile(object):
+    """ File object which counts written bytes and drops them """
+
+    def __init__(self):
+        self.size = 0
+
+    def write(self, data):
+        self.size += len(data)
+
+
+def serve_stub(options, addresses):
+    """ Stub's process: put its address to queue and serve """
+    server = StubReportServer(**options)
+    addresses.put(server.url)
+    server.serve_forever()
+
+
+def percentile(values, fraction):
+    """ Nearest-rank percentile of sorted values """
+    if not values:
+        return None
+    return values[min(len(values) - 1, max(0, int(round(fraction * len(values))) - 1))]
+
+
+def run_load(server, auth, request_count, concurrency, use_session, chunk_size):
+    """ Fetch report request_count times by concurrency threads, returns (latencies, errors, seconds) """
+    client = SSRSClient(server, auth, concurrency=concurrency) if use_session else None
+
+    def fetch(number):
+        params = {'request': number, 'name': 'load test'}
+        if client is not None:
+            report = client.report(REPORT_PATH, params)
+        else:
+            report = SSRSReport(server, REPORT_PATH, auth, params)
+        start = time.time()
+        try:
+            error = report.save_file(DiscardFile(), chunk_size)
+        except requests.RequestException as e:
+            error = repr(e)
+        return time.time() - start, error
+
+    pool = ThreadPool(concurrency)
+    start = time.time()
+    try:
+        results = pool.map(fetch, range(request_count))
+    finally:
+        pool.close()
+        pool.join()
+        if client is not None:
+            client.close()
+    elapsed = time.time() - start
+
+    return sorted(latency for latency, _ in results), [error for _, error in results if error], elapsed
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--requests', type=int, default=1000, help='number of report requests')
+    parser.add_argument('--concurrency', type=int, default=8, help='number of concurrent requests')
+    parser.add_argument('--payload-size', type=int, default=256 * 1024, help='bytes of report')
+    parser.add_argument('--latency', type=float, default=0, help="seconds of server's latency")
+    parser.add_argument('--chunked', action='store_true', help='send reports with chunked transfer')
+    parser.add_argument('--error-every', type=int, default=0, help='fail each N-th request')
+    parser.add_argument('--error-code', type=int, default=500, help='status of failed requests')
+    parser.add_argument('--auth', nargs=2, metavar=('USER', 'PASSWORD'), help='Basic auth, may be non-latin')
+    parser.add_argument('--no-session', action='store_true', help='new connection per report, without SSRSClient')
+    parser.add_argument('--chunk-size', type=int, default=64 * 1024, help="client's read chunk size")
+    parser.add_argument('--server', help='address of running ReportServer instead of local stub')
+    parser.add_argument('--save', help='save results to json file')
+    args = parser.parse_args()
+
+    auth = tuple(args.auth) if args.auth else ()
+    stub = None
+    server = args.server
+    if server is None:
+        addresses = Queue()
+        stub = Process(target=serve_stub, args=(dict(
+            auth=auth or None,
+            payload_size=args.payload_size,
+            latency=args.latency,
+            chunked=args.chunked,
+            error_code=args.error_code,
+            error_every=args.error_every,
+        ), addresses))
+        stub.daemon = True
+        stub.start()
+        server = addresses.get()
+
+    try:
+        latencies, errors, elapsed = run_load(
+            server, auth, args.requests, args.concurrency, not args.no_session, args.chunk_size
+        )
+        stats = requests.get(server.rsplit('/', 1)[0] + STATS_PATH).json() if stub is not None else {}
+    finally:
+        if stub is not None:
+            stub.terminate()
+            stub.join()
+
+    results = {
+        'requests': args.requests,
+        'concurrency': args.concurrency,
+        'seconds': elapsed,
+        'requests_per_second': args.requests / elapsed,
+        'p50_ms': percentile(latencies, 0.5) * 1000,
+        'p99_ms': percentile(latencies, 0.99) * 1000,
+        'max_ms': latencies[-1] * 1000,
+        'errors': len(errors),
+        'connections': stats.get('connections'),
+        'peak_memory_mb': get_peak_memory(),
+    }
+    print('{0} requests, concurrency {1}: {2:.1f} req/s, p50 {3:.1f} ms, p99 {4:.1f} ms, max {5:.1f} ms'.format(
+        args.requests, args.concurrency, results['requests_per_second'],
+        results['p50_ms'], results['p99_ms'], results['max_ms'],
+    ))
+    print('errors: {0}, connections: {1}, peak memory: {2} MB'.format(
+        results['errors'],
+        '-' if results['connections'] is None else results['connections'],
+        '-' if results['peak_memory_mb'] is None else '{0:.1f}'.format(results['peak_memory_mb']),
+    ))
+    if errors:
+        print('first error: {0}'.format(errors[0]))
+
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump(results, save_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,181 @@
+# -*- coding: utf-8 -*-
+"""
+    Benchmarks of xlsx post-processing on synthetic SSRS-like workbooks.
+    Reports cells/s, MB/s of sheets' xml and peak memory of each scenario and
+    per-call timings of R1C1-converter, optionally comparing them with baseline.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python run_benchmarks.py --save baseline.json
+           python run_benchmarks.py --baseline baseline.json
+    Notice: Each scenario runs in its own process, so its peak memory doesn't
+            include previous scenarios. Peak memory is measured on Unix only.
+"""
+from __future__ import print_function
+
+import argparse
+import json
+import os
+import shutil
+import sys
+import tempfile
+import time
+import timeit
+from multiprocessing import Process, Queue
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from parse_xlsx_xml import ParseXlsx
+from xlsx_generator import generate_workbook
+
+try:
+    import resource
+except ImportError:
+    resource = None
+
+# Name, generator settings, ParseXlsx options
+SCENARIOS = [
+    ('shared_strings', dict(sheets=2, rows=5000, cols=20), dict()),
+    ('inline_strings', dict(sheets=2, rows=5000, cols=20, inline=True), dict()),
+    ('formula_heavy', dict(sheets=1, rows=5000, cols=30, formula_density=0.8, format_density=0.8), dict()),
+    ('nan_heavy', dict(sheets=1, rows=5000, cols=20, nan_density=0.3), dict()),
+    ('clean_sheets', dict(sheets=2, rows=5000, cols=20, formula_density=0, nan_density=0), dict()),
+    ('streaming', dict(sheets=2, rows=5000, cols=20), dict(streaming=True)),
+    ('shared_formulas', dict(sheets=2, rows=5000, cols=20, formula_density=0.5),
+     dict(streaming=True, shared_formulas=True)),
+    ('print_view', dict(sheets=2, rows=5000, cols=20), dict(print_view=True, fix_area=[(1, 1)])),
+    ('workers', dict(sheets=4, rows=5000, cols=20), dict(workers=4)),
+    ('compress_threads', dict(sheets=2, rows=20000, cols=20), dict(compress_threads=4)),
+    ('compress_level_1', dict(sheets=2, rows=5000, cols=20), dict(compress_level=1)),
+]
+# Name, statement and setup of converter's micro-benchmarks
+MICRO_BENCHMARKS = [
+    ('convert_rc_formula', "convert_rc_formula('=SUM(R2C:R[-1]C)+RC[-1]', 'D15')",
+     'from xlsx_rc_convertor import convert_rc_formula'),
+    # Each formula's text is new, eg. '=R[-1]C+RC[-1]*7', so its template isn't cached
+    ('convert_rc_formula_uncached', "convert_rc_formula('=R[-1]C+RC[-1]*' + str(next(n)), 'D15')",
+     'from itertools import count; from xlsx_rc_convertor import convert_rc_formula; n = count()'),
+    ('col2str', 'col2str(16384, run=1)', 'from xlsx_rc_convertor import col2str'),
+    ('col2int', "col2int('XFD')", 'from xlsx_rc_convertor import col2int'),
+]
+# Relative change of metric reported as regression
+REGRESSION_THRESHOLD = 0.1
+
+
+def get_peak_memory():
+    """ Peak resident memory of current process in MB, None if it can't be measured """
+    if resource is None:
+        return None
+    peak = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss
+    # ru_maxrss is in bytes on macOS and in kilobytes on Linux
+    return peak / (1024.0 * 1024.0 if sys.platform == 'darwin' else 1024.0)
+
+
+def run_scenario(file_name, parse_options, repeat, results):
+    """ Parse copies of workbook, put best time and peak memory to results queue """
+    try:
+        work_file_name = file_name + '.work.xlsx'
+        times = []
+        for _ in range(repeat):
+            shutil.copy(file_name, work_file_name)
+            start = time.time()
+            ParseXlsx(work_file_name, run=True, **parse_options)
+            times.append(time.time() - start)
+        os.remove(work_file_name)
+        results.put((min(times), get_peak_memory(), None))
+    except Exception as e:
+        results.put((None, None, repr(e)))
+
+
+def bench_scenario(name, generator_settings, parse_options, temp_dir, scale, repeat):
+    """ Generate workbook and parse it in child process """
+    settings = dict(generator_settings)
+    settings['rows'] = max(int(settings['rows'] * scale), 2)
+    file_name = os.path.join(temp_dir, name + '.xlsx')
+    stats = generate_workbook(file_name, **settings)
+
+    results = Queue()
+    process = Process(target=run_scenario, args=(file_name, parse_options, repeat, results))
+    process.start()
+    elapsed, peak_memory, error = results.get()
+    process.join()
+    if error:
+        raise RuntimeError('Scenario {0} failed: {1}'.format(name, error))
+
+    return {
+        'seconds': elapsed,
+        'cells_per_second': stats['cells'] / elapsed,
+        'mb_per_second': stats['sheets_size'] / elapsed / 1024.0 / 1024.0,
+        'peak_memory_mb': peak_memory,
+        'cells': stats['cells'],
+        'file_size': stats['file_size'],
+    }
+
+
+def bench_micro(statement, setup, number):
+    """ Best time of one call in microseconds """
+    timer = timeit.Timer(statement, setup)
+    return min(timer.repeat(3, number)) / number * 1000000
+
+
+def compare(name, metric, value, baseline, higher_is_better):
+    """ Format change of metric against baseline """
+    base_value = baseline.get(name, {}).get(metric)
+    if not base_value or value is None:
+        return ''
+    change = (value - base_value) / float(base_value)
+    regression = -change if higher_is_better else change
+    mark = '  REGRESSION' if regression > REGRESSION_THRESHOLD else ''
+
+    return ' ({0:+.1f}%{1})'.format(change * 100, mark)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--scale', type=float, default=1.0, help='multiplier of scenarios rows')
+    parser.add_argument('--repeat', type=int, default=3, help='parse runs of each scenario, best is taken')
+    parser.add_argument('--number', type=int, default=10000, help='calls of each micro-benchmark')
+    parser.add_argument('--only', nargs='+', help='names of benchmarks to run')
+    parser.add_argument('--save', help='save results to json file')
+    parser.add_argument('--baseline', help='compare results with saved json file')
+    args = parser.parse_args()
+
+    baseline = {}
+    if args.baseline:
+        with open(args.baseline) as baseline_file:
+            baseline = json.load(baseline_file)
+
+    results = {}
+    temp_dir = tempfile.mkdtemp(prefix='xlsx_bench_')
+    try:
+        for name, generator_settings, parse_options in SCENARIOS:
+            if args.only and name not in args.only:
+                continue
+            result = bench_scenario(name, generator_settings, parse_options, temp_dir, args.scale, args.repeat)
+            results[name] = result
+            print('{0:<30} {1:>12,.0f} cells/s{2}  {3:>8.2f} MB/s{4}  {5:>8} MB peak{6}'.format(
+                name,
+                result['cells_per_second'],
+                compare(name, 'cells_per_second', result['cells_per_second'], baseline, True),
+                result['mb_per_second'],
+                compare(name, 'mb_per_second', result['mb_per_second'], baseline, True),
+                '-' if result['peak_memory_mb'] is None else '{0:.1f}'.format(result['peak_memory_mb']),
+                compare(name, 'peak_memory_mb', result['peak_memory_mb'], baseline, False),
+            ))
+    finally:
+        shutil.rmtree(temp_dir, ignore_errors=True)
+
+    for name, statement, setup in MICRO_BENCHMARKS:
+        if args.only and name not in args.only:
+            continue
+        call_time = bench_micro(statement, setup, args.number)
+        results[name] = {'us_per_call': call_time}
+        print('{0:<30} {1:>12.2f} us/call{2}'.format(
+            name, call_time, compare(name, 'us_per_call', call_time, baseline, False),
+        ))
+
+    if args.save:
+        with open(args.save, 'w') as save_file:
+            json.dump(results, save_file, indent=2, sort_keys=True)
+
+
+if __name__ == '__main__':
+    main()
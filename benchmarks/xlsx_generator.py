@@ -0,0 +1,223 @@
+# -*- coding: utf-8 -*-
+"""
+    Generator of synthetic xlsx-workbooks like ones exported by Reporting Services:
+    label and number cells with R1C1-formulae as strings, formats and NaN values.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python xlsx_generator.py out.xlsx --sheets 3 --rows 10000 --cols 20
+"""
+from __future__ import unicode_literals
+
+import argparse
+import os
+import random
+import sys
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, ZIP_DEFLATED
+
+sys.path.insert(0, os.path.join(os.path.dirname(os.path.abspath(__file__)), '..'))
+
+from xlsx_rc_convertor import col2str
+from xlsx_zip import ZipMemberWriter, new_zip_info
+
+NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_R = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+
+# Formulae like ones of SSRS reports, column's formula is the same in each row
+FORMULAS = [
+    '=R[-1]C+RC[-1]',
+    '=RC[-2]*RC[-1]',
+    '=SUM(R2C:R[-1]C)',
+    '=IF(RC[-1]>0;RC[-2]/RC[-1];0)',
+    '=ROUND(RC[-1]*100;2)',
+]
+# Formulae refer up to two columns left and to rows from the 2nd one to the previous one,
+# so they start at cell where all references are in sheet and don't refer to formula's cell
+FORMULA_FIRST_COL = 3
+FORMULA_FIRST_ROW = 3
+# Formats appended to formulae as '@format@'
+FORMATS = ['#,##0.00', '0.0%', '#,##0']
+
+DEFAULTS = dict(
+    sheets=1,
+    rows=1000,
+    cols=10,
+    formula_density=0.2,
+    format_density=0.5,
+    nan_density=0.01,
+    inline=False,
+    seed=0,
+)
+
+
+class SharedStrings(object):
+    """ sharedStrings.xml being collected while sheets are generated """
+
+    def __init__(self):
+        self.index = {}
+        self.strings = []
+        self.count = 0
+
+    def add(self, text):
+        """ Get string's index, adding it if it's new """
+        self.count += 1
+        if text not in self.index:
+            self.index[text] = len(self.strings)
+            self.strings.append(text)
+        return self.index[text]
+
+    def write(self, output_file):
+        """ Write sharedStrings.xml to file object """
+        output_file.write(XML_DECLARATION.encode('utf-8'))
+        output_file.write('<sst xmlns="{0}" count="{1}" uniqueCount="{2}">'.format(
+            NS, self.count, len(self.strings)).encode('utf-8'))
+        for text in self.strings:
+            output_file.write('<si><t>{0}</t></si>'.format(escape(text)).encode('utf-8'))
+        output_file.write(b'</sst>')
+
+
+def column_kinds(cols, formula_density, rnd):
+    """ Choose kind of each column: first column is label, others are numbers or formulae """
+    kinds = ['label']
+    for col in range(2, cols + 1):
+        kinds.append('formula' if col >= FORMULA_FIRST_COL and rnd.random() < formula_density else 'number')
+    return kinds
+
+
+def write_sheet(output_file, rows, kinds, formulas, shared_strings, settings, rnd):
+    """ Write sheetN.xml row by row to file object """
+    output_file.write(XML_DECLARATION.encode('utf-8'))
+    output_file.write((
+        '<worksheet xmlns="{0}" xmlns:r="{1}"><sheetPr/><dimension ref="A1:{2}{3}"/>'
+        '<sheetViews><sheetView workbookViewId="0"/></sheetViews>'
+        '<sheetFormatPr defaultRowHeight="15"/><sheetData>'
+    ).format(NS, NS_R, col2str(len(kinds), run=1), rows).encode('utf-8'))
+
+    for row in range(1, rows + 1):
+        cells = []
+        for col, kind in enumerate(kinds, 1):
+            ref = '{0}{1}'.format(col2str(col, run=1), row)
+            if kind == 'number' or row < FORMULA_FIRST_ROW and kind == 'formula':
+                if rnd.random() < settings['nan_density']:
+                    value = 'NaN'
+                else:
+                    value = '{0:.2f}'.format(rnd.random() * 1000)
+                cells.append('<c r="{0}" s="1"><v>{1}</v></c>'.format(ref, value))
+                continue
+
+            text = formulas[col] if kind == 'formula' else 'Label {0}-{1}'.format(row, col)
+            if settings['inline']:
+                cells.append('<c r="{0}" s="1" t="inlineStr"><is><t>{1}</t></is></c>'.format(ref, escape(text)))
+            else:
+                cells.append('<c r="{0}" s="1" t="s"><v>{1}</v></c>'.format(ref, shared_strings.add(text)))
+        output_file.write('<row r="{0}">{1}</row>'.format(row, ''.join(cells)).encode('utf-8'))
+
+    output_file.write((
+        '</sheetData><pageMargins left="0.7" right="0.7" top="0.75" bottom="0.75" header="0.3" footer="0.3"/>'
+        '<pageSetup orientation="portrait"/></worksheet>'
+    ).encode('utf-8'))
+
+
+def generate_workbook(file_name, **kwargs):
+    """ Generate xlsx-workbook, see DEFAULTS for settings. Returns dict of workbook's stats """
+    settings = dict(DEFAULTS, **kwargs)
+    rnd = random.Random(settings['seed'])
+    shared_strings = SharedStrings()
+    sheets = range(1, settings['sheets'] + 1)
+
+    with ZipFile(file_name, 'w', ZIP_DEFLATED) as output_zip:
+        output_zip.writestr('[Content_Types].xml', XML_DECLARATION + (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="rels" ContentType="application/vnd.openxmlformats-package.relationships+xml"/>'
+            '<Default Extension="xml" ContentType="application/xml"/>'
+            '<Override PartName="/xl/workbook.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sheet.main+xml"/>'
+            '<Override PartName="/xl/styles.xml" '
+            'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.styles+xml"/>'
+            '{0}{1}</Types>'
+        ).format(
+            ''.join(
+                '<Override PartName="/xl/worksheets/sheet{0}.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml"/>'.format(n)
+                for n in sheets
+            ),
+            '' if settings['inline'] else (
+                '<Override PartName="/xl/sharedStrings.xml" '
+                'ContentType="application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml"/>'
+            ),
+        ))
+        output_zip.writestr('_rels/.rels', XML_DECLARATION + (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '<Relationship Id="rId1" Type="{0}/officeDocument" Target="xl/workbook.xml"/></Relationships>'
+        ).format(NS_R))
+        output_zip.writestr('xl/workbook.xml', XML_DECLARATION + (
+            '<workbook xmlns="{0}" xmlns:r="{1}"><sheets>{2}</sheets></workbook>'
+        ).format(NS, NS_R, ''.join(
+            '<sheet name="Sheet{0}" sheetId="{0}" r:id="rId{0}"/>'.format(n) for n in sheets
+        )))
+        output_zip.writestr('xl/_rels/workbook.xml.rels', XML_DECLARATION + (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">'
+            '{0}<Relationship Id="rIdStyles" Type="{1}/styles" Target="styles.xml"/>{2}</Relationships>'
+        ).format(
+            ''.join(
+                '<Relationship Id="rId{0}" Type="{1}/worksheet" Target="worksheets/sheet{0}.xml"/>'.format(n, NS_R)
+                for n in sheets
+            ),
+            NS_R,
+            '' if settings['inline'] else
+            '<Relationship Id="rIdStrings" Type="{0}/sharedStrings" Target="sharedStrings.xml"/>'.format(NS_R),
+        ))
+        output_zip.writestr('xl/styles.xml', XML_DECLARATION + (
+            '<styleSheet xmlns="{0}"><numFmts count="1"><numFmt numFmtId="164" formatCode="0.00"/></numFmts>'
+            '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+            '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+            '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+            '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+            '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+            '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+            '</styleSheet>'
+        ).format(NS))
+
+        cells = 0
+        for n in sheets:
+            kinds = column_kinds(settings['cols'], settings['formula_density'], rnd)
+            formulas = {}
+            for col, kind in enumerate(kinds, 1):
+                if kind == 'formula':
+                    formula = rnd.choice(FORMULAS)
+                    if rnd.random() < settings['format_density']:
+                        formula += "@{0}@".format(rnd.choice(FORMATS))
+                    formulas[col] = formula
+            with ZipMemberWriter(output_zip, new_zip_info('xl/worksheets/sheet{0}.xml'.format(n))) as sheet_file:
+                write_sheet(sheet_file, settings['rows'], kinds, formulas, shared_strings, settings, rnd)
+            cells += settings['rows'] * len(kinds)
+
+        if not settings['inline']:
+            with ZipMemberWriter(output_zip, new_zip_info('xl/sharedStrings.xml')) as strings_file:
+                shared_strings.write(strings_file)
+
+        xml_size = sum(
+            info.file_size for info in output_zip.infolist() if info.filename.startswith('xl/worksheets/')
+        )
+
+    return dict(cells=cells, sheets_size=xml_size, file_size=os.path.getsize(file_name))
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('file_name')
+    parser.add_argument('--sheets', type=int, default=DEFAULTS['sheets'])
+    parser.add_argument('--rows', type=int, default=DEFAULTS['rows'])
+    parser.add_argument('--cols', type=int, default=DEFAULTS['cols'])
+    parser.add_argument('--formula-density', type=float, default=DEFAULTS['formula_density'])
+    parser.add_argument('--format-density', type=float, default=DEFAULTS['format_density'])
+    parser.add_argument('--nan-density', type=float, default=DEFAULTS['nan_density'])
+    parser.add_argument('--inline', action='store_true', help='use inlineStr instead of sharedStrings')
+    parser.add_argument('--seed', type=int, default=DEFAULTS['seed'])
+    args = vars(parser.parse_args())
+    file_name = args.pop('file_name')
+    print(generate_workbook(file_name, **args))
+
+
+if __name__ == '__main__':
+    main()
@@ -8,60 +8,138 @@
 """
 from __future__ import unicode_literals
 
-import sys
 import os
-import shutil
+import pickle
 import time
 import re
+import uuid
+import zlib
+from bisect import bisect_left
+from multiprocessing import Pool
+from multiprocessing.pool import ThreadPool
+from tempfile import SpooledTemporaryFile
 from zipfile import ZipFile, ZIP_DEFLATED
 from lxml import etree
-from copy import deepcopy
-
-from xlsx_rc_convertor import convert_rc_formula, get_cell_format, col2str
-
-
-class RecursiveFileIterator:
-    def __init__(self, *root_dirs):
-        self.dir_queue = list(root_dirs)
-        self.include_dirs = None
-        self.file_queue = []
-
-    def __getitem__(self, index):
-        while not len(self.file_queue):
-            self.next_dir()
-        result = self.file_queue[0]
-        del self.file_queue[0]
-        return result
-
-    def next_dir(self):
-        dir = self.dir_queue[0]  # fails with IndexError, which is fine
-        # for iterator interface
-        del self.dir_queue[0]
-        list = os.listdir(dir)
-        join = os.path.join
-        isdir = os.path.isdir
-
-        for basename in list:
-            full_path = join(dir, basename)
-            if isdir(full_path):
-                self.dir_queue.append(full_path)
-                if self.include_dirs:
-                    self.file_queue.append(full_path)
-            else:
-                self.file_queue.append(full_path)
+
+from report_metrics import Metrics
+from xlsx_evaluator import SheetEvaluator, CellError, UNKNOWN_TEXT
+from xlsx_rc_convertor import convert_rc_formula, clean_rc_formula, get_cell_format, col2str, split_address
+from xlsx_styles import StyleRegistry, StyleMapping
+from xlsx_styles_cache import StylesCache, CachedStyles
+from xlsx_transforms import Cell, DEFAULT_TRANSFORMS, apply_format, convert_formula, fix_nan
+from xlsx_zip import ZipMemberWriter, MemberCompressor, CompressionPolicy, copy_zip_member, write_compressed_member
+
+SHARED_STRINGS_FILE = 'xl/sharedStrings.xml'
+STYLES_FILE = 'xl/styles.xml'
+# Parsed workbooks up to this size are spooled in memory, larger ones in temp file
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+# Pre-scan of sheets: size of chunk and byte patterns of NaN value, inline formula string
+# and index of shared string's cell
+PRESCAN_CHUNK_SIZE = 1024 * 1024
+NAN_VALUE = b'>NaN<'
+INLINE_FORMULA = b'>='
+SHARED_STRING_CELL_RE = re.compile(br'<c\s([^>]*)>\s*<v>(\d+)</v>')
+SHARED_STRING_TYPE_RE = re.compile(br'\bt\s*=\s*["\']s["\']')
+
+
+class SharedFormulaRuns(object):
+    """
+        Runs of cells in a column with the same R1C1 formula in adjacent rows.
+        Each run is written as Excel's shared formula: first cell of run keeps
+        the formula with range of run, other cells only refer to it.
+    """
+
+    def __init__(self):
+        # (row, col) of first cell -> (si, ref, last row)
+        self.masters = {}
+        # col -> [formula, first row, last row] of run being collected
+        self.open_runs = {}
+        # col -> (si, last row) of run being written
+        self.active_runs = {}
+
+    def add(self, address, formula):
+        """ Collect formula cell, cells have to be added in sheet's order """
+        row, col = split_address(address)
+        run = self.open_runs.get(col)
+        if run and run[0] == formula and run[2] == row - 1:
+            run[2] = row
+        else:
+            self.close_run(col)
+            self.open_runs[col] = [formula, row, row]
+
+    def close(self):
+        """ Finish collecting of runs """
+        for col in sorted(self.open_runs):
+            self.close_run(col)
+
+    def close_run(self, col):
+        """ Save collected run of column if it has more than one cell """
+        run = self.open_runs.pop(col, None)
+        if run and run[2] > run[1]:
+            ref = '{0}{1}:{0}{2}'.format(col2str(col, run=1), run[1], run[2])
+            self.masters[(run[1], col)] = (str(len(self.masters)), ref, run[2])
+
+    def get(self, address):
+        """
+            Get (si, ref) for first cell of run, (si, None) for other cells of run and
+            None for cells out of runs. Cells have to be requested in sheet's order.
+        """
+        row, col = split_address(address)
+        master = self.masters.get((row, col))
+        if master:
+            self.active_runs[col] = (master[0], master[2])
+            return master[0], master[1]
+        active_run = self.active_runs.get(col)
+        if active_run and row <= active_run[1]:
+            return active_run[0], None
+
+        return None
 
 
 class ParseXlsx:
     """ Parse xlsx file and replace formulas strings to formulas format """
 
     def __init__(self, file_name, task_id=0, show_log=False, run=False, **kwargs):
-        """ Init start parameters """
+        """
+            Init start parameters. file_name is name of xlsx file or seekable file object,
+            eg. SSRSReport.spool_file(). Parsed workbook replaces file_name's file, unless
+            output_file (file name or file object) is set. For file object without
+            output_file parsed workbook is written to spooled temp file in self.output_file.
+            Timings of phases and counters are recorded to metrics (report_metrics.Metrics),
+            with show_log they're printed. transforms are applied to each cell of sheets,
+            see xlsx_transforms. compress_level is deflate level of output workbook and
+            with compress_threads > 1 large members are compressed on thread pool.
+            With styles_cache_dir rewritten styles.xml is cached across runs, see xlsx_styles_cache.
+            With evaluate_formulas converted formulas get cached values, see xlsx_evaluator.
+        """
         self.file_name = file_name
+        self.output_file = kwargs.get('output_file')
+        # Each run of file object without output_file is written to new spooled file
+        self.spool_output = self.output_file is None and hasattr(file_name, 'read')
         self.task_id = task_id
-        self.main_temp_dir = 'temp'
         self.show_log = show_log
-        self.shared_strings = []
-        self.style_list = None
+        self.metrics = kwargs.get('metrics') or Metrics(self.log_metric if show_log else None)
+        self.reset()
+        # Process sheets row by row instead of loading whole sheet's tree
+        self.streaming = kwargs.get('streaming', False)
+        # Write formulas repeated in adjacent rows of column as shared formulas
+        self.shared_formulas = kwargs.get('shared_formulas', False)
+        # Write values of supported formulas, so readers don't have to recalculate workbook
+        self.evaluate_formulas = kwargs.get('evaluate_formulas', False)
+        # Number of processes to parse sheets in parallel
+        self.workers = int(kwargs.get('workers', 1))
+        # Transforms applied to each cell in order
+        self.transforms = list(kwargs.get('transforms', DEFAULT_TRANSFORMS))
+        # Copy sheets without NaN values and formula strings as is, see sheet_needs_parsing
+        self.prescan = kwargs.get('prescan', True)
+        # Deflate level and number of threads compressing large members of output workbook
+        self.compression = CompressionPolicy(
+            level=int(kwargs.get('compress_level', zlib.Z_DEFAULT_COMPRESSION)),
+            threads=int(kwargs.get('compress_threads', 1)),
+        )
+        # Cache of rewritten styles.xml, keyed by original styles.xml and formats set in it
+        styles_cache_dir = kwargs.get('styles_cache_dir')
+        self.styles_cache = StylesCache(styles_cache_dir) if styles_cache_dir else None
 
         # Print view params
         self.print_view = kwargs.get('print_view')
@@ -73,134 +151,635 @@ class ParseXlsx:
         if run:
             self.main()
 
+    def reset(self):
+        """ Clear state of previous run, so parser can be run again """
+        # Number of strings in sharedStrings.xml, 0 for workbooks with inlineStr
+        self.shared_strings_count = 0
+        # Index of shared string -> its text, for formula strings only
+        self.formula_strings = {}
+        # Texts of all shared strings, loaded for export only, see xlsx_export
+        self.shared_strings = None
+        # Sorted indexes of formula strings which are replaced by formulas and pruned
+        self.removed_strings = []
+        # Number of cells which referred to pruned strings
+        self.removed_strings_refs = 0
+        self.styles = None
+        self.formula_runs = None
+        # SheetEvaluator of sheet being parsed
+        self.formula_values = None
+        # Workbook being rebuilt, styles.xml is loaded from it on first use
+        self.source_zip = None
+        self.compress_pool = None
+
     def main(self):
-        """ Read xlsx file, extract files from it and parse each sheet """
-        if not os.path.exists(self.file_name):
+        """
+            Read xlsx file and write its members to new xlsx file, parsing each sheet on the way.
+            Parser doesn't change process-wide state, so parsers of different workbooks
+            can be run by concurrent threads. Single parser isn't shared by threads.
+        """
+        source_is_file = hasattr(self.file_name, 'read')
+        if not source_is_file and not os.path.exists(self.file_name):
             print('Source file not found. Exit.')
         else:
-            if not os.path.isdir(self.main_temp_dir):
-                self.print_log('Creating temp directory')
-                os.mkdir(os.path.join(os.getcwd(), self.main_temp_dir))
-            os.chdir(self.main_temp_dir)
-            # Create temp dir
-            temp_dir = str(self.task_id) + str(time.time())
-            os.mkdir(os.path.join(os.getcwd(), temp_dir))
-            os.chdir(temp_dir)
-            # Extract xlsx and process it
-            zip_file_name = os.path.join("../" * 2, self.file_name)
-            with ZipFile(zip_file_name, 'a', ZIP_DEFLATED) as report_zip:
-                report_zip.extractall(os.getcwd())
-                # Check if file generated with sharedString or with inlineStr
-                if os.path.isfile('xl/sharedStrings.xml'):
-                    self.print_log('Found sharedStrings')
-                    # Extract all strings from sharedStrings.xml
-                    shared_string_xml_object = etree.parse('xl/sharedStrings.xml')
-                    si_tags = shared_string_xml_object.getroot().xpath("//*[local-name()='sst']/*[local-name()='si']")
-                    for si_tag in si_tags:
-                        t_tag = si_tag.xpath("*[local-name()='t']")
-                        if not t_tag:
-                            self.shared_strings.append(None)
-                        else:
-                            self.shared_strings.append(t_tag[0].text)
-                else:
-                    self.print_log('sharedStrings not found')
-                # Process each sheet
-                for sheet_file_name in report_zip.namelist():
-                    if 'xl/worksheets/sheet' in sheet_file_name:
-                        self.parse_sheet(sheet_file_name)
-
-            self.print_log('Deleting source file')
-            os.stat(zip_file_name)
-            os.remove(zip_file_name)
-            with ZipFile(zip_file_name, "w") as cur_file:
-                for name in RecursiveFileIterator('.'):
-                    self.print_log('Writing to new Excel file. File -> {0}'.format(name))
-                    if os.path.isfile(name):
-                        cur_file.write(name, name, ZIP_DEFLATED)
-
-            os.chdir('..')
-            self.print_log('Removing temp files')
-            shutil.rmtree(os.path.join(os.getcwd(), temp_dir))
-            # Return to script's work directory
-            os.chdir(sys.path[0])
+            self.reset()
+            if self.spool_output:
+                # File object has no name to be replaced, so result is spooled
+                self.output_file = SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE)
+            output_file = self.output_file if self.output_file is not None else self.file_name
+
+            temp_file_name = None
+            if not hasattr(output_file, 'write'):
+                # New workbook is written next to the output one and replaces it at the end,
+                # temp file's name is unique, so threads don't clash
+                temp_file_name = '{0}.{1}.{2}.tmp'.format(output_file, self.task_id, uuid.uuid4().hex)
+            start = time.time()
+            if self.compression.threads > 1:
+                self.compress_pool = ThreadPool(self.compression.threads)
+            try:
+                with self.metrics.timer('extract'):
+                    # Only archive's directory is read, members are extracted while they're parsed
+                    source_zip = ZipFile(self.file_name, 'r')
+                with source_zip:
+                    with ZipFile(temp_file_name or output_file, 'w', ZIP_DEFLATED,
+                                 allowZip64=self.compression.allow_zip64) as output_zip:
+                        self.rebuild_workbook(source_zip, output_zip)
+            except Exception:
+                if temp_file_name and os.path.exists(temp_file_name):
+                    os.remove(temp_file_name)
+                raise
+            finally:
+                if self.compress_pool:
+                    self.compress_pool.terminate()
+                    self.compress_pool.join()
+                    self.compress_pool = None
+
+            if temp_file_name:
+                self.print_log('Replacing output file')
+                if os.path.exists(output_file):
+                    os.remove(output_file)
+                os.rename(temp_file_name, output_file)
+            else:
+                output_file.seek(0)
+            self.metrics.timing('total', time.time() - start)
+            self.metrics.flush()
             self.print_log('Done')
 
-    def parse_sheet(self, sheet_file_name):
-        """ Parse sheet and  replace formulas strings to formulas format """
-        styles_file = 'xl/styles.xml'
-        self.style_list = etree.parse(styles_file)
-        sheet_xml_object = etree.parse(sheet_file_name)
-        # Removing NaN values
-        v_nan_tags = sheet_xml_object.getroot().xpath(
-            "//*[local-name()='c']/*[local-name()='v' and text()='NaN']"
-        )
-        for v_nan_tag in v_nan_tags:
-            c_nan_tag = v_nan_tag.xpath("ancestor::*[local-name()='c']")
-            self.print_log("Found NaN value in cell {0}".format(c_nan_tag[0].get("r")))
-            v_nan_tag.text = "0"
-
-        # If not found sharedStrings, then looking for inlineStr c tags
-        if not len(self.shared_strings):
-            c_tags = sheet_xml_object.getroot().xpath(
-                "//*[local-name()='sheetData']/*[local-name()='row']/*[local-name()='c'][@t='inlineStr']"
-            )
-            for c_tag in c_tags:
-                is_tag = c_tag.xpath("*[local-name()='is']")
-                t_tag = c_tag.xpath("*[local-name()='is']/*[local-name()='t']")
-                if len(t_tag):
-                    cur_inline_string = t_tag[0].text
-                    if cur_inline_string and cur_inline_string[0] == '=':
-                        self.print_log(
-                            'Found formula -> {0} in row {1}'.format(cur_inline_string, c_tag.get('r'))
+    def register_transform(self, transform, index=None):
+        """ Add cell's transform, after built-in ones if index isn't set """
+        if index is None:
+            self.transforms.append(transform)
+        else:
+            self.transforms.insert(index, transform)
+
+    def rebuild_workbook(self, source_zip, output_zip):
+        """ Write members of source_zip to output_zip, parsing sheets """
+        # Check if file generated with sharedString or with inlineStr
+        if SHARED_STRINGS_FILE in source_zip.NameToInfo:
+            self.print_log('Found sharedStrings')
+            with self.metrics.timer('load_shared_strings'):
+                self.load_shared_strings(source_zip)
+            self.metrics.count('shared_strings', self.shared_strings_count)
+        else:
+            self.print_log('sharedStrings not found')
+        self.source_zip = source_zip
+        self.styles = None
+        rezip_time = 0
+
+        sheet_file_names = [name for name in source_zip.namelist() if 'xl/worksheets/sheet' in name]
+        with self.metrics.timer('prescan'):
+            sheet_file_names = [name for name in sheet_file_names if self.sheet_needs_parsing(source_zip, name)]
+        self.metrics.count('sheets_parsed', len(sheet_file_names))
+        # Workers open workbook by its name, file objects are parsed serially
+        pool = None
+        if self.workers > 1 and len(sheet_file_names) > 1 and not hasattr(self.file_name, 'read'):
+            pool = Pool(self.workers)
+        try:
+            if pool or self.styles_cache is not None:
+                self.collect_styles(sheet_file_names, pool)
+            parsed_sheets = self.parse_sheets_parallel(sheet_file_names, pool) if pool else None
+            # Process each sheet and copy other files as is
+            for zip_info in source_zip.infolist():
+                if zip_info.filename in sheet_file_names:
+                    self.print_log('Parsing sheet -> {0}'.format(zip_info.filename))
+                    if parsed_sheets:
+                        output_file, removed_strings_refs, sheet_metrics = next(parsed_sheets)
+                        self.removed_strings_refs += removed_strings_refs
+                        self.metrics.merge(sheet_metrics)
+                        write_compressed_member(
+                            output_zip, self.compression.zip_info(zip_info.filename, zip_info), output_file
                         )
-                        right_formula = convert_rc_formula(cur_inline_string[1:], c_tag.get('r'))
-                        if right_formula:
-                            c_tag.remove(is_tag[0])
-                            # Generate formula
-                            self.gen_formula_tag(c_tag, right_formula)
-                        # Set format to formula's cell
-                        if '@' in cur_inline_string[1:]:
-                            c_tag.attrib['s'] = self.set_format(c_tag.get('s'), get_cell_format(cur_inline_string[1:]))
+                    else:
+                        with self.metrics.timer('parse_sheet', sheet=zip_info.filename):
+                            with self.open_member(output_zip, zip_info.filename, zip_info) as output_file:
+                                self.parse_sheet(zip_info.filename, source_zip, output_file)
+                elif zip_info.filename not in (STYLES_FILE, SHARED_STRINGS_FILE):
+                    start = time.time()
+                    copy_zip_member(source_zip, zip_info, output_zip)
+                    rezip_time += time.time() - start
+        finally:
+            self.source_zip = None
+            if pool:
+                pool.terminate()
+                pool.join()
+        self.metrics.timing('rezip', rezip_time)
+
+        # Save sharedStrings.xml without strings replaced by formulas
+        if self.shared_strings_count:
+            with self.metrics.timer('save_shared_strings'):
+                self.save_shared_strings(source_zip, output_zip)
+            self.metrics.count('shared_strings_pruned', len(self.removed_strings))
+
+        # Save changes in styles.xml, it's copied as is if no format was set
+        if self.styles is not None:
+            self.metrics.count('styles_added', self.styles.added_count)
+            if self.styles_cache is not None:
+                self.metrics.count('styles_cache_hits' if self.styles.is_cached else 'styles_cache_misses')
+            with self.metrics.timer('save_styles'):
+                with self.open_member(output_zip, STYLES_FILE, source_zip.getinfo(STYLES_FILE)) as output_file:
+                    output_file.write(self.styles.tostring())
+        elif STYLES_FILE in source_zip.NameToInfo:
+            copy_zip_member(source_zip, source_zip.getinfo(STYLES_FILE), output_zip)
+
+    def sheet_needs_parsing(self, source_zip, sheet_file_name):
+        """
+            Pre-scan sheet's bytes for NaN values, inline formula strings and cells
+            referring to formula or renumbered shared strings. Sheets without them
+            are copied to output as is. Sheets with print view or fixed area and
+            sheets of parsers with custom transforms are always parsed.
+        """
+        if not self.prescan or self.transforms != list(DEFAULT_TRANSFORMS) or self.print_view or \
+                self.get_sheet_number(sheet_file_name) <= len(self.fix_area):
+            return True
+
+        # Indexes of shared strings from the first pruned one are changed
+        first_changed_index = self.removed_strings[0] if self.removed_strings else None
+        with source_zip.open(sheet_file_name) as source_file:
+            data = source_file.read(PRESCAN_CHUNK_SIZE)
+            if b'<worksheet' not in data[:1024]:
+                # Tags with namespace prefixes aren't recognized by byte patterns
+                return True
+            while data:
+                if NAN_VALUE in data:
+                    return True
+                if not self.shared_strings_count:
+                    if INLINE_FORMULA in data:
+                        return True
+                else:
+                    for attributes, index in SHARED_STRING_CELL_RE.findall(data):
+                        if SHARED_STRING_TYPE_RE.search(attributes):
+                            index = int(index)
+                            if index in self.formula_strings or \
+                                    first_changed_index is not None and index >= first_changed_index:
+                                return True
+                # Last cell may be cut by chunk's end, so it's scanned again with the next chunk
+                chunk = source_file.read(PRESCAN_CHUNK_SIZE)
+                if not chunk:
+                    break
+                cut = data.rfind(b'<c')
+                data = (data[cut:] if cut >= 0 else data[-len(NAN_VALUE):]) + chunk
+
+        return False
+
+    def get_styles(self):
+        """ Workbook's styles, styles.xml is loaded on first use """
+        if self.styles is None:
+            with self.metrics.timer('load_styles'):
+                with self.source_zip.open(STYLES_FILE) as styles_file:
+                    if self.styles_cache is not None:
+                        self.styles = CachedStyles(self.styles_cache, styles_file.read())
+                    else:
+                        self.styles = StyleRegistry(styles_file)
+
+        return self.styles
+
+    def collect_styles(self, sheet_file_names, pool=None):
+        """
+            Add formats of sheets' formula cells to styles before sheets are parsed, in the
+            same order as serial parsing does, so styles.xml doesn't depend on number of
+            workers. Styles cache's entry is looked up by the whole list of formats.
+        """
+        if apply_format not in self.transforms or \
+                self.shared_strings_count and not any('@' in text for text in self.formula_strings.values()):
+            return
+        with self.metrics.timer('collect_formats'):
+            if pool:
+                jobs = [(self, sheet_file_name) for sheet_file_name in sheet_file_names]
+                sheets_formats = pool.imap(collect_sheet_formats_job, jobs)
+            else:
+                sheets_formats = (self.collect_sheet_formats(sheet_file_name) for sheet_file_name in sheet_file_names)
+            formats = [sheet_format for sheet_formats in sheets_formats for sheet_format in sheet_formats]
+        if not formats:
+            return
+
+        if self.styles_cache is not None:
+            with self.metrics.timer('load_styles'):
+                with self.source_zip.open(STYLES_FILE) as styles_file:
+                    self.styles = CachedStyles(self.styles_cache, styles_file.read(), formats)
         else:
-            c_tags = sheet_xml_object.getroot().xpath(
-                "//*[local-name()='sheetData']/*[local-name()='row']/*[local-name()='c'][@t='s']"
+            for style_id, new_format in formats:
+                self.get_styles().get_style(style_id, new_format)
+
+    def collect_sheet_formats(self, sheet_file_name):
+        """ Get (style_id, format) of formula cells of workbook's sheet, see collect_formats """
+        with self.source_zip.open(sheet_file_name) as source_file:
+            return self.collect_formats(self.iter_sheet_cells(source_file))
+
+    def parse_sheets_parallel(self, sheet_file_names, pool):
+        """
+            Parse sheets in process pool. Returns iterator over (compressed sheet,
+            number of pruned strings refs, sheet's metrics) in order of sheet_file_names.
+        """
+        style_mapping = StyleMapping(self.styles.added_styles if self.styles is not None else {})
+        jobs = [(self, sheet_file_name, style_mapping) for sheet_file_name in sheet_file_names]
+
+        return pool.imap(parse_sheet_job, jobs)
+
+    def __getstate__(self):
+        """ Parser is passed to process pool's workers without workbook's styles and metrics """
+        state = self.__dict__.copy()
+        state['styles'] = None
+        state['source_zip'] = None
+        state['metrics'] = Metrics()
+        state['compress_pool'] = None
+
+        return state
+
+    def open_member(self, output_zip, file_name, source_info=None):
+        """ Open new member of output workbook for writing, compressed by parser's compression policy """
+        return ZipMemberWriter(
+            output_zip,
+            self.compression.zip_info(file_name, source_info),
+            self.compression.level,
+            self.compress_pool,
+            self.compression.block_size,
+            self.compression.zip64(source_info),
+        )
+
+    def load_shared_strings(self, source_zip, keep_texts=False):
+        """
+            Index formula strings of sharedStrings.xml, other strings are only counted.
+            With keep_texts texts of all strings are kept in shared_strings.
+        """
+        if keep_texts:
+            self.shared_strings = []
+        with source_zip.open(SHARED_STRINGS_FILE) as source_file:
+            for event, si_tag in etree.iterparse(source_file, tag='{*}si'):
+                ns = si_tag.tag[:-2]
+                t_tag = si_tag.find(ns + 't')
+                if t_tag is not None and t_tag.text and t_tag.text[0] == '=':
+                    self.formula_strings[self.shared_strings_count] = t_tag.text
+                if keep_texts:
+                    if t_tag is not None:
+                        self.shared_strings.append(t_tag.text or '')
+                    else:
+                        # Rich text is split to runs
+                        self.shared_strings.append(''.join(t.text or '' for t in si_tag.iterfind(ns + 'r/' + ns + 't')))
+                self.shared_strings_count += 1
+                si_tag.clear()
+                while si_tag.getprevious() is not None:
+                    del si_tag.getparent()[0]
+
+        # Strings of formulas which are converted aren't referred after conversion,
+        # cells are renumbered by convert_formula, so without it strings are kept
+        if convert_formula in self.transforms:
+            self.removed_strings = sorted(
+                index for index, text in self.formula_strings.items() if clean_rc_formula(text[1:])
             )
-            for c_tag in c_tags:
-                v_tag = c_tag.xpath("*[local-name()='v']")
-                if self.shared_strings[int(v_tag[0].text)]:
-                    cur_shared_string = self.shared_strings[int(v_tag[0].text)]
-                    if cur_shared_string[0] == '=':
-                        self.print_log(
-                            'Found formula -> {0} in row {1}'.format(cur_shared_string, c_tag.get('r'))
-                        )
-                        right_formula = convert_rc_formula(cur_shared_string[1:], c_tag.get('r'))
-                        if right_formula:
-                            c_tag.remove(v_tag[0])
-                            # Generate formula
-                            self.gen_formula_tag(c_tag, right_formula)
-                        # Set format to formula's cell
-                        if '@' in cur_shared_string[1:]:
-                            c_tag.attrib['s'] = self.set_format(c_tag.get('s'), get_cell_format(cur_shared_string[1:]))
-
-        # Save changes in styles.xml
-        self.save_xml_to_file(self.style_list, styles_file)
+
+    def save_shared_strings(self, source_zip, output_zip):
+        """ Write sharedStrings.xml without pruned strings """
+        source_info = source_zip.getinfo(SHARED_STRINGS_FILE)
+        if not self.removed_strings:
+            return copy_zip_member(source_zip, source_info, output_zip)
+
+        removed_strings = set(self.removed_strings)
+        with source_zip.open(SHARED_STRINGS_FILE) as source_file:
+            with self.open_member(output_zip, SHARED_STRINGS_FILE, source_info) as output_file:
+                with etree.xmlfile(output_file, encoding='UTF-8') as xml_file:
+                    xml_file.write_declaration(standalone=True)
+                    root = None
+                    root_writer = None
+                    index = 0
+                    for event, elem in etree.iterparse(source_file, events=('start', 'end')):
+                        if root is None:
+                            root = elem
+                            attrib = dict(root.attrib)
+                            unique_count = self.shared_strings_count - len(self.removed_strings)
+                            if 'count' in attrib:
+                                attrib['count'] = str(max(int(attrib['count']) - self.removed_strings_refs, unique_count))
+                            attrib['uniqueCount'] = str(unique_count)
+                            root_writer = xml_file.element(root.tag, attrib, nsmap=root.nsmap)
+                            root_writer.__enter__()
+                        elif event == 'end' and elem.getparent() is root:
+                            if index not in removed_strings:
+                                self.write_element(xml_file, elem)
+                            index += 1
+                            elem.clear()
+                            while elem.getprevious() is not None:
+                                del root[0]
+                    root_writer.__exit__(None, None, None)
+
+    def parse_sheet(self, sheet_file_name, source_zip, output_file):
+        """ Parse sheet and  replace formulas strings to formulas format, writing it to output_file """
+        if self.streaming:
+            return self.parse_sheet_stream(sheet_file_name, source_zip, output_file)
+
+        sheet_xml_object = etree.parse(source_zip.open(sheet_file_name))
+        root = sheet_xml_object.getroot()
+        ns = self.get_namespace(root)
+        sheet_data = root.find(ns + 'sheetData')
+        if sheet_data is not None:
+            if self.shared_formulas:
+                self.formula_runs = self.plan_shared_formulas(sheet_data.iter(ns + 'c'))
+            if self.evaluate_formulas:
+                self.formula_values = self.evaluate_sheet(sheet_data.iter(ns + 'c'), sheet_file_name)
+            # Transform each cell in one pass
+            cell = Cell(ns)
+            for row in sheet_data.iterchildren(ns + 'row'):
+                for c_tag in row.iterchildren(ns + 'c'):
+                    self.transform_cell(cell.reset(c_tag))
 
         # Set sheet styles
-        sh_num = int(re.compile(r'\d+').findall(sheet_file_name)[-1])
+        sh_num = self.get_sheet_number(sheet_file_name)
         if self.print_view:
             sheet_xml_object = self.set_print_view(sheet_xml_object)
         if sh_num <= len(self.fix_area):
             sheet_xml_object = self.set_fixed_area(sheet_xml_object, int(self.fix_area[sh_num-1][0]), int(self.fix_area[sh_num-1][1]))
 
         # Save changes in sheetN.xml
-        self.save_xml_to_file(sheet_xml_object, sheet_file_name)
+        with self.metrics.timer('serialize', sheet=sheet_file_name):
+            output_file.write(etree.tostring(sheet_xml_object, xml_declaration=True, encoding='UTF-8', standalone=True))
+
+    def parse_sheet_stream(self, sheet_file_name, source_zip, output_file):
+        """ Parse sheet row by row, writing converted rows to output_file as they are read """
+        sh_num = self.get_sheet_number(sheet_file_name)
+        fixed_area = None
+        if sh_num <= len(self.fix_area):
+            fixed_area = (int(self.fix_area[sh_num-1][0]), int(self.fix_area[sh_num-1][1]))
+
+        if self.shared_formulas:
+            # Runs of formulas have to be known before their first cells are written
+            with source_zip.open(sheet_file_name) as source_file:
+                self.formula_runs = self.plan_shared_formulas(self.iter_sheet_cells(source_file))
+        if self.evaluate_formulas:
+            # Formulas may refer to cells of next rows, so values are evaluated before sheet is written
+            with source_zip.open(sheet_file_name) as source_file:
+                self.formula_values = self.evaluate_sheet(self.iter_sheet_cells(source_file), sheet_file_name)
+
+        with source_zip.open(sheet_file_name) as source_file:
+            self.stream_sheet(source_file, output_file, fixed_area)
+
+    def stream_sheet(self, source_file, output_file, fixed_area=None):
+        """
+            Convert sheet from source_file to output_file with iterparse.
+            Only the current row (and small tags around sheetData) is kept in memory.
+        """
+        root = None
+        root_writer = None
+        sheet_data_writer = None
+        seen_tags = set()
+        with etree.xmlfile(output_file, encoding='UTF-8') as xml_file:
+            xml_file.write_declaration(standalone=True)
+            for event, elem in etree.iterparse(source_file, events=('start', 'end')):
+                if root is None:
+                    # Open worksheet tag with source namespaces
+                    root = elem
+                    ns = self.get_namespace(root)
+                    tag = lambda name: ns + name
+                    cell = Cell(ns)
+                    root_writer = xml_file.element(root.tag, root.attrib, nsmap=root.nsmap)
+                    root_writer.__enter__()
+                    continue
+
+                parent = elem.getparent()
+                if event == 'start':
+                    if parent is root:
+                        # Insert tags which set_print_view and set_fixed_area would create
+                        if self.print_view and not seen_tags and elem.tag != tag('sheetPr'):
+                            sheet_pr = etree.Element(tag('sheetPr'))
+                            self.add_fit_to_page(sheet_pr)
+                            self.write_element(xml_file, sheet_pr)
+                        if fixed_area and tag('sheetViews') not in seen_tags and \
+                                elem.tag not in (tag('sheetPr'), tag('dimension'), tag('sheetViews')):
+                            sheet_views = etree.Element(tag('sheetViews'))
+                            self.add_fixed_pane(sheet_views, *fixed_area)
+                            self.write_element(xml_file, sheet_views)
+                            seen_tags.add(sheet_views.tag)
+                        seen_tags.add(elem.tag)
+                        if elem.tag == tag('sheetData'):
+                            sheet_data_writer = xml_file.element(elem.tag, elem.attrib)
+                            sheet_data_writer.__enter__()
+                    continue
+
+                if parent is root:
+                    if elem.tag == tag('sheetData'):
+                        sheet_data_writer.__exit__(None, None, None)
+                    else:
+                        if elem.tag == tag('sheetPr') and self.print_view:
+                            self.add_fit_to_page(elem)
+                        elif elem.tag == tag('sheetViews') and fixed_area:
+                            self.add_fixed_pane(elem, *fixed_area)
+                        elif elem.tag == tag('pageSetup') and self.print_view:
+                            self.set_page_setup(elem)
+                        self.write_element(xml_file, elem)
+                elif elem.tag == tag('row') and parent.tag == tag('sheetData'):
+                    for c_tag in elem.iterchildren(tag('c')):
+                        self.transform_cell(cell.reset(c_tag))
+                    self.write_element(xml_file, elem)
+                else:
+                    continue
+
+                # Free already written tags
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del parent[0]
+
+            root_writer.__exit__(None, None, None)
+
+    def transform_cell(self, cell):
+        """ Apply transforms to a single cell """
+        for transform in self.transforms:
+            transform(self, cell)
+
+    def convert_cell(self, cell):
+        """ Renumber cell's shared string and convert it if it's a formula, see xlsx_transforms.convert_formula """
+        c_tag = cell.tag
+        # If not found sharedStrings, then looking for inlineStr c tags
+        if not self.shared_strings_count:
+            value_tag, cur_string = self.get_cell_string(c_tag)
+        elif c_tag.get('t') == 's':
+            value_tag = cell.find('v')
+            cur_string = self.renumber_shared_string(value_tag) if value_tag is not None else None
+        else:
+            return
+
+        if cur_string and cur_string[0] == '=':
+            cell.formula = cur_string
+            self.parse_formula_cell(c_tag, value_tag, cur_string)
+
+    def renumber_shared_string(self, v_tag):
+        """ Renumber shared string's index after pruning, returns string if it's a formula """
+        index = int(v_tag.text)
+        if self.removed_strings:
+            position = bisect_left(self.removed_strings, index)
+            if position < len(self.removed_strings) and self.removed_strings[position] == index:
+                self.removed_strings_refs += 1
+            else:
+                v_tag.text = str(index - position)
+
+        return self.formula_strings.get(index)
+
+    def get_cell_string(self, c_tag):
+        """
+            Get cell's string value and tag holding it: inlineStr if sharedStrings
+            not found, shared string otherwise. Only formula strings are known
+            for shared strings, None is returned for text of other ones.
+            Returns (None, None) for cells without string.
+        """
+        ns = c_tag.tag[:-1]
+        # If not found sharedStrings, then looking for inlineStr c tags
+        if not self.shared_strings_count:
+            if c_tag.get('t') == 'inlineStr':
+                is_tag = c_tag.find(ns + 'is')
+                t_tag = is_tag.find(ns + 't') if is_tag is not None else None
+                if t_tag is not None:
+                    return is_tag, t_tag.text
+        elif c_tag.get('t') == 's':
+            v_tag = c_tag.find(ns + 'v')
+            if v_tag is not None:
+                return v_tag, self.formula_strings.get(int(v_tag.text))
+
+        return None, None
+
+    def parse_formula_cell(self, c_tag, value_tag, cur_string):
+        """ Replace cell's value tag by formula tag if cell's string is a formula """
+        if cur_string and cur_string[0] == '=':
+            self.metrics.count('formulas_converted')
+            shared = self.formula_runs.get(c_tag.get('r')) if self.formula_runs else None
+            if shared and shared[1] is None:
+                # Formula is written in first cell of shared formula's run
+                c_tag.remove(value_tag)
+                self.gen_formula_tag(c_tag, None, *shared)
+            else:
+                right_formula = convert_rc_formula(cur_string[1:], c_tag.get('r'))
+                if not right_formula:
+                    return
+                c_tag.remove(value_tag)
+                # Generate formula
+                self.gen_formula_tag(c_tag, right_formula, *(shared or ()))
+            if self.formula_values is not None:
+                self.formula_values.set_cached_value(c_tag, self.get_namespace(c_tag))
+
+    def plan_shared_formulas(self, c_tags):
+        """ Collect runs of shared formulas from sheet's cells """
+        formula_runs = SharedFormulaRuns()
+        for c_tag in c_tags:
+            cur_string = self.get_cell_string(c_tag)[1]
+            if cur_string and cur_string[0] == '=':
+                formula_runs.add(c_tag.get('r'), cur_string[1:])
+        formula_runs.close()
+
+        return formula_runs
+
+    def evaluate_sheet(self, c_tags, sheet_file_name):
+        """ Evaluate sheet's formula strings converted to A1-type, returns SheetEvaluator of their values """
+        evaluator = SheetEvaluator()
+        with self.metrics.timer('evaluate_formulas', sheet=sheet_file_name):
+            for c_tag in c_tags:
+                address = c_tag.get('r')
+                if not address:
+                    continue
+                cur_string = self.get_cell_string(c_tag)[1]
+                if cur_string and cur_string[0] == '=':
+                    evaluator.add_formula(address, convert_rc_formula(cur_string[1:], address))
+                else:
+                    evaluator.add_value(address, self.get_cell_value(c_tag, cur_string))
+            stats = evaluator.evaluate()
+        for name in ('evaluated', 'unsupported', 'cyclic'):
+            if stats[name]:
+                self.metrics.count('formulas_' + name, stats[name])
+
+        return evaluator
+
+    def get_cell_value(self, c_tag, cur_string=None):
+        """ Value of cell without formula as it's written to output, see xlsx_evaluator """
+        cell_type = c_tag.get('t', 'n')
+        if cell_type == 'inlineStr':
+            return cur_string if cur_string is not None else UNKNOWN_TEXT
+        v_tag = c_tag.find(self.get_namespace(c_tag) + 'v')
+        if v_tag is None or v_tag.text is None:
+            return None
+        if cell_type == 's':
+            # Texts of shared strings are loaded by export only
+            if self.shared_strings is not None:
+                return self.shared_strings[int(v_tag.text)]
+            return UNKNOWN_TEXT
+        if cell_type == 'str':
+            return v_tag.text
+        if cell_type == 'b':
+            return v_tag.text == '1'
+        if cell_type == 'e':
+            return CellError(v_tag.text)
+        if v_tag.text == 'NaN':
+            return 0.0 if fix_nan in self.transforms else UNKNOWN_TEXT
+        try:
+            return float(v_tag.text)
+        except ValueError:
+            return UNKNOWN_TEXT
+
+    def collect_formats(self, c_tags):
+        """ Get (style_id, format) of formula cells with format, in order of cells """
+        formats = []
+        for c_tag in c_tags:
+            cur_string = self.get_cell_string(c_tag)[1]
+            if cur_string and cur_string[0] == '=' and '@' in cur_string[1:]:
+                formats.append((c_tag.get('s'), get_cell_format(cur_string[1:])))
+
+        return formats
+
+    @staticmethod
+    def iter_sheet_cells(source_file):
+        """ Iterate over sheet's c tags, freeing each row after it is read """
+        for event, elem in etree.iterparse(source_file):
+            local_name = etree.QName(elem).localname
+            if local_name == 'c':
+                yield elem
+            elif local_name == 'row':
+                elem.clear()
+                while elem.getprevious() is not None:
+                    del elem.getparent()[0]
+
+    @staticmethod
+    def get_namespace(elem):
+        """ Namespace prefix of element's tag, eg. '{http://...}', to find its children """
+        return elem.tag[:elem.tag.index('}') + 1] if elem.tag[0] == '{' else ''
+
+    @staticmethod
+    def get_sheet_number(sheet_file_name):
+        """ Get sheet's number from its file name, eg. 'xl/worksheets/sheet2.xml' = 2 """
+        return int(re.compile(r'\d+').findall(sheet_file_name)[-1])
 
     @staticmethod
-    def gen_formula_tag(c_tag, right_formula):
-        """ Generate new formula tag """
-        c_tag.append(etree.Element("f"))
-        f_tag = c_tag.xpath("*[local-name()='f']")
-        f_tag[0].text = right_formula
+    def write_element(xml_file, elem):
+        """ Write element to incremental xml-file without repeating namespace declarations """
+        with xml_file.element(elem.tag, elem.attrib):
+            if elem.text:
+                xml_file.write(elem.text)
+            for child in elem:
+                ParseXlsx.write_element(xml_file, child)
+                if child.tail:
+                    xml_file.write(child.tail)
+
+    @staticmethod
+    def gen_formula_tag(c_tag, right_formula, shared_index=None, shared_ref=None):
+        """ Generate new formula tag, shared formula's one if shared_index is set """
+        f_tag = etree.SubElement(c_tag, ParseXlsx.get_namespace(c_tag) + 'f')
+        f_tag.text = right_formula
+        if shared_index is not None:
+            f_tag.attrib['t'] = 'shared'
+            if shared_ref:
+                f_tag.attrib['ref'] = shared_ref
+            f_tag.attrib['si'] = shared_index
         del c_tag.attrib["t"]
 
     def print_log(self, message):
@@ -208,92 +787,77 @@ class ParseXlsx:
         if self.show_log:
             print(message)
 
+    def log_metric(self, kind, name, value, labels):
+        """ Metrics' callback which shows metrics as log messages """
+        if kind == 'timing':
+            value = '{0:.3f}s'.format(value)
+        self.print_log('{0}: {1} {2}'.format(name, value, ' '.join(
+            '{0}={1}'.format(key, labels[key]) for key in sorted(labels)
+        )).rstrip())
+
     def set_format(self, style_id, new_format):
         """ Set formula's cell format """
-        new_format = new_format.replace("'", '"')
-
-        # Find current common format
-        cell_xfs = self.style_list.getroot().xpath(
-            "//*[local-name()='cellXfs']"
-        )[0]
-        current_xf = deepcopy(cell_xfs.xpath("*[local-name()='xf']")[int(style_id)])
-        # Append copied common format
-        cell_xfs.append(current_xf)
-        # Save last item's id as new style_id
-        style_id = cell_xfs.attrib['count']
-        # Increase cellXfs' count
-        cell_xfs.attrib['count'] = str(int(cell_xfs.get('count')) + 1)
-
-        # Get new common format
-        current_xf = cell_xfs.xpath("*[local-name()='xf']")[-1]
-
-        # Edit numFmts block
-        num_fmts = self.style_list.getroot().xpath(
-            "//*[local-name()='numFmts'][@count]"
-        )[0]
-
-        # Check on existing current style
-        exists_fmt = num_fmts.xpath(
-            """*[local-name()='numFmt'][@formatCode='[$-010419]{0}']""".format(new_format)
-        )
-
-        if not exists_fmt:
-            # Add new numFmt
-            num_fmts.append(etree.Element('numFmt'))
-            new_item = num_fmts.xpath("*[local-name()='numFmt']")[-1]
-            new_item.attrib['numFmtId'] = str(style_id)
-            new_item.attrib['formatCode'] = """[$-010419]{0}""".format(new_format)
-
-            # Increase numFmts count
-            num_fmts.attrib['count'] = str(int(num_fmts.get('count')) + 1)
-
-        # Set format number's id to new common style
-        current_xf.attrib["numFmtId"] = str(
-            exists_fmt[0].get('numFmtId') if exists_fmt else style_id
-        )
-
-        return style_id
+        return self.get_styles().get_style(style_id, new_format)
 
     def set_print_view(self, sheet_object):
         """ Set pageSetup-tag """
+        root = sheet_object.getroot()
+        ns = self.get_namespace(root)
         # Set fixToPage property to True
-        sheet_pr = sheet_object.getroot().xpath("//*[local-name()='sheetPr']")
-        if not len(sheet_pr):
-            sheet_object.getroot().xpath("//")[0].insert(0, etree.Element('sheetPr'))
-            sheet_pr = sheet_object.getroot().xpath("//*[local-name()='sheetPr']")[0]
-        else:
-            sheet_pr = sheet_pr[0]
-        sheet_pr.append(etree.Element('pageSetUpPr', {'fitToPage': '1'}))
+        sheet_pr = root.find(ns + 'sheetPr')
+        if sheet_pr is None:
+            sheet_pr = etree.Element(ns + 'sheetPr')
+            root.insert(0, sheet_pr)
+        self.add_fit_to_page(sheet_pr)
 
         # Set orientation to landscape and fit to width and height to True
-        page_setup = sheet_object.getroot().xpath("//*[local-name()='pageSetup']")[0]
+        page_setup = root.find(ns + 'pageSetup')
+        if page_setup is not None:
+            self.set_page_setup(page_setup)
+
+        return sheet_object
+
+    @staticmethod
+    def add_fit_to_page(sheet_pr):
+        """ Append pageSetUpPr-tag with fitToPage property to sheetPr-tag """
+        etree.SubElement(sheet_pr, ParseXlsx.get_namespace(sheet_pr) + 'pageSetUpPr', {'fitToPage': '1'})
+
+    def set_page_setup(self, page_setup):
+        """ Set orientation and fit to width and height to pageSetup-tag """
         page_setup.attrib['orientation'] = self.landscape
         page_setup.attrib['fitToWidth'] = self.fit_to_width
         page_setup.attrib['fitToHeight'] = self.fit_to_height
 
-        return sheet_object
-
     @staticmethod
     def set_fixed_area(sheet_object, col=0, row=0):
         """ Set fixed area to sheet """
+        root = sheet_object.getroot()
+        ns = ParseXlsx.get_namespace(root)
         # Get sheetViews tag
-        sheet_views = sheet_object.getroot().xpath("//*[local-name()='sheetViews']")
-        if not len(sheet_views):
-            sheet_object.getroot().xpath("//")[0].insert(0, etree.Element('sheetViews'))
-            sheet_views = sheet_object.getroot().xpath("//*[local-name()='sheetViews']")[0]
-        else:
-            sheet_views = sheet_views[0]
+        sheet_views = root.find(ns + 'sheetViews')
+        if sheet_views is None:
+            # sheetViews follows sheetPr and dimension tags
+            sheet_views = etree.Element(ns + 'sheetViews')
+            position = 0
+            while position < len(root) and root[position].tag in (ns + 'sheetPr', ns + 'dimension'):
+                position += 1
+            root.insert(position, sheet_views)
+        ParseXlsx.add_fixed_pane(sheet_views, col, row)
+
+        return sheet_object
 
+    @staticmethod
+    def add_fixed_pane(sheet_views, col=0, row=0):
+        """ Add frozen pane to first sheetView-tag of sheetViews-tag """
         # Get sheetView tag
-        cur_sheet_view = sheet_views.xpath("*[local-name()='sheetView']")
-        if not len(cur_sheet_view):
-            sheet_views.insert(0, etree.Element('sheetView'))
-            cur_sheet_view = sheet_views.xpath("*[local-name()='sheetView']")[0]
-        else:
-            cur_sheet_view = cur_sheet_view[0]
+        ns = ParseXlsx.get_namespace(sheet_views)
+        cur_sheet_view = sheet_views.find(ns + 'sheetView')
+        if cur_sheet_view is None:
+            cur_sheet_view = etree.Element(ns + 'sheetView')
+            sheet_views.insert(0, cur_sheet_view)
 
         # Add new pane to fix current area
-        cur_sheet_view.append(etree.Element('pane', {
+        cur_sheet_view.append(etree.Element(ns + 'pane', {
             'xSplit': str(col),
             'ySplit': str(row),
             'topLeftCell': "{col}{row}".format(**dict(
@@ -304,14 +868,79 @@ class ParseXlsx:
             'state': "frozen",
         }))
 
-        return sheet_object
 
-    @staticmethod
-    def save_xml_to_file(xml_object, file_name):
-        """ Save edited XML-object to source-file """
-        file_handler = open(file_name, "w")
-        file_handler.writelines(etree.tostring(xml_object, pretty_print=True))
-        file_handler.close()
+def collect_sheet_formats_job(job):
+    """ Process pool's job: get formats of sheet's formula cells, see ParseXlsx.collect_formats """
+    parser, sheet_file_name = job
+    with ZipFile(parser.file_name, 'r') as source_zip:
+        with source_zip.open(sheet_file_name) as source_file:
+            return parser.collect_formats(parser.iter_sheet_cells(source_file))
+
+
+def parse_sheet_job(job):
+    """ Process pool's job: parse sheet to compressed data of zip member """
+    parser, sheet_file_name, style_mapping = job
+    parser.styles = style_mapping
+    parser.removed_strings_refs = 0
+    with parser.metrics.timer('parse_sheet', sheet=sheet_file_name):
+        with ZipFile(parser.file_name, 'r') as source_zip:
+            compress_type = parser.compression.compress_type(sheet_file_name)
+            with MemberCompressor(compress_type, parser.compression.level) as output_file:
+                parser.parse_sheet(sheet_file_name, source_zip, output_file)
+
+    return output_file, parser.removed_strings_refs, parser.metrics
+
+
+def process_many(file_names, workers=4, processes=False, output_dir=None, **options):
+    """
+        Parse many workbooks with ParseXlsx options on thread pool, or on process pool
+        with processes=True (sheets of workbook are parsed serially then). Workbooks are
+        replaced by parsed ones, unless output_dir is set. Returns [(file_name, metrics,
+        error)] in order of file_names, error is exception or None on success.
+        Workbook which output file is written by previous one, eg. workbook of other
+        directory with the same name, isn't parsed and gets ValueError.
+    """
+    jobs = []
+    results = {}
+    output_names = {}
+    for index, file_name in enumerate(file_names):
+        output_file = os.path.join(output_dir, os.path.basename(file_name)) if output_dir else None
+        output_name = os.path.normcase(os.path.abspath(output_file or file_name))
+        if output_name in output_names:
+            results[index] = (file_name, Metrics(), ValueError('Output file {0} is written by {1} already'.format(
+                output_file or file_name, output_names[output_name]
+            )))
+            continue
+        output_names[output_name] = file_name
+        jobs.append((index, (file_name, output_file, options)))
+
+    pool = Pool(workers) if processes else ThreadPool(workers)
+    try:
+        results.update(zip((index for index, _ in jobs), pool.map(process_file_job, [job for _, job in jobs])))
+    finally:
+        pool.terminate()
+        pool.join()
+
+    return [results[index] for index in sorted(results)]
+
+
+def process_file_job(job):
+    """ Pool's job of process_many: parse single workbook """
+    file_name, output_file, options = job
+    metrics = Metrics()
+    try:
+        if not os.path.exists(file_name):
+            raise IOError('Source file not found: {0}'.format(file_name))
+        ParseXlsx(file_name, run=True, output_file=output_file, metrics=metrics, **options)
+    except Exception as error:
+        try:
+            pickle.dumps(error)
+        except Exception:
+            # Error is passed back from process pool's worker
+            error = RuntimeError(repr(error))
+        return file_name, metrics, error
+
+    return file_name, metrics, None
 
 
 if __name__ == '__main__':
@@ -7,28 +7,70 @@
     :license: Apache License.
 
 """
+import shutil
+import time
+from multiprocessing.pool import ThreadPool
+from tempfile import SpooledTemporaryFile
 from urllib import quote
 
 import requests
+from requests.adapters import HTTPAdapter
+
+from parse_xlsx_xml import ParseXlsx
+from report_metrics import Metrics
+from xlsx_merge import merge_workbooks, MERGE_ROWS
+
+# Size of chunk of report's file read from server
+CHUNK_SIZE = 64 * 1024
+# Reports up to this size are spooled in memory, larger ones in temp file
+SPOOL_MAX_SIZE = 16 * 1024 * 1024
+# Formats of reports rendered as xlsx, which are post-processed by ParseXlsx
+XLSX_FORMATS = ('EXCEL', 'EXCELOPENXML')
+
+
+def encode_auth(auth):
+    """ Convert utf-8 auth data to cp1251, as Reporting Services expects it """
+    if not auth:
+        return ()
+    return (
+        auth[0].decode('utf-8').encode('cp1251').decode('latin1'),
+        auth[1].decode('utf-8').encode('cp1251').decode('latin1'),
+    )
+
+
+def needs_parsing(output_format, parse_options):
+    """
+        Whether report of output_format is post-processed by ParseXlsx with parse_options.
+        Raises ValueError if options are set for report which isn't xlsx.
+    """
+    if not parse_options:
+        return False
+    if output_format.upper() not in XLSX_FORMATS:
+        raise ValueError('ParseXlsx options are set for {0} report, which is not xlsx'.format(output_format))
+    return True
 
 
 class SSRSReport(object):
     """ SQL Server Reporting Services Report object """
 
-    def __init__(self, server, report_path, auth=(), params={}, multiparams_divider='', output_format='EXCEL'):
+    def __init__(self, server, report_path, auth=(), params={}, multiparams_divider='', output_format='EXCEL',
+                 session=None, timeout=None, cache=None, metrics=None):
         self._server = server
         self._report_path = report_path
-        self._auth = ()
-        if auth:
-            self._auth = (
-                auth[0].decode('utf-8').encode('cp1251').decode('latin1'),
-                auth[1].decode('utf-8').encode('cp1251').decode('latin1'),
-            )
+        self._auth = encode_auth(auth)
+        self._session = session
+        self._timeout = timeout
+        # ssrs_cache.ReportCache of rendered reports
+        self._cache = cache
+        # report_metrics.Metrics of fetching, passed to ParseXlsx by save_parsed_file
+        self._metrics = metrics or Metrics()
         self._params = params
         self._multiparams_divider = multiparams_divider
         self._format = output_format
         self._connection_string = self.get_connection_string(params, multiparams_divider)
         self._report_request = None
+        # Body of response is downloaded by read_content
+        self._content_read = False
         self._output_file = None
 
     @property
@@ -70,6 +112,16 @@ class SSRSReport(object):
     def connection_string(self, value):
         self._connection_string = value
 
+    @property
+    def report_request(self):
+        """ Response of Reporting Services, None if report wasn't requested """
+        return self._report_request
+
+    @property
+    def metrics(self):
+        """ Timings of fetching: fetch_first_byte, download and download_bytes_per_second """
+        return self._metrics
+
     @property
     def output_format(self):
         """
@@ -112,20 +164,79 @@ class SSRSReport(object):
 
     def get_report(self):
         """ Get report's file """
-        req = requests.get(self.connection_string, auth=self.auth)
+        # Body is read from server by chunks, when report is saved
+        start = time.time()
+        req = (self._session or requests).get(
+            self.connection_string, auth=self.auth, timeout=self._timeout, stream=True
+        )
+        # Response is returned as soon as its headers are received
+        self._metrics.timing('fetch_first_byte', time.time() - start, report=self.report_path)
         self._report_request = req
+        self._content_read = False
 
-    def save_file(self, output_file):
-        """ Write received content to your file """
+    def iter_content(self, chunk_size=CHUNK_SIZE):
+        """ Iterate over chunks of report's body as they are downloaded, recording download speed """
+        if self._content_read:
+            for chunk in self._report_request.iter_content(chunk_size):
+                yield chunk
+            return
+        start = time.time()
+        size = 0
+        for chunk in self._report_request.iter_content(chunk_size):
+            size += len(chunk)
+            yield chunk
+        elapsed = time.time() - start
+        self._metrics.timing('download', elapsed, report=self.report_path, bytes=size)
+        if elapsed:
+            self._metrics.gauge('download_bytes_per_second', size / elapsed, report=self.report_path)
+
+    def read_content(self):
+        """
+            Download whole report's body to memory, so its connection is returned to pool.
+            Body is saved from report_request.content then.
+        """
+        if self._report_request is None:
+            self.get_report()
+        start = time.time()
+        content = self._report_request.content
+        self._metrics.timing('download', time.time() - start, report=self.report_path, bytes=len(content))
+        self._content_read = True
+
+        return content
+
+    def cache_key(self, variant=None):
+        """ Key of report in cache, variant is set for post-processed files, see ReportCache.key """
+        return self._cache.key(self.connection_string, self.output_format, variant)
+
+    def get_cached_file(self):
+        """ Open report's cached file, None if there's no cache or report isn't cached """
+        if self._cache is None:
+            return None
+        return self._cache.get(self.cache_key())
+
+    def save_file(self, output_file, chunk_size=CHUNK_SIZE):
+        """ Write received content to your file, output_file is file name or file object """
         result = ''
+        cached_file = self.get_cached_file()
+        if cached_file is not None:
+            with cached_file:
+                self.copy_file(cached_file, output_file, chunk_size)
+            self._output_file = output_file
+            return result
+
         if not self._report_request:
             # Get report if it wasn't
             self.get_report()
         if self._report_request.status_code == 200:
             # Write file on success
-            with open(output_file, 'wb') as xlsx_file:
-                for chunk in self._report_request.iter_content(1024):
-                    xlsx_file.write(chunk)
+            if self._cache is not None:
+                with self._cache.put(self.cache_key(), self.iter_content(chunk_size)) as cached_file:
+                    self.copy_file(cached_file, output_file, chunk_size)
+            elif hasattr(output_file, 'write'):
+                self.write_content(output_file, chunk_size)
+            else:
+                with open(output_file, 'wb') as xlsx_file:
+                    self.write_content(xlsx_file, chunk_size)
 
             self._output_file = output_file
         else:
@@ -134,6 +245,193 @@ class SSRSReport(object):
 
         return result
 
+    def write_content(self, output_file, chunk_size=CHUNK_SIZE):
+        """ Write received content to file object as it is downloaded """
+        for chunk in self.iter_content(chunk_size):
+            output_file.write(chunk)
+
+    @staticmethod
+    def copy_file(source_file, output_file, chunk_size=CHUNK_SIZE):
+        """ Copy file object to file name or file object """
+        if hasattr(output_file, 'write'):
+            shutil.copyfileobj(source_file, output_file, chunk_size)
+        else:
+            with open(output_file, 'wb') as xlsx_file:
+                shutil.copyfileobj(source_file, xlsx_file, chunk_size)
+
+    def spool_file(self, max_size=SPOOL_MAX_SIZE, chunk_size=CHUNK_SIZE):
+        """
+            Download report to spooled temp file, which is kept in memory up to max_size bytes.
+            Returned file is rewound and can be passed to ParseXlsx instead of file name.
+            Raises requests.HTTPError on server error.
+        """
+        spooled_file = SpooledTemporaryFile(max_size=max_size)
+        cached_file = self.get_cached_file()
+        if cached_file is None:
+            if not self._report_request:
+                self.get_report()
+            self._report_request.raise_for_status()
+            if self._cache is not None:
+                cached_file = self._cache.put(self.cache_key(), self.iter_content(chunk_size))
+            else:
+                self.write_content(spooled_file, chunk_size)
+        if cached_file is not None:
+            with cached_file:
+                shutil.copyfileobj(cached_file, spooled_file, chunk_size)
+        spooled_file.seek(0)
+        self._output_file = spooled_file
+
+        return spooled_file
+
+    def save_parsed_file(self, output_file, chunk_size=CHUNK_SIZE, **parse_options):
+        """
+            Write report post-processed by ParseXlsx with parse_options to your file.
+            Post-processed file is cached too, keyed by parse_options.
+            Raises requests.HTTPError on server error.
+        """
+        parsed_key = self.cache_key(variant=parse_options) if self._cache is not None else None
+        cached_file = self._cache.get(parsed_key) if parsed_key else None
+        if cached_file is None:
+            parse_options.setdefault('metrics', self._metrics)
+            parser = ParseXlsx(self.spool_file(chunk_size=chunk_size), run=True, **parse_options)
+            if parsed_key:
+                cached_file = self._cache.put(parsed_key, parser.output_file)
+            else:
+                self.copy_file(parser.output_file, output_file, chunk_size)
+        if cached_file is not None:
+            with cached_file:
+                self.copy_file(cached_file, output_file, chunk_size)
+        self._output_file = output_file
+
+
+class SSRSClient(object):
+    """
+        Reporting Services client which fetches many reports through one
+        pooled HTTP session, running at most `concurrency` requests at a time
+    """
+
+    def __init__(self, server, auth=(), multiparams_divider='', concurrency=4, timeout=None, cache=None,
+                 metrics=None):
+        self._server = server
+        self._auth = auth
+        self._multiparams_divider = multiparams_divider
+        self._concurrency = concurrency
+        self._timeout = timeout
+        self._cache = cache
+        # report_metrics.Metrics shared by client's reports
+        self._metrics = metrics
+        # Keep-alive connections are reused by all reports of client
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def session(self):
+        """ requests.Session shared by client's reports """
+        return self._session
+
+    def close(self):
+        """ Close pooled connections """
+        self._session.close()
+
+    def report(self, report_path, params={}, output_format='EXCEL', metrics=None):
+        """ Create report object which is fetched with client's session """
+        return SSRSReport(
+            self._server,
+            report_path,
+            auth=self._auth,
+            params=params,
+            multiparams_divider=self._multiparams_divider,
+            output_format=output_format,
+            session=self._session,
+            timeout=self._timeout,
+            cache=self._cache,
+            metrics=metrics or self._metrics,
+        )
+
+    def fetch_reports(self, jobs):
+        """
+            Fetch reports of jobs like (report_path, params, output_format) concurrently.
+            Yields (job, report, error) as reports are received, not in jobs order.
+            error is None on success, report's body is read to report.report_request then,
+            so pooled connection is free before report is yielded.
+        """
+        pool = ThreadPool(self._concurrency)
+        try:
+            for result in pool.imap_unordered(self.fetch_report, jobs):
+                yield result
+        finally:
+            pool.terminate()
+            pool.join()
+
+    def fetch_fan_out(self, report_path, params, fan_out_param, chunk_size, output_file, merge=MERGE_ROWS,
+                      header_rows=0, output_format='EXCEL', **parse_options):
+        """
+            Render report for chunks of chunk_size values of multi-value fan_out_param concurrently
+            and merge them into one workbook, see xlsx_merge.merge_workbooks for merge and header_rows.
+            Merged workbook is post-processed by ParseXlsx if parse_options are set.
+            Raises requests.HTTPError if any chunk fails.
+        """
+        divider = self._multiparams_divider
+        if not divider:
+            raise ValueError('multiparams_divider of client is required to fan out parameter')
+        values = params[fan_out_param]
+        if isinstance(values, (str, unicode)):
+            values = values.split(divider)
+        values = list(values)
+        jobs = []
+        for start in range(0, len(values), chunk_size):
+            chunk_params = dict(params)
+            chunk_values = values[start:start + chunk_size]
+            chunk_params[fan_out_param] = divider.join('{0}'.format(value) for value in chunk_values)
+            jobs.append((report_path, chunk_params, output_format))
+
+        pool = ThreadPool(self._concurrency)
+        try:
+            start = time.time()
+            spooled_files = pool.map(self.spool_report, jobs)
+            if self._metrics is not None:
+                self._metrics.timing('fetch_fan_out', time.time() - start, report=report_path, chunks=len(jobs))
+        finally:
+            pool.terminate()
+            pool.join()
+
+        try:
+            if not parse_options:
+                merge_workbooks(spooled_files, output_file, merge, header_rows)
+                return
+            with SpooledTemporaryFile(max_size=SPOOL_MAX_SIZE) as merged_file:
+                merge_workbooks(spooled_files, merged_file, merge, header_rows)
+                parse_options.setdefault('metrics', self._metrics)
+                ParseXlsx(merged_file, run=True, output_file=output_file, **parse_options)
+        finally:
+            for spooled_file in spooled_files:
+                spooled_file.close()
+
+    def spool_report(self, job):
+        """ Fetch report of job and download it to spooled temp file, see fetch_fan_out """
+        return self.report(*job).spool_file()
+
+    def fetch_report(self, job):
+        """ Fetch report of single job, see fetch_reports """
+        report = None
+        try:
+            report = self.report(*job)
+            report.get_report()
+            report.report_request.raise_for_status()
+            report.read_content()
+        except Exception as error:
+            return job, report, error
+
+        return job, report, None
+
 
 if __name__ == '__main__':
     report = SSRSReport(
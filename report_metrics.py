@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+    Timings and counters of report fetching and xlsx post-processing.
+    Metrics are kept in Metrics object and passed to callback as they're recorded,
+    so they can be exported to monitoring.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Notice: Counters are incremented for every cell, so they're passed to callback
+            only by flush(), eg. once per workbook.
+"""
+import time
+from contextlib import contextmanager
+
+# Kinds of metrics passed to callback
+TIMING = 'timing'
+GAUGE = 'gauge'
+COUNTER = 'counter'
+
+
+class Metrics(object):
+    """
+        Collector of metrics. callback is called as callback(kind, name, value, labels),
+        where kind is TIMING (value in seconds), GAUGE or COUNTER and labels is a dict,
+        eg. {'sheet': 'xl/worksheets/sheet1.xml'}.
+    """
+
+    def __init__(self, callback=None):
+        self.callback = callback
+        # (name, seconds, labels) in order of recording
+        self.timings = []
+        # (name, value, labels) in order of recording
+        self.gauges = []
+        # name -> value, including already flushed values
+        self.counters = {}
+        self._unflushed = {}
+
+    def __getstate__(self):
+        """ Callback isn't passed between processes, results are merged by caller instead """
+        state = self.__dict__.copy()
+        state['callback'] = None
+        return state
+
+    @contextmanager
+    def timer(self, name, **labels):
+        """ Record time of with-block as timing name """
+        start = time.time()
+        try:
+            yield
+        finally:
+            self.timing(name, time.time() - start, **labels)
+
+    def timing(self, name, seconds, **labels):
+        """ Record duration of phase """
+        self.timings.append((name, seconds, labels))
+        if self.callback:
+            self.callback(TIMING, name, seconds, labels)
+
+    def gauge(self, name, value, **labels):
+        """ Record measured value, eg. download speed """
+        self.gauges.append((name, value, labels))
+        if self.callback:
+            self.callback(GAUGE, name, value, labels)
+
+    def count(self, name, value=1):
+        """ Increment counter """
+        self._unflushed[name] = self._unflushed.get(name, 0) + value
+
+    def flush(self, **labels):
+        """ Add counters incremented since last flush to totals and pass them to callback """
+        unflushed, self._unflushed = self._unflushed, {}
+        for name in sorted(unflushed):
+            self.counters[name] = self.counters.get(name, 0) + unflushed[name]
+            if self.callback:
+                self.callback(COUNTER, name, unflushed[name], labels)
+
+    def merge(self, other):
+        """ Record metrics of other Metrics, eg. collected in process pool's worker """
+        for name, seconds, labels in other.timings:
+            self.timing(name, seconds, **labels)
+        for name, value, labels in other.gauges:
+            self.gauge(name, value, **labels)
+        for counters in (other.counters, other._unflushed):
+            for name, value in counters.items():
+                self.count(name, value)
+
+    def get_timing(self, name):
+        """ Total seconds of timings with name """
+        return sum(seconds for timing_name, seconds, _ in self.timings if timing_name == name)
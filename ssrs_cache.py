@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    On-disk cache of rendered reports.
+    Reports are keyed by normalized connection string and output format,
+    expire after TTL and least recently used ones are evicted over size limit.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Notice: Files are written to temp file and renamed, so several processes
+            can share one cache directory.
+"""
+import hashlib
+import os
+import shutil
+import time
+from tempfile import mkstemp
+
+# Extension of cached reports' files
+CACHE_FILE_EXT = '.cache'
+# Size of chunk used for copying cached files
+CHUNK_SIZE = 64 * 1024
+
+
+def normalize_connection_string(connection_string):
+    """
+        Sort report's URL-parameters by name, so the same parameters in other order
+        give the same string. Values of multi-value parameter keep their order.
+    """
+    base, _, query = connection_string.partition('?')
+    parts = query.split('&')
+    params = sorted(parts[1:], key=lambda param: param.split('=', 1)[0].lower())
+
+    return '{0}?{1}'.format(base, '&'.join(parts[:1] + params))
+
+
+class ReportCache(object):
+    """ Directory of cached report files with TTL and LRU eviction """
+
+    def __init__(self, cache_dir, ttl=3600, max_size=1024 * 1024 * 1024):
+        """ ttl in seconds and max_size in bytes, None for unlimited """
+        self.cache_dir = cache_dir
+        self.ttl = ttl
+        self.max_size = max_size
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # Created by another process
+                if not os.path.isdir(cache_dir):
+                    raise
+
+    @staticmethod
+    def key(connection_string, output_format, variant=None):
+        """
+            Cache key of report. variant distinguishes post-processed files of
+            the same report, eg. dict of ParseXlsx options.
+        """
+        if isinstance(variant, dict):
+            variant = repr(sorted(variant.items()))
+        key_string = '\n'.join((
+            normalize_connection_string(connection_string),
+            output_format.upper(),
+            variant or '',
+        ))
+        if not isinstance(key_string, bytes):
+            key_string = key_string.encode('utf-8')
+
+        return hashlib.sha1(key_string).hexdigest()
+
+    def get_path(self, key):
+        """ Path of key's file in cache directory """
+        return os.path.join(self.cache_dir, key + CACHE_FILE_EXT)
+
+    def get(self, key):
+        """ Open key's cached file, None if it isn't cached or expired """
+        path = self.get_path(key)
+        try:
+            stat = os.stat(path)
+            if self.ttl is not None and time.time() - stat.st_mtime > self.ttl:
+                return None
+            cached_file = open(path, 'rb')
+            # Access time is last use time for LRU, modification time is creation time for TTL
+            os.utime(path, (time.time(), stat.st_mtime))
+        except (IOError, OSError):
+            # Not cached or evicted by another process
+            return None
+
+        return cached_file
+
+    def put(self, key, source):
+        """
+            Save file to cache. source is file name, file object or iterable of chunks.
+            Returns opened cached file.
+        """
+        fd, temp_path = mkstemp(suffix='.tmp', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                if isinstance(source, basestring):
+                    with open(source, 'rb') as source_file:
+                        shutil.copyfileobj(source_file, temp_file, CHUNK_SIZE)
+                elif hasattr(source, 'read'):
+                    shutil.copyfileobj(source, temp_file, CHUNK_SIZE)
+                else:
+                    for chunk in source:
+                        temp_file.write(chunk)
+            path = self.get_path(key)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Windows doesn't replace existing file, which is written by another process then
+                os.remove(temp_path)
+            cached_file = open(path, 'rb')
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self.evict()
+
+        return cached_file
+
+    def evict(self):
+        """ Remove expired files and least recently used ones over max_size """
+        files = []
+        now = time.time()
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(CACHE_FILE_EXT):
+                continue
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                stat = os.stat(path)
+                if self.ttl is not None and now - stat.st_mtime > self.ttl:
+                    os.remove(path)
+                else:
+                    files.append((stat.st_atime, stat.st_size, path))
+            except OSError:
+                # Removed by another process
+                continue
+
+        if self.max_size is not None:
+            total_size = sum(size for _, size, _ in files)
+            for _, size, path in sorted(files):
+                if total_size <= self.max_size:
+                    break
+                try:
+                    os.remove(path)
+                except OSError:
+                    pass
+                total_size -= size
+
+    def clear(self):
+        """ Remove all cached files """
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(CACHE_FILE_EXT):
+                try:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                except OSError:
+                    pass
@@ -0,0 +1,241 @@
+# -*- coding: utf-8 -*-
+"""
+    Pipeline of report production: fetch -> convert -> deliver.
+    Stages run concurrently with bounded queues between them, so downloads,
+    post-processing and writing of different reports overlap. Stage waits when
+    next stage's queue is full, so fast downloads don't pile up on disk.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: with SSRSClient(server, auth, concurrency=8) as client:
+               pipeline = ReportPipeline(client, '/data/reports', fetch_workers=8, convert_workers=4)
+               for job, output_file, error in pipeline.run(jobs):
+                   ...
+    Notice: Reports are converted in process pool, so ParseXlsx options of jobs
+            have to be picklable and can't have workers > 1. Fetched reports are
+            kept in temp directory inside output directory until they're delivered.
+"""
+import os
+import shutil
+import tempfile
+import threading
+import time
+from multiprocessing import Pool, cpu_count
+from Queue import Queue
+
+from parse_xlsx_xml import ParseXlsx
+from pyssrs import needs_parsing
+from report_metrics import Metrics
+
+# Stages of pipeline in order
+FETCH = 'fetch'
+CONVERT = 'convert'
+DELIVER = 'deliver'
+STAGES = (FETCH, CONVERT, DELIVER)
+
+
+class PipelineItem(object):
+    """ Report passed between stages """
+
+    def __init__(self, job):
+        self.job = job
+        # Report's file in work directory
+        self.file_name = None
+        self.output_file = None
+        self.error = None
+        # Whether report is post-processed by ParseXlsx
+        self.parse = False
+
+
+class Stage(object):
+    """
+        Threads running handler(item) for items of input queue and putting them to output
+        queue. Items which failed are put to results queue. None is end of items.
+    """
+
+    def __init__(self, name, handler, workers, input_queue, output_queue, results, next_stage_workers=1):
+        self.name = name
+        self.handler = handler
+        self.input_queue = input_queue
+        self.output_queue = output_queue
+        self.results = results
+        self.next_stage_workers = next_stage_workers
+        self.lock = threading.Lock()
+        self.stats = {'active': 0, 'done': 0, 'errors': 0, 'max_queued': 0}
+        self.running = workers
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self.run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def run(self):
+        """ Worker thread's loop """
+        while True:
+            item = self.input_queue.get()
+            if item is None:
+                break
+            with self.lock:
+                self.stats['active'] += 1
+                # Taken item was queued too
+                self.stats['max_queued'] = max(self.stats['max_queued'], self.input_queue.qsize() + 1)
+            try:
+                self.handler(item)
+            except Exception as e:
+                item.error = e
+            with self.lock:
+                self.stats['active'] -= 1
+                self.stats['errors' if item.error else 'done'] += 1
+            if item.error:
+                self.results.put(item)
+            else:
+                # Blocks while next stage is busy
+                self.output_queue.put(item)
+
+        with self.lock:
+            self.running -= 1
+            last = not self.running
+        if last:
+            # Last worker finishes next stage
+            for _ in range(self.next_stage_workers):
+                self.output_queue.put(None)
+
+    def get_stats(self):
+        """ Number of queued, running, finished and failed items of stage """
+        with self.lock:
+            stats = dict(self.stats)
+        stats['queued'] = self.input_queue.qsize()
+        return stats
+
+
+class ReportPipeline(object):
+    """
+        Fetches reports of jobs with SSRSClient, converts them by ParseXlsx in process pool and
+        moves them to output_dir. Job is a dict: {'name': output file's name, 'report_path': ...,
+        'params': {...}, 'output_format': ..., 'options': {...}}, where options are ParseXlsx's
+        options. Report isn't converted if options aren't set, they can be set for xlsx formats
+        only. Jobs with name of earlier job fail. queue_size limits reports waiting for each stage.
+    """
+
+    def __init__(self, client, output_dir, fetch_workers=4, convert_workers=None, deliver_workers=2,
+                 queue_size=8, metrics=None):
+        self.client = client
+        self.output_dir = output_dir
+        self.workers = {
+            FETCH: fetch_workers,
+            CONVERT: convert_workers or cpu_count(),
+            DELIVER: deliver_workers,
+        }
+        self.queue_size = queue_size
+        # report_metrics.Metrics of stages: timings of each report and queue depths
+        self.metrics = metrics or Metrics()
+        self.metrics_lock = threading.Lock()
+        self.stages = {}
+        self.work_dir = None
+        self.pool = None
+
+    def run(self, jobs):
+        """
+            Run jobs through pipeline. Yields (job, output file, error) as reports are
+            delivered or failed, error is None on success.
+        """
+        self.work_dir = tempfile.mkdtemp(prefix='.ssrs_pipeline_', dir=self.output_dir)
+        self.pool = Pool(self.workers[CONVERT])
+        results = Queue()
+        queues = dict((stage, Queue(self.queue_size)) for stage in STAGES)
+        queues[None] = results
+        handlers = {FETCH: self.fetch, CONVERT: self.convert, DELIVER: self.deliver}
+        for index, stage in enumerate(STAGES):
+            next_stage = STAGES[index + 1] if index + 1 < len(STAGES) else None
+            self.stages[stage] = Stage(
+                stage,
+                handlers[stage],
+                self.workers[stage],
+                queues[stage],
+                queues[next_stage],
+                results,
+                self.workers[next_stage] if next_stage else 1,
+            )
+
+        feeder = threading.Thread(target=self.feed, args=(jobs, queues[FETCH], results))
+        feeder.daemon = True
+        feeder.start()
+        try:
+            for item in iter(results.get, None):
+                if item.error and item.file_name and os.path.exists(item.file_name):
+                    os.remove(item.file_name)
+                yield item.job, item.output_file, item.error
+        finally:
+            self.pool.terminate()
+            self.pool.join()
+            shutil.rmtree(self.work_dir, ignore_errors=True)
+            with self.metrics_lock:
+                self.metrics.flush()
+
+    def feed(self, jobs, fetch_queue, results):
+        """ Put jobs to fetch queue, waiting while it's full. Jobs with taken names are failed """
+        names = set()
+        for job in jobs:
+            item = PipelineItem(job)
+            name = os.path.normcase(os.path.normpath(job['name']))
+            if name in names:
+                item.error = ValueError('Output file {0} is written by other job already'.format(job['name']))
+                results.put(item)
+                continue
+            names.add(name)
+            fetch_queue.put(item)
+            self.record_queue_depth(FETCH, fetch_queue)
+        for _ in range(self.workers[FETCH]):
+            fetch_queue.put(None)
+
+    def get_stats(self):
+        """ Stats of each stage: queued, max_queued, active, done and errors """
+        return dict((name, stage.get_stats()) for name, stage in self.stages.items())
+
+    def record_queue_depth(self, stage, queue):
+        """ Record number of reports waiting for stage """
+        with self.metrics_lock:
+            self.metrics.gauge('queue_depth', queue.qsize(), stage=stage)
+
+    def record_stage(self, stage, item, start):
+        """ Record time of report's stage and depth of next stage's queue """
+        with self.metrics_lock:
+            self.metrics.timing('stage', time.time() - start, stage=stage, report=item.job.get('name'))
+        if stage != DELIVER:
+            self.record_queue_depth(STAGES[STAGES.index(stage) + 1], self.stages[stage].output_queue)
+
+    def fetch(self, item):
+        """ Download report to work directory """
+        start = time.time()
+        job = item.job
+        item.parse = needs_parsing(job.get('output_format', 'EXCEL'), job.get('options'))
+        fd, item.file_name = tempfile.mkstemp(dir=self.work_dir, suffix=os.path.splitext(job['name'])[1])
+        os.close(fd)
+        report = self.client.report(job['report_path'], job.get('params') or {}, job.get('output_format', 'EXCEL'))
+        error = report.save_file(item.file_name)
+        if error:
+            raise IOError(error)
+        self.record_stage(FETCH, item, start)
+
+    def convert(self, item):
+        """ Post-process report by ParseXlsx in process pool """
+        start = time.time()
+        if item.parse:
+            metrics = self.pool.apply(convert_report_job, (item.file_name, item.job['options']))
+            with self.metrics_lock:
+                self.metrics.merge(metrics)
+        self.record_stage(CONVERT, item, start)
+
+    def deliver(self, item):
+        """ Move report to output directory """
+        start = time.time()
+        output_file = os.path.join(self.output_dir, item.job['name'])
+        shutil.move(item.file_name, output_file)
+        item.output_file = output_file
+        self.record_stage(DELIVER, item, start)
+
+
+def convert_report_job(file_name, options):
+    """ Process pool's job: post-process report's file in place, returns its Metrics """
+    metrics = Metrics()
+    ParseXlsx(file_name, run=True, metrics=metrics, **options)
+    return metrics
@@ -0,0 +1,291 @@
+# -*- coding: utf-8 -*-
+"""
+    Client of Reporting Services ReportExecution2005 SOAP endpoint.
+    Report is loaded once into execution session, which is rendered many times,
+    eg. to Excel and PDF, or page by page, from the same server-side snapshot.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: with ReportExecutionClient('http://your-reporting.com/ReportServer', auth) as client:
+               execution = client.load_report('/Report/Path', {'item_id': 666})
+               execution.render('EXCELOPENXML', 'report.xlsx')
+               execution.render('PDF', 'report.pdf')
+    Notice: Execution sessions expire on server after its ExecutionTimeout,
+            load report again after ReportExecutionError with rsExecutionNotFound.
+"""
+import base64
+import time
+
+import requests
+from lxml import etree
+from requests.adapters import HTTPAdapter
+
+from pyssrs import encode_auth
+
+SOAP_NS = 'http://schemas.xmlsoap.org/soap/envelope/'
+RS_NS = 'http://schemas.microsoft.com/sqlserver/2005/06/30/reporting/reportingservices'
+EXECUTION_ENDPOINT = 'ReportExecution2005.asmx'
+
+
+def rs_tag(name):
+    """ Qualified name of ReportExecution2005 tag """
+    return '{%s}%s' % (RS_NS, name)
+
+
+class ReportExecutionError(Exception):
+    """ SOAP fault returned by Reporting Services, eg. rsItemNotFound """
+
+    def __init__(self, fault_code, message, error_code=None):
+        super(ReportExecutionError, self).__init__(
+            '{0}: {1}'.format(error_code or fault_code, message)
+        )
+        self.fault_code = fault_code
+        self.error_code = error_code
+
+
+def build_envelope(action, values=(), execution_id=None):
+    """
+        SOAP envelope of action's request. values are (name, value) pairs of action's
+        arguments, value is text, None for omitted argument or list of (name, value) pairs.
+    """
+    envelope = etree.Element('{%s}Envelope' % SOAP_NS, nsmap={'soap': SOAP_NS, None: RS_NS})
+    if execution_id:
+        header = etree.SubElement(envelope, '{%s}Header' % SOAP_NS)
+        execution_header = etree.SubElement(header, rs_tag('ExecutionHeader'))
+        etree.SubElement(execution_header, rs_tag('ExecutionID')).text = execution_id
+    body = etree.SubElement(envelope, '{%s}Body' % SOAP_NS)
+    add_values(etree.SubElement(body, rs_tag(action)), values)
+
+    return etree.tostring(envelope, xml_declaration=True, encoding='UTF-8')
+
+
+def add_values(parent, values):
+    """ Add (name, value) pairs to parent as tags, see build_envelope """
+    for name, value in values:
+        if value is None:
+            continue
+        elem = etree.SubElement(parent, rs_tag(name))
+        if isinstance(value, list):
+            add_values(elem, value)
+        else:
+            elem.text = value if isinstance(value, unicode) else str(value).decode('utf-8')
+
+
+def parse_values(elem):
+    """ Dict of child tags' texts, tags with children are lists of their dicts """
+    values = {}
+    for child in elem:
+        name = etree.QName(child).localname
+        if len(child):
+            values[name] = [parse_values(item) if len(item) else item.text for item in child]
+        else:
+            values[name] = child.text
+
+    return values
+
+
+class ReportExecutionClient(object):
+    """
+        ReportExecution2005 client which calls server through one pooled HTTP session,
+        keeping at most `concurrency` connections
+    """
+
+    def __init__(self, server, auth=(), multiparams_divider='', concurrency=4, timeout=None, metrics=None):
+        # Address of ReportServer, eg. http://your-reporting.com/ReportServer
+        self._endpoint = '{0}/{1}'.format(server.rstrip('/'), EXECUTION_ENDPOINT)
+        self._auth = encode_auth(auth)
+        self._multiparams_divider = multiparams_divider
+        self._timeout = timeout
+        # report_metrics.Metrics of SOAP calls
+        self._metrics = metrics
+        self._session = requests.Session()
+        adapter = HTTPAdapter(pool_connections=concurrency, pool_maxsize=concurrency)
+        self._session.mount('http://', adapter)
+        self._session.mount('https://', adapter)
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    @property
+    def endpoint(self):
+        """ URL of ReportExecution2005 endpoint """
+        return self._endpoint
+
+    @property
+    def session(self):
+        """ requests.Session shared by client's executions """
+        return self._session
+
+    def close(self):
+        """ Close pooled connections """
+        self._session.close()
+
+    def call(self, action, values=(), execution_id=None):
+        """
+            Call action of endpoint, returns its response tag, eg. LoadReportResponse.
+            Raises ReportExecutionError on SOAP fault and requests.HTTPError on other errors.
+        """
+        start = time.time()
+        response = self._session.post(
+            self._endpoint,
+            data=build_envelope(action, values, execution_id),
+            headers={
+                'Content-Type': 'text/xml; charset=utf-8',
+                'SOAPAction': '"{0}/{1}"'.format(RS_NS, action),
+            },
+            auth=self._auth,
+            timeout=self._timeout,
+        )
+        if self._metrics is not None:
+            self._metrics.timing('soap_call', time.time() - start, action=action)
+
+        try:
+            root = etree.fromstring(response.content)
+        except etree.XMLSyntaxError:
+            # Not a SOAP response, eg. 401 page
+            response.raise_for_status()
+            raise
+        body = root.find('{%s}Body' % SOAP_NS)
+        fault = body.find('{%s}Fault' % SOAP_NS) if body is not None else None
+        if fault is not None:
+            error_code = fault.find('detail/{*}ErrorCode')
+            raise ReportExecutionError(
+                fault.findtext('faultcode'),
+                fault.findtext('faultstring'),
+                error_code.text if error_code is not None else None,
+            )
+        response.raise_for_status()
+
+        return body[0]
+
+    def load_report(self, report_path, params=None, history_id=None):
+        """ Start execution session of report, setting its params if they're passed """
+        response = self.call('LoadReport', [('Report', report_path), ('HistoryID', history_id)])
+        execution = ReportExecution(self, report_path, parse_values(response.find(rs_tag('executionInfo'))))
+        if params:
+            execution.set_parameters(params)
+
+        return execution
+
+    def get_parameter_values(self, params):
+        """ ParameterValue tags of params, multi-value ones are split by multiparams_divider """
+        values = []
+        for name, value in params.iteritems():
+            if isinstance(value, (list, tuple)):
+                items = value
+            elif self._multiparams_divider and isinstance(value, basestring) and self._multiparams_divider in value:
+                items = value.split(self._multiparams_divider)
+            else:
+                items = [value]
+            for item in items:
+                values.append(('ParameterValue', [('Name', name), ('Value', item)]))
+
+        return values
+
+
+class ReportExecution(object):
+    """ Execution session of loaded report, rendered from its server-side snapshot """
+
+    def __init__(self, client, report_path, info):
+        self._client = client
+        self._report_path = report_path
+        # ExecutionInfo of server: ExecutionID, NumPages, HasSnapshot, Parameters...
+        self._info = info
+
+    @property
+    def execution_id(self):
+        """ Id of execution session, sent in ExecutionHeader of each call """
+        return self._info['ExecutionID']
+
+    @property
+    def report_path(self):
+        """ Path to report on server, eg. /Report/Report1 """
+        return self._report_path
+
+    @property
+    def info(self):
+        """ Last ExecutionInfo of execution as dict """
+        return self._info
+
+    def call(self, action, values=()):
+        """ Call action of endpoint in execution's session """
+        return self._client.call(action, values, self.execution_id)
+
+    def set_parameters(self, params, language=None):
+        """ Set report's params, eg. {'item_id': 666, 'contractor_id': [9899, 12775]} """
+        response = self.call('SetExecutionParameters', [
+            ('Parameters', self._client.get_parameter_values(params)),
+            ('ParameterLanguage', language or 'en-us'),
+        ])
+        info = response.find(rs_tag('executionInfo'))
+        if info is not None:
+            self._info = parse_values(info)
+
+    def refresh_info(self):
+        """ Get ExecutionInfo from server, eg. NumPages after render """
+        self._info = parse_values(self.call('GetExecutionInfo').find(rs_tag('executionInfo')))
+        return self._info
+
+    def render(self, output_format, output_file=None, device_info=None, start_page=None, end_page=None):
+        """
+            Render execution's snapshot to output_format, eg. EXCELOPENXML, PDF, IMAGE.
+            start_page and end_page select pages of paginated formats. Rendered report is
+            written to output_file (file name or file object) or returned as bytes if
+            it isn't set. Returns (content or None, dict of Extension, MimeType, StreamIds...).
+        """
+        response = self.call('Render', [
+            ('Format', output_format),
+            ('DeviceInfo', self.get_device_info(device_info, start_page, end_page)),
+        ])
+
+        return self.save_result(response, output_file)
+
+    def render_stream(self, output_format, stream_id, output_file=None, device_info=None):
+        """ Render stream of last render, eg. image of HTML report, see render """
+        response = self.call('RenderStream', [
+            ('Format', output_format),
+            ('StreamID', stream_id),
+            ('DeviceInfo', self.get_device_info(device_info)),
+        ])
+
+        return self.save_result(response, output_file)
+
+    @staticmethod
+    def get_device_info(device_info=None, start_page=None, end_page=None):
+        """ DeviceInfo xml-string of render, device_info is dict of renderer's settings """
+        settings = dict(device_info or {})
+        if start_page is not None:
+            settings['StartPage'] = start_page
+            settings['EndPage'] = end_page if end_page is not None else start_page
+        root = etree.Element('DeviceInfo')
+        for name, value in sorted(settings.items()):
+            etree.SubElement(root, name).text = unicode(value)
+
+        return etree.tostring(root, encoding='unicode')
+
+    @staticmethod
+    def save_result(response, output_file):
+        """ Decode rendered content of response, see render """
+        content = b''
+        result = response.find(rs_tag('Result'))
+        if result is not None:
+            content = base64.b64decode(result.text or '')
+            response.remove(result)
+        render_info = parse_values(response)
+        if output_file is None:
+            return content, render_info
+        if hasattr(output_file, 'write'):
+            output_file.write(content)
+        else:
+            with open(output_file, 'wb') as report_file:
+                report_file.write(content)
+
+        return None, render_info
+
+
+if __name__ == '__main__':
+    with ReportExecutionClient('http://your-reporting.com/ReportServer', multiparams_divider=',') as client:
+        execution = client.load_report('/Report/Path', {'item_id': 666, 'contractor_id': '9899,12775,3459'})
+        execution.render('EXCELOPENXML', 'report.xlsx')
+        execution.render('PDF', 'report.pdf')
@@ -0,0 +1,366 @@
+# -*- coding: utf-8 -*-
+"""
+    Local stub of Reporting Services for testing clients offline.
+    Serves ReportExecution2005 SOAP endpoint with execution sessions: report is
+    run once per session and parameters, further renders reuse its snapshot.
+    URL access (?/Report/Path&rs:FORMAT=EXCEL) serves payloads of configured size
+    with latency, chunked transfer and injected errors, for load tests of SSRSReport.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python ssrs_stub.py --port 8080
+           ReportExecutionClient('http://localhost:8080/ReportServer')
+           SSRSReport('http://localhost:8080/ReportServer', '/Report/Path')
+    Notice: Rendered content is made by renderer(report_path, params, output_format,
+            device_info) -> bytes, default one describes the request as text.
+            Stub's counters are served as json by GET /StubStats.
+"""
+import argparse
+import base64
+import json
+import threading
+import time
+import uuid
+from BaseHTTPServer import HTTPServer, BaseHTTPRequestHandler
+from SocketServer import ThreadingMixIn
+from urllib import unquote
+
+from lxml import etree
+
+from ssrs_soap import SOAP_NS, RS_NS, EXECUTION_ENDPOINT, rs_tag, build_envelope
+
+# Format -> (extension, MIME type) of rendered report
+RENDER_FORMATS = {
+    'EXCELOPENXML': ('xlsx', 'application/vnd.openxmlformats-officedocument.spreadsheetml.sheet'),
+    'EXCEL': ('xls', 'application/vnd.ms-excel'),
+    'PDF': ('pdf', 'application/pdf'),
+    'IMAGE': ('tif', 'image/tiff'),
+    'CSV': ('csv', 'text/csv'),
+    'XML': ('xml', 'text/xml'),
+    'HTML4.0': ('html', 'text/html'),
+    'WORDOPENXML': ('docx', 'application/vnd.openxmlformats-officedocument.wordprocessingml.document'),
+}
+# Number of pages of reports rendered by stub
+STUB_PAGE_COUNT = 3
+# Size of chunk of URL access response
+STUB_CHUNK_SIZE = 64 * 1024
+# Path of stub's counters
+STATS_PATH = '/StubStats'
+
+
+def describe_request(report_path, params, output_format, device_info):
+    """ Default renderer of stub: request as json-text """
+    return json.dumps({
+        'report': report_path,
+        'params': params,
+        'format': output_format,
+        'device_info': device_info,
+    }, sort_keys=True)
+
+
+def parse_url_access(query):
+    """
+        Report path, params {name: [values]} and commands {name: value} of URL access query, eg.
+        /Report/Path&rs:FORMAT=EXCEL&item_id=666. Values are cp1251 as SSRSReport quotes them.
+    """
+    parts = query.split('&')
+    report_path = unquote(parts[0]).decode('cp1251')
+    params = {}
+    commands = {}
+    for part in parts[1:]:
+        name, _, value = part.partition('=')
+        value = unquote(value).decode('cp1251')
+        if name.lower().startswith('rs:'):
+            commands[name[3:].lower()] = value
+        elif name:
+            params.setdefault(name, []).append(value)
+
+    return report_path, params, commands
+
+
+def build_fault(error_code, message):
+    """ SOAP fault envelope with Reporting Services error code """
+    envelope = etree.Element('{%s}Envelope' % SOAP_NS, nsmap={'soap': SOAP_NS})
+    fault = etree.SubElement(etree.SubElement(envelope, '{%s}Body' % SOAP_NS), '{%s}Fault' % SOAP_NS)
+    etree.SubElement(fault, 'faultcode').text = 'soap:Server'
+    etree.SubElement(fault, 'faultstring').text = message
+    detail = etree.SubElement(fault, 'detail')
+    etree.SubElement(detail, rs_tag('ErrorCode'), nsmap={None: RS_NS}).text = error_code
+
+    return etree.tostring(envelope, xml_declaration=True, encoding='UTF-8')
+
+
+class StubFault(Exception):
+    """ Error returned to client as SOAP fault """
+
+    def __init__(self, error_code, message):
+        super(StubFault, self).__init__(message)
+        self.error_code = error_code
+
+
+class StubRequestHandler(BaseHTTPRequestHandler):
+    """ Handler of stub's requests, state of sessions is kept by server """
+    # Keep-alive connections and chunked responses
+    protocol_version = 'HTTP/1.1'
+
+    def setup(self):
+        BaseHTTPRequestHandler.setup(self)
+        self.server.count('connections')
+
+    def do_GET(self):
+        stub = self.server
+        path, _, query = self.path.partition('?')
+        if path == STATS_PATH:
+            return self.send_content(200, json.dumps(stub.get_stats(), sort_keys=True), 'application/json')
+        if not query or not path.rstrip('/').endswith('ReportServer'):
+            return self.send_content(404, b'Not found', 'text/plain')
+        request_number = stub.count('url_access')
+        if not stub.check_auth(self.headers.get('Authorization')):
+            stub.count('errors')
+            return self.send_content(401, b'Unauthorized', 'text/plain', {'WWW-Authenticate': 'Basic'})
+
+        report_path, params, commands = parse_url_access(query)
+        output_format = commands.get('format', 'HTML4.0').upper()
+        if stub.reports is not None and report_path not in stub.reports:
+            status, message = 404, 'rsItemNotFound: The item {0} cannot be found.'.format(report_path)
+        elif output_format not in RENDER_FORMATS:
+            status, message = 400, 'rsRenderingExtensionNotFound: Format {0} is not supported.'.format(output_format)
+        elif stub.error_every and not request_number % stub.error_every:
+            status, message = stub.error_code, 'Injected error'
+        else:
+            status, message = 200, None
+        if stub.latency:
+            # Time to first byte of report
+            time.sleep(stub.latency)
+        if message is not None:
+            stub.count('errors')
+            return self.send_content(status, message.encode('utf-8'), 'text/plain; charset=utf-8')
+
+        content = stub.get_payload(report_path, params, output_format)
+        self.send_response(200)
+        self.send_header('Content-Type', RENDER_FORMATS[output_format][1])
+        if stub.chunked:
+            self.send_header('Transfer-Encoding', 'chunked')
+        else:
+            self.send_header('Content-Length', str(len(content)))
+        self.end_headers()
+        for start in range(0, len(content), STUB_CHUNK_SIZE):
+            chunk = content[start:start + STUB_CHUNK_SIZE]
+            if stub.chunked:
+                self.wfile.write(b'{0:X}\r\n{1}\r\n'.format(len(chunk), chunk))
+            else:
+                self.wfile.write(chunk)
+        if stub.chunked:
+            self.wfile.write(b'0\r\n\r\n')
+        stub.count('sent_bytes', len(content))
+
+    def do_POST(self):
+        stub = self.server
+        # Body is read before errors are sent, so keep-alive connection stays usable
+        body = self.rfile.read(int(self.headers.get('Content-Length', 0)))
+        if not self.path.rstrip('/').endswith(EXECUTION_ENDPOINT):
+            return self.send_content(404, b'Not found', 'text/plain')
+        if not stub.check_auth(self.headers.get('Authorization')):
+            return self.send_content(401, b'Unauthorized', 'text/plain', {'WWW-Authenticate': 'Basic'})
+
+        request = etree.fromstring(body)
+        execution_id = request.findtext('{%s}Header/%s/%s' % (SOAP_NS, rs_tag('ExecutionHeader'),
+                                                              rs_tag('ExecutionID')))
+        call = request.find('{%s}Body' % SOAP_NS)[0]
+        action = etree.QName(call).localname
+        try:
+            execution_id, values = stub.call(action, call, execution_id)
+        except StubFault as fault:
+            return self.send_content(500, build_fault(fault.error_code, fault.args[0]), 'text/xml; charset=utf-8')
+        self.send_content(
+            200, build_envelope(action + 'Response', values, execution_id), 'text/xml; charset=utf-8'
+        )
+
+    def send_content(self, code, content, content_type, headers=None):
+        """ Send response with body """
+        self.send_response(code)
+        self.send_header('Content-Type', content_type)
+        self.send_header('Content-Length', str(len(content)))
+        for name, value in (headers or {}).items():
+            self.send_header(name, value)
+        self.end_headers()
+        self.wfile.write(content)
+
+    def log_message(self, format, *args):
+        """ Requests are logged if server is verbose """
+        if self.server.verbose:
+            BaseHTTPRequestHandler.log_message(self, format, *args)
+
+
+class StubReportServer(ThreadingMixIn, HTTPServer):
+    """
+        Stub of ReportServer. reports is collection of known report paths, any path is
+        known if it isn't set. auth is (user, password) of Basic auth, not checked if
+        it isn't set. stats counts calls by action and report runs, ie. snapshots made.
+        URL access serves payload_size bytes of rendered content, or reports[report_path]
+        bytes if reports is a dict, after latency seconds. Each error_every-th request
+        fails with error_code. stats counts connections, url_access requests and errors.
+    """
+    daemon_threads = True
+    # Backlog of concurrent connections of load tests
+    request_queue_size = 128
+
+    def __init__(self, address=('127.0.0.1', 0), reports=None, auth=None, renderer=describe_request,
+                 verbose=False, payload_size=None, latency=0, chunked=False, error_code=500, error_every=0):
+        HTTPServer.__init__(self, address, StubRequestHandler)
+        self.reports = reports
+        self.auth = auth
+        self.renderer = renderer
+        self.verbose = verbose
+        self.payload_size = payload_size
+        self.latency = latency
+        self.chunked = chunked
+        self.error_code = error_code
+        self.error_every = error_every
+        self.lock = threading.Lock()
+        # execution id -> {'report': ..., 'params': {name -> [values]}, 'has_snapshot': bool}
+        self.executions = {}
+        self.stats = {'report_runs': 0}
+
+    @property
+    def url(self):
+        """ Address of stub's ReportServer """
+        return 'http://{0}:{1}/ReportServer'.format(*self.server_address)
+
+    def start(self):
+        """ Serve in daemon thread """
+        thread = threading.Thread(target=self.serve_forever)
+        thread.daemon = True
+        thread.start()
+        return thread
+
+    def count(self, name, value=1):
+        """ Add value to stats' counter, returns new value """
+        with self.lock:
+            self.stats[name] = self.stats.get(name, 0) + value
+            return self.stats[name]
+
+    def get_stats(self):
+        """ Copy of stats """
+        with self.lock:
+            return dict(self.stats)
+
+    def get_payload(self, report_path, params, output_format):
+        """ Rendered content of URL access, repeated or cut to report's payload size """
+        content = self.renderer(report_path, params, output_format, '')
+        if isinstance(content, unicode):
+            content = content.encode('utf-8')
+        size = self.reports.get(report_path) if isinstance(self.reports, dict) else None
+        if size is None:
+            size = self.payload_size
+        if size is not None and content:
+            content = (content * (size // len(content) + 1))[:size]
+
+        return content
+
+    def check_auth(self, authorization):
+        """ Check Basic auth header, credentials are cp1251 as Reporting Services expects """
+        if not self.auth:
+            return True
+        if not authorization or not authorization.startswith('Basic '):
+            return False
+        user, _, password = base64.b64decode(authorization[6:]).decode('cp1251').partition(':')
+        return (user, password) == tuple(
+            value.decode('utf-8') if isinstance(value, bytes) else value for value in self.auth
+        )
+
+    def call(self, action, call, execution_id):
+        """ Run action of SOAP call, returns (execution id, response values) """
+        with self.lock:
+            self.stats[action] = self.stats.get(action, 0) + 1
+            if action == 'LoadReport':
+                report_path = call.findtext(rs_tag('Report'))
+                if self.reports is not None and report_path not in self.reports:
+                    raise StubFault('rsItemNotFound', 'The item {0} cannot be found.'.format(report_path))
+                execution_id = uuid.uuid4().hex
+                self.executions[execution_id] = {'report': report_path, 'params': {}, 'has_snapshot': False}
+                return execution_id, [('executionInfo', self.get_info(execution_id))]
+
+            execution = self.executions.get(execution_id)
+            if execution is None:
+                raise StubFault('rsExecutionNotFound', 'Execution {0} cannot be found.'.format(execution_id))
+            if action == 'SetExecutionParameters':
+                params = {}
+                for value in call.iterfind('{0}/{1}'.format(rs_tag('Parameters'), rs_tag('ParameterValue'))):
+                    params.setdefault(value.findtext(rs_tag('Name')), []).append(value.findtext(rs_tag('Value')))
+                execution['params'] = params
+                execution['has_snapshot'] = False
+                return execution_id, [('executionInfo', self.get_info(execution_id))]
+            if action == 'GetExecutionInfo':
+                return execution_id, [('executionInfo', self.get_info(execution_id))]
+            if action in ('Render', 'RenderStream'):
+                return execution_id, self.render(execution, call, action == 'RenderStream')
+
+        raise StubFault('rsOperationNotSupported', 'Action {0} is not supported.'.format(action))
+
+    def render(self, execution, call, is_stream):
+        """ Render execution's report, which is run once per snapshot """
+        output_format = call.findtext(rs_tag('Format'))
+        if output_format not in RENDER_FORMATS:
+            raise StubFault('rsRenderingExtensionNotFound', 'Format {0} is not supported.'.format(output_format))
+        if not execution['has_snapshot']:
+            # Report's data is processed on first render of session
+            self.stats['report_runs'] += 1
+            execution['has_snapshot'] = True
+        device_info = call.findtext(rs_tag('DeviceInfo')) or ''
+        if is_stream:
+            device_info += call.findtext(rs_tag('StreamID')) or ''
+        content = self.renderer(execution['report'], execution['params'], output_format, device_info)
+        extension, mime_type = RENDER_FORMATS[output_format]
+
+        return [
+            ('Result', base64.b64encode(content)),
+            ('Extension', None if is_stream else extension),
+            ('MimeType', mime_type),
+            ('Encoding', None if is_stream else 'utf-8'),
+            ('Warnings', []),
+            ('StreamIds', None if is_stream else []),
+        ]
+
+    def get_info(self, execution_id):
+        """ ExecutionInfo values of execution """
+        execution = self.executions[execution_id]
+        return [
+            ('ExecutionID', execution_id),
+            ('HasSnapshot', 'true' if execution['has_snapshot'] else 'false'),
+            ('NumPages', STUB_PAGE_COUNT if execution['has_snapshot'] else 0),
+            ('ReportPath', execution['report']),
+            ('Parameters', [
+                ('ReportParameter', [('Name', name), ('ValidValuesQueryBased', 'false')])
+                for name in sorted(execution['params'])
+            ]),
+        ]
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--host', default='127.0.0.1', help='address to listen')
+    parser.add_argument('--port', type=int, default=8080, help='port to listen')
+    parser.add_argument('--auth', nargs=2, metavar=('USER', 'PASSWORD'), help='require Basic auth')
+    parser.add_argument('--verbose', action='store_true', help='log requests')
+    parser.add_argument('--payload-size', type=int, help='bytes of URL access response')
+    parser.add_argument('--latency', type=float, default=0, help='seconds before URL access response')
+    parser.add_argument('--chunked', action='store_true', help='send URL access responses chunked')
+    parser.add_argument('--error-code', type=int, default=500, help='status of injected errors')
+    parser.add_argument('--error-every', type=int, default=0, help='fail each N-th URL access request')
+    args = parser.parse_args()
+
+    server = StubReportServer(
+        (args.host, args.port),
+        auth=args.auth,
+        verbose=args.verbose,
+        payload_size=args.payload_size,
+        latency=args.latency,
+        chunked=args.chunked,
+        error_code=args.error_code,
+        error_every=args.error_every,
+    )
+    print('Serving {0}'.format(server.url))
+    server.serve_forever()
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,365 @@
+# -*- coding: utf-8 -*-
+"""
+    Resident worker of report post-processing.
+    Runs fetch-and-convert and convert-only jobs in a long-living process,
+    so interpreter startup, imports, HTTP sessions and formula caches are
+    shared by all jobs. Jobs are received over Unix socket or spool directory.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python ssrs_worker.py --socket /var/run/ssrs_worker.sock
+           python ssrs_worker.py --spool-dir /var/spool/ssrs_worker
+    Notice: Jobs are run by threads, set 'workers' in job's options to parse
+            sheets of big workbooks in process pool.
+"""
+import argparse
+import json
+import logging
+import os
+import socket
+import threading
+import time
+import uuid
+from collections import OrderedDict
+from Queue import Queue, Full
+from SocketServer import StreamRequestHandler, ThreadingMixIn, UnixStreamServer
+
+from parse_xlsx_xml import ParseXlsx
+from pyssrs import SSRSClient, needs_parsing
+from report_metrics import Metrics
+
+# Statuses of job
+QUEUED = 'queued'
+RUNNING = 'running'
+DONE = 'done'
+ERROR = 'error'
+REJECTED = 'rejected'
+# Job of spool directory which didn't fit into queue and is submitted again later
+REQUEUED = 'requeued'
+# Number of finished jobs which statuses are kept
+FINISHED_JOBS_LIMIT = 1000
+# Extensions of spool directory's files
+JOB_FILE_EXT = '.job'
+RESULT_FILE_EXT = '.result'
+
+logger = logging.getLogger(__name__)
+
+
+class ReportWorker(object):
+    """
+        Pool of threads running jobs from bounded queue. Job is a dict:
+        {'action': 'convert', 'file_name': ..., 'output_file': ..., 'options': {...}} or
+        {'action': 'fetch', 'server': ..., 'report_path': ..., 'params': {...}, 'auth': [user, password],
+         'multiparams_divider': ..., 'output_format': ..., 'output_file': ..., 'options': {...}},
+        where options are ParseXlsx's options, eg. print_view, fit_to_width, fix_area.
+        Fetched report is saved as is if options aren't set, they can be set for xlsx formats only.
+    """
+
+    def __init__(self, workers=2, max_queue=16, cache=None, concurrency=4, timeout=None):
+        self.cache = cache
+        self.concurrency = concurrency
+        self.timeout = timeout
+        # Jobs over max_queue waiting ones are rejected
+        self.queue = Queue(max_queue)
+        # job id -> status, finished jobs are forgotten over FINISHED_JOBS_LIMIT
+        self.jobs = OrderedDict()
+        self.finished_count = 0
+        self.stats = dict.fromkeys((DONE, ERROR, REJECTED, REQUEUED), 0)
+        # (server, auth, divider) -> SSRSClient, so connections are reused by jobs
+        self.clients = {}
+        self.lock = threading.Lock()
+        self.finished = threading.Condition(self.lock)
+        self.threads = []
+        for _ in range(workers):
+            thread = threading.Thread(target=self.run)
+            thread.daemon = True
+            thread.start()
+            self.threads.append(thread)
+
+    def submit(self, job, on_finish=None, requeue=False):
+        """
+            Add job to queue. Returns job's status, which is REJECTED if queue is full.
+            With requeue job isn't rejected then, its status is REQUEUED and caller submits
+            it again later. on_finish(status) is called by worker's thread after job is finished.
+        """
+        status = {
+            'id': job.get('id') or uuid.uuid4().hex,
+            'status': QUEUED,
+            'submitted': time.time(),
+        }
+        with self.lock:
+            self.jobs[status['id']] = status
+        try:
+            self.queue.put_nowait((job, status, on_finish))
+        except Full:
+            if not requeue:
+                self.finish(status, REJECTED, 'Queue is full', on_finish)
+            else:
+                with self.lock:
+                    del self.jobs[status['id']]
+                    self.stats[REQUEUED] += 1
+                status['status'] = REQUEUED
+
+        return dict(status)
+
+    def get_status(self, job_id):
+        """ Status of job, None for unknown one """
+        with self.lock:
+            status = self.jobs.get(job_id)
+            return dict(status) if status else None
+
+    def wait(self, job_id, timeout=None):
+        """ Wait for job to be finished and return its status """
+        deadline = time.time() + timeout if timeout is not None else None
+        with self.lock:
+            while self.jobs.get(job_id, {}).get('status') in (QUEUED, RUNNING):
+                left = deadline - time.time() if deadline is not None else None
+                if left is not None and left <= 0:
+                    break
+                self.finished.wait(left)
+            status = self.jobs.get(job_id)
+            return dict(status) if status else None
+
+    def get_stats(self):
+        """ Numbers of queued, running and finished jobs """
+        with self.lock:
+            stats = dict(self.stats)
+            stats[QUEUED] = sum(1 for status in self.jobs.values() if status['status'] == QUEUED)
+            stats[RUNNING] = sum(1 for status in self.jobs.values() if status['status'] == RUNNING)
+        return stats
+
+    def run(self):
+        """ Worker thread's loop """
+        while True:
+            job, status, on_finish = self.queue.get()
+            if job is None:
+                break
+            with self.lock:
+                status['status'] = RUNNING
+                status['started'] = time.time()
+            try:
+                metrics = self.run_job(job)
+            except Exception as e:
+                self.finish(status, ERROR, repr(e), on_finish)
+            else:
+                status['counters'] = metrics.counters
+                self.finish(status, DONE, None, on_finish)
+
+    def run_job(self, job):
+        """ Run single job, returns its Metrics """
+        metrics = Metrics()
+        options = job.get('options') or {}
+        action = job.get('action')
+        if action == 'convert':
+            if not os.path.exists(job['file_name']):
+                raise IOError('Source file not found: {0}'.format(job['file_name']))
+            ParseXlsx(job['file_name'], run=True, output_file=job.get('output_file'), metrics=metrics, **options)
+        elif action == 'fetch':
+            # encode_auth expects utf-8 encoded strings, json gives unicode ones
+            auth = tuple(value.encode('utf-8') for value in job.get('auth') or ())
+            output_format = job.get('output_format', 'EXCEL')
+            parse = needs_parsing(output_format, options)
+            client = self.get_client(job['server'], auth, job.get('multiparams_divider', ''))
+            report = client.report(job['report_path'], job.get('params') or {}, output_format, metrics=metrics)
+            if parse:
+                # Report's metrics are passed to ParseXlsx
+                report.save_parsed_file(job['output_file'], **options)
+            else:
+                error = report.save_file(job['output_file'])
+                if error:
+                    raise IOError(error)
+        else:
+            raise ValueError('Unknown action {0!r}'.format(action))
+
+        return metrics
+
+    def get_client(self, server, auth, multiparams_divider):
+        """ Get client of server, creating it for the first job """
+        key = (server, auth, multiparams_divider)
+        with self.lock:
+            if key not in self.clients:
+                self.clients[key] = SSRSClient(
+                    server,
+                    auth=auth,
+                    multiparams_divider=multiparams_divider,
+                    concurrency=self.concurrency,
+                    timeout=self.timeout,
+                    cache=self.cache,
+                )
+            return self.clients[key]
+
+    def finish(self, status, result, error, on_finish):
+        """ Save job's result and latency, forgetting old finished jobs """
+        with self.lock:
+            now = time.time()
+            status['status'] = result
+            status['finished'] = now
+            status['latency'] = now - status['submitted']
+            if 'started' in status:
+                status['queue_time'] = status['started'] - status['submitted']
+                status['run_time'] = now - status['started']
+            if error:
+                status['error'] = error
+            self.stats[result] += 1
+            self.finished_count += 1
+            if self.finished_count > FINISHED_JOBS_LIMIT:
+                for job_id, old_status in self.jobs.items():
+                    if old_status['status'] not in (QUEUED, RUNNING):
+                        del self.jobs[job_id]
+                        self.finished_count -= 1
+                        break
+            self.finished.notify_all()
+            finished_status = dict(status)
+        if on_finish:
+            try:
+                on_finish(finished_status)
+            except Exception:
+                # Callback's error mustn't stop worker's thread
+                logger.exception('on_finish callback of job %s failed', finished_status['id'])
+
+    def close(self):
+        """ Finish queued jobs and stop threads """
+        for _ in self.threads:
+            self.queue.put((None, None, None))
+        for thread in self.threads:
+            thread.join()
+        for client in self.clients.values():
+            client.close()
+
+
+class JobRequestHandler(StreamRequestHandler):
+    """
+        Handler of worker's socket. Each line of request is json-object, each line
+        of response is json-status. Request is a job, with 'wait': true response is
+        sent when job is finished. {'action': 'status', 'id': ...} gets job's status
+        and {'action': 'stats'} gets worker's stats.
+    """
+
+    def handle(self):
+        worker = self.server.worker
+        for line in iter(self.rfile.readline, b''):
+            if not line.strip():
+                continue
+            try:
+                request = json.loads(line)
+                action = request.get('action')
+                if action == 'status':
+                    response = worker.get_status(request.get('id')) or {'id': request.get('id'), 'status': ERROR,
+                                                                         'error': 'Unknown job'}
+                elif action == 'stats':
+                    response = worker.get_stats()
+                else:
+                    response = worker.submit(request)
+                    if request.get('wait') and response['status'] == QUEUED:
+                        response = worker.wait(response['id'])
+            except Exception as e:
+                response = {'status': ERROR, 'error': repr(e)}
+            self.wfile.write(json.dumps(response) + b'\n')
+            self.wfile.flush()
+
+
+class WorkerServer(ThreadingMixIn, UnixStreamServer):
+    """ Unix socket server of ReportWorker """
+    daemon_threads = True
+
+    def __init__(self, socket_path, worker):
+        if os.path.exists(socket_path):
+            os.remove(socket_path)
+        UnixStreamServer.__init__(self, socket_path, JobRequestHandler)
+        self.worker = worker
+
+
+def send_job(socket_path, job, wait=True):
+    """ Send job to worker's socket and get its status """
+    client = socket.socket(socket.AF_UNIX, socket.SOCK_STREAM)
+    try:
+        client.connect(socket_path)
+        client.sendall(json.dumps(dict(job, wait=wait)) + b'\n')
+        response = client.makefile('rb').readline()
+    finally:
+        client.close()
+
+    return json.loads(response)
+
+
+def watch_spool_dir(spool_dir, worker, poll_interval=0.5, stop_event=None):
+    """
+        Run jobs of spool directory's '*.job' json-files. Job's file is renamed to
+        '*.job.running' while it's run and its status is written to '*.result' file.
+        Files are taken while worker's queue has place, others wait in directory.
+        '*.job.running' files left by stopped worker are run again, so directory
+        is shared by workers only if they are started together.
+    """
+    def write_result(job_path, status):
+        result_path = job_path[:-len(JOB_FILE_EXT)] + RESULT_FILE_EXT
+        with open(result_path + '.tmp', 'w') as result_file:
+            json.dump(status, result_file)
+        os.rename(result_path + '.tmp', result_path)
+        os.remove(job_path + '.running')
+
+    for file_name in os.listdir(spool_dir):
+        if file_name.endswith(JOB_FILE_EXT + '.running'):
+            job_path = os.path.join(spool_dir, file_name[:-len('.running')])
+            logger.warning('Job %s was interrupted, it is run again', job_path)
+            os.rename(job_path + '.running', job_path)
+
+    while not (stop_event and stop_event.is_set()):
+        job_paths = sorted(
+            (os.path.getmtime(path), path) for path in (
+                os.path.join(spool_dir, file_name) for file_name in os.listdir(spool_dir)
+                if file_name.endswith(JOB_FILE_EXT)
+            )
+        )
+        for _, job_path in job_paths:
+            if worker.queue.full():
+                break
+            try:
+                os.rename(job_path, job_path + '.running')
+            except OSError:
+                # Taken by another worker
+                continue
+            try:
+                with open(job_path + '.running') as job_file:
+                    job = json.load(job_file)
+            except ValueError as e:
+                write_result(job_path, {'status': ERROR, 'error': repr(e)})
+                continue
+            job.setdefault('id', os.path.basename(job_path)[:-len(JOB_FILE_EXT)])
+            status = worker.submit(
+                job, on_finish=lambda status, job_path=job_path: write_result(job_path, status), requeue=True
+            )
+            if status['status'] == REQUEUED:
+                # Queue was filled by socket's jobs, try again later
+                os.rename(job_path + '.running', job_path)
+        time.sleep(poll_interval)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('--socket', help='path of Unix socket to listen')
+    parser.add_argument('--spool-dir', help='directory with job files')
+    parser.add_argument('--workers', type=int, default=2, help='number of jobs run at the same time')
+    parser.add_argument('--max-queue', type=int, default=16, help='number of waiting jobs, others are rejected')
+    parser.add_argument('--cache-dir', help='directory of reports cache')
+    args = parser.parse_args()
+    if not args.socket and not args.spool_dir:
+        parser.error('--socket or --spool-dir is required')
+    logging.basicConfig(format='%(asctime)s %(levelname)s %(message)s')
+
+    cache = None
+    if args.cache_dir:
+        from ssrs_cache import ReportCache
+        cache = ReportCache(args.cache_dir)
+    worker = ReportWorker(workers=args.workers, max_queue=args.max_queue, cache=cache)
+    if args.socket:
+        server = WorkerServer(args.socket, worker)
+        if args.spool_dir:
+            thread = threading.Thread(target=server.serve_forever)
+            thread.daemon = True
+            thread.start()
+        else:
+            server.serve_forever()
+    if args.spool_dir:
+        watch_spool_dir(args.spool_dir, worker)
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,259 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of ParseXlsx on small workbooks like ones exported by Reporting Services.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+    Notice: build_workbook and read_workbook are used by tests of other modules too.
+"""
+from __future__ import unicode_literals
+
+import os
+import shutil
+import tempfile
+import unittest
+from xml.sax.saxutils import escape
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from lxml import etree
+
+from parse_xlsx_xml import ParseXlsx, process_many, SHARED_STRINGS_FILE, STYLES_FILE
+from xlsx_rc_convertor import split_address
+from xlsx_transforms import fix_nan, blank_errors
+
+NS = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_R = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+WORKSHEET_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+XML_DECLARATION = '<?xml version="1.0" encoding="UTF-8" standalone="yes"?>\n'
+STYLES_XML = XML_DECLARATION + (
+    '<styleSheet xmlns="{0}"><numFmts count="1"><numFmt numFmtId="164" formatCode="0.00"/></numFmts>'
+    '<fonts count="1"><font><sz val="11"/><name val="Calibri"/></font></fonts>'
+    '<fills count="1"><fill><patternFill patternType="none"/></fill></fills>'
+    '<borders count="1"><border><left/><right/><top/><bottom/><diagonal/></border></borders>'
+    '<cellStyleXfs count="1"><xf numFmtId="0" fontId="0" fillId="0" borderId="0"/></cellStyleXfs>'
+    '<cellXfs count="2"><xf numFmtId="0" fontId="0" fillId="0" borderId="0" xfId="0"/>'
+    '<xf numFmtId="164" fontId="0" fillId="0" borderId="0" xfId="0" applyNumberFormat="1"/></cellXfs>'
+    '</styleSheet>'
+).format(NS)
+# Sheet of report: header, values, NaN, error and R1C1-formula strings, some of them with format
+REPORT_SHEET = [
+    ('A1', 'Name'), ('B1', 'Price'), ('C1', 'Count'), ('D1', 'Total'),
+    ('A2', 'Apples'), ('B2', 1.5), ('C2', 4), ('D2', '=RC[-2]*RC[-1]@0.00@'),
+    ('A3', 'Pears'), ('B3', 2.25), ('C3', 'NaN'), ('D3', '=RC[-2]*RC[-1]@0.00@'),
+    ('A4', 'Plums'), ('B4', '#DIV/0!'), ('C4', 2), ('D4', '=RC[-2]*RC[-1]@0.00@'),
+    ('A5', 'Total'), ('D5', '=SUM(R2C:R[-1]C)'), ('E5', '=R1C1'),
+]
+
+
+def build_workbook(file_name, sheets, inline=False):
+    """
+        Write workbook with sheets [(address, value)]. Texts are shared strings (inline ones
+        with inline), 'NaN' and '#...' strings are NaN and error values.
+    """
+    strings = []
+    string_index = {}
+    sheet_xmls = []
+    for cells in sheets:
+        rows = []
+        for address, value in sorted(cells, key=lambda cell: split_address(cell[0])):
+            row = split_address(address)[0]
+            if not rows or rows[-1][0] != row:
+                rows.append((row, []))
+            if isinstance(value, bool):
+                cell = '<c r="{0}" t="b"><v>{1}</v></c>'.format(address, int(value))
+            elif isinstance(value, (int, float)) or value == 'NaN':
+                cell = '<c r="{0}"><v>{1}</v></c>'.format(address, value)
+            elif value.startswith('#'):
+                cell = '<c r="{0}" t="e"><v>{1}</v></c>'.format(address, value)
+            elif inline:
+                cell = '<c r="{0}" s="1" t="inlineStr"><is><t>{1}</t></is></c>'.format(address, escape(value))
+            else:
+                if value not in string_index:
+                    string_index[value] = len(strings)
+                    strings.append(value)
+                cell = '<c r="{0}" s="1" t="s"><v>{1}</v></c>'.format(address, string_index[value])
+            rows[-1][1].append(cell)
+        sheet_xmls.append(XML_DECLARATION + (
+            '<worksheet xmlns="{0}" xmlns:r="{1}"><sheetViews><sheetView workbookViewId="0"/></sheetViews>'
+            '<sheetData>{2}</sheetData><pageSetup orientation="portrait"/></worksheet>'
+        ).format(NS, NS_R, ''.join(
+            '<row r="{0}">{1}</row>'.format(row, ''.join(row_cells)) for row, row_cells in rows
+        )))
+
+    with ZipFile(file_name, 'w', ZIP_DEFLATED) as output_zip:
+        output_zip.writestr('xl/workbook.xml', XML_DECLARATION + (
+            '<workbook xmlns="{0}" xmlns:r="{1}"><sheets>{2}</sheets></workbook>'
+        ).format(NS, NS_R, ''.join(
+            '<sheet name="Sheet{0}" sheetId="{0}" r:id="rId{0}"/>'.format(n) for n in range(1, len(sheets) + 1)
+        )))
+        output_zip.writestr('xl/_rels/workbook.xml.rels', XML_DECLARATION + (
+            '<Relationships xmlns="http://schemas.openxmlformats.org/package/2006/relationships">{0}</Relationships>'
+        ).format(''.join(
+            '<Relationship Id="rId{0}" Type="{1}/worksheet" Target="worksheets/sheet{0}.xml"/>'.format(n, NS_R)
+            for n in range(1, len(sheets) + 1)
+        )))
+        output_zip.writestr('[Content_Types].xml', XML_DECLARATION + (
+            '<Types xmlns="http://schemas.openxmlformats.org/package/2006/content-types">'
+            '<Default Extension="xml" ContentType="application/xml"/>{0}</Types>'
+        ).format(''.join(
+            '<Override PartName="/xl/worksheets/sheet{0}.xml" ContentType="{1}"/>'.format(n, WORKSHEET_CONTENT_TYPE)
+            for n in range(1, len(sheets) + 1)
+        )))
+        output_zip.writestr(STYLES_FILE, STYLES_XML)
+        for n, sheet_xml in enumerate(sheet_xmls, 1):
+            output_zip.writestr('xl/worksheets/sheet{0}.xml'.format(n), sheet_xml.encode('utf-8'))
+        if not inline:
+            output_zip.writestr(SHARED_STRINGS_FILE, (XML_DECLARATION + (
+                '<sst xmlns="{0}" count="{1}" uniqueCount="{1}">{2}</sst>'
+            ).format(NS, len(strings), ''.join('<si><t>{0}</t></si>'.format(escape(text)) for text in strings))
+            ).encode('utf-8'))
+
+
+def read_workbook(file_name):
+    """
+        Read cells of workbook's sheets as [{address: (type, value, formula, style)}], values of
+        shared strings are their texts. Fails on cells referring to missing shared strings.
+    """
+    with ZipFile(file_name, 'r') as source_zip:
+        assert source_zip.testzip() is None
+        strings = []
+        if SHARED_STRINGS_FILE in source_zip.NameToInfo:
+            sst = etree.fromstring(source_zip.read(SHARED_STRINGS_FILE))
+            strings = [si.findtext('{%s}t' % NS) for si in sst]
+            assert int(sst.get('uniqueCount')) == len(strings)
+        sheets = []
+        sheet_names = sorted(
+            (name for name in source_zip.namelist() if name.startswith('xl/worksheets/sheet')),
+            key=lambda name: int(name[len('xl/worksheets/sheet'):-len('.xml')]),
+        )
+        for sheet_name in sheet_names:
+            cells = {}
+            for c_tag in etree.fromstring(source_zip.read(sheet_name)).iter('{%s}c' % NS):
+                cell_type = c_tag.get('t', 'n')
+                value = c_tag.findtext('{%s}v' % NS)
+                if cell_type == 's':
+                    value = strings[int(value)]
+                elif cell_type == 'inlineStr':
+                    value = c_tag.findtext('{%s}is/{%s}t' % (NS, NS))
+                f_tag = c_tag.find('{%s}f' % NS)
+                cells[c_tag.get('r')] = (cell_type, value, f_tag.text if f_tag is not None else None, c_tag.get('s'))
+            sheets.append(cells)
+
+    return sheets
+
+
+class WorkbookTestCase(unittest.TestCase):
+    """ Test case with temp dir for workbooks """
+
+    def setUp(self):
+        self.temp_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.temp_dir)
+
+    def make_workbook(self, sheets=(REPORT_SHEET,), name='report.xlsx', inline=False):
+        """ Build workbook in temp dir, returns its file name """
+        file_name = os.path.join(self.temp_dir, name)
+        build_workbook(file_name, sheets, inline)
+        return file_name
+
+    def parse(self, file_name, **options):
+        """ Parse workbook to new file, returns cells of its sheets """
+        output_file = file_name + '.parsed.xlsx'
+        ParseXlsx(file_name, run=True, output_file=output_file, **options)
+        return read_workbook(output_file)
+
+
+class ParseXlsxTest(WorkbookTestCase):
+
+    def check_report_sheet(self, cells):
+        """ Check cells of parsed REPORT_SHEET """
+        self.assertEqual(cells['A4'][1], 'Plums')
+        self.assertEqual(cells['C3'][:2], ('n', '0'))
+        self.assertEqual(cells['D3'][2], 'B3*C3')
+        self.assertEqual(cells['D5'][2], 'SUM(D$2:D4)')
+        self.assertEqual(cells['E5'][2], '$A$1')
+        self.assertIsNone(cells['D5'][1])
+        # Formulas with format get new cell style
+        self.assertNotEqual(cells['D2'][3], '1')
+        self.assertEqual(cells['D5'][3], '1')
+
+    def test_shared_strings(self):
+        file_name = self.make_workbook()
+        self.check_report_sheet(self.parse(file_name)[0])
+        with ZipFile(file_name + '.parsed.xlsx') as output_zip:
+            sst = etree.fromstring(output_zip.read(SHARED_STRINGS_FILE))
+        # Formula strings are pruned
+        self.assertEqual([si.findtext('{%s}t' % NS) for si in sst],
+                         ['Name', 'Price', 'Count', 'Total', 'Apples', 'Pears', 'Plums'])
+
+    def test_inline_strings(self):
+        self.check_report_sheet(self.parse(self.make_workbook(inline=True))[0])
+
+    def test_streaming(self):
+        file_name = self.make_workbook()
+        self.assertEqual(self.parse(file_name, streaming=True), self.parse(file_name))
+
+    def test_workers(self):
+        file_name = self.make_workbook([REPORT_SHEET, REPORT_SHEET[:8], REPORT_SHEET])
+        sheets = self.parse(file_name, workers=2)
+        self.assertEqual(sheets, self.parse(file_name))
+        self.check_report_sheet(sheets[2])
+
+    def test_shared_formulas(self):
+        cells = self.parse(self.make_workbook(), shared_formulas=True)[0]
+        self.assertEqual(cells['D2'][2], 'B2*C2')
+        self.assertEqual(cells['D3'][2], None)
+        self.assertEqual(cells['D5'][2], 'SUM(D$2:D4)')
+        with ZipFile(self.temp_dir + '/report.xlsx.parsed.xlsx') as output_zip:
+            sheet = etree.fromstring(output_zip.read('xl/worksheets/sheet1.xml'))
+        f_tags = dict((f_tag.getparent().get('r'), f_tag) for f_tag in sheet.iter('{%s}f' % NS))
+        self.assertEqual(f_tags['D2'].attrib, {'t': 'shared', 'ref': 'D2:D4', 'si': '0'})
+        self.assertEqual(f_tags['D4'].attrib, {'t': 'shared', 'si': '0'})
+
+    def test_custom_transforms(self):
+        # Formula strings aren't converted, so they are kept in sharedStrings
+        cells = self.parse(self.make_workbook(), transforms=[fix_nan, blank_errors])[0]
+        self.assertEqual(cells['D3'][:3], ('s', '=RC[-2]*RC[-1]@0.00@', None))
+        self.assertEqual(cells['A5'][:2], ('s', 'Total'))
+        self.assertEqual(cells['C3'][:2], ('n', '0'))
+        self.assertEqual(cells['B4'][:2], ('n', None))
+
+    def test_unchanged_sheet_is_copied(self):
+        file_name = self.make_workbook([REPORT_SHEET, [('A1', 'Name'), ('B1', 1)]])
+        sheets = self.parse(file_name)
+        self.assertEqual(sheets[1], {'A1': ('s', 'Name', None, '1'), 'B1': ('n', '1', None, None)})
+
+
+class ProcessManyTest(WorkbookTestCase):
+
+    def test_output_dir(self):
+        file_names = [self.make_workbook(name='report{0}.xlsx'.format(n)) for n in range(3)]
+        output_dir = os.path.join(self.temp_dir, 'out')
+        os.mkdir(output_dir)
+        results = process_many(file_names + [os.path.join(self.temp_dir, 'missing.xlsx')], workers=2,
+                               output_dir=output_dir)
+        self.assertEqual([file_name for file_name, _, _ in results], file_names + [results[3][0]])
+        self.assertEqual([error for _, _, error in results[:3]], [None] * 3)
+        self.assertIsInstance(results[3][2], IOError)
+        for n in range(3):
+            self.assertEqual(read_workbook(os.path.join(output_dir, 'report{0}.xlsx'.format(n)))[0]['D5'][2],
+                             'SUM(D$2:D4)')
+
+    def test_same_names_in_other_dirs(self):
+        file_names = []
+        for dir_name in ('first', 'second'):
+            os.mkdir(os.path.join(self.temp_dir, dir_name))
+            file_names.append(self.make_workbook(
+                [REPORT_SHEET + [('A6', dir_name)]], name=os.path.join(dir_name, 'report.xlsx')
+            ))
+        output_dir = os.path.join(self.temp_dir, 'out')
+        os.mkdir(output_dir)
+        results = process_many(file_names, workers=2, output_dir=output_dir)
+        self.assertIsNone(results[0][2])
+        # Second workbook would overwrite output of the first one
+        self.assertIsInstance(results[1][2], ValueError)
+        self.assertEqual(read_workbook(os.path.join(output_dir, 'report.xlsx'))[0]['A6'][1], 'first')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of SSRSReport and SSRSClient against local stub of Reporting Services.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+"""
+import unittest
+from io import BytesIO
+
+import requests
+
+from pyssrs import SSRSReport, SSRSClient
+from ssrs_stub import StubReportServer
+
+PAYLOAD_SIZE = 512 * 1024
+
+
+class StubServerTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubReportServer(payload_size=PAYLOAD_SIZE)
+        self.stub.start()
+
+    def tearDown(self):
+        self.stub.shutdown()
+        self.stub.server_close()
+
+
+class SSRSReportTest(StubServerTest):
+
+    def test_connection_string(self):
+        report = SSRSReport('http://server/ReportServer', '/Report/Path', params={'item_id': 666})
+        self.assertEqual(report.connection_string, 'http://server/ReportServer?/Report/Path&rs:FORMAT=EXCEL&item_id=666')
+
+    def test_save_file(self):
+        report = SSRSReport(self.stub.url, '/Report/Path', params={'item_id': 666})
+        output_file = BytesIO()
+        self.assertEqual(report.save_file(output_file), '')
+        self.assertEqual(len(output_file.getvalue()), PAYLOAD_SIZE)
+        self.assertEqual([timing[0] for timing in report.metrics.timings], ['fetch_first_byte', 'download'])
+
+    def test_server_error(self):
+        self.stub.error_every = 1
+        report = SSRSReport(self.stub.url, '/Report/Path')
+        self.assertEqual(report.save_file(BytesIO()), 'Server error: 500')
+        self.assertRaises(requests.HTTPError, report.spool_file)
+
+
+class SSRSClientTest(StubServerTest):
+
+    def test_fetch_reports_read_bodies(self):
+        jobs = [('/Report/Path', {'item_id': number}, 'EXCEL') for number in range(6)]
+        with SSRSClient(self.stub.url, concurrency=2) as client:
+            results = []
+            for job, report, error in client.fetch_reports(jobs):
+                self.assertIsNone(error)
+                # Body is downloaded in worker, so connection is back in pool
+                self.assertEqual(report.report_request.raw.tell(), PAYLOAD_SIZE)
+                results.append((job, report))
+        # Bodies can't be read from stopped server anymore
+        self.stub.shutdown()
+        self.stub.server_close()
+
+        self.assertEqual(sorted(job for job, _ in results), sorted(jobs))
+        for job, report in results:
+            output_file = BytesIO()
+            self.assertEqual(report.save_file(output_file), '')
+            self.assertEqual(len(output_file.getvalue()), PAYLOAD_SIZE)
+            self.assertIn(b'"item_id": ["{0}"]'.format(job[1]['item_id']), output_file.getvalue())
+
+    def test_fetch_reports_error(self):
+        self.stub.error_every = 2
+        jobs = [('/Report/Path', {'item_id': number}, 'EXCEL') for number in range(4)]
+        with SSRSClient(self.stub.url, concurrency=2) as client:
+            errors = [error for _, _, error in client.fetch_reports(jobs)]
+        self.assertEqual(len([error for error in errors if isinstance(error, requests.HTTPError)]), 2)
+        self.assertEqual(errors.count(None), 2)
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,97 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of on-disk cache of rendered reports.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+"""
+import os
+import shutil
+import tempfile
+import time
+import unittest
+from io import BytesIO
+
+from pyssrs import SSRSReport
+from ssrs_cache import ReportCache, normalize_connection_string, CACHE_FILE_EXT
+from ssrs_stub import StubReportServer
+
+
+class ReportCacheTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+
+    def tearDown(self):
+        shutil.rmtree(self.cache_dir)
+
+    def test_key(self):
+        self.assertEqual(
+            normalize_connection_string('http://server/ReportServer?/Report&rs:FORMAT=EXCEL&b=2&a=1&a=3'),
+            'http://server/ReportServer?/Report&a=1&a=3&b=2&rs:FORMAT=EXCEL',
+        )
+        key = ReportCache.key('http://server/ReportServer?/Report&b=2&a=1', 'excel')
+        self.assertEqual(key, ReportCache.key('http://server/ReportServer?/Report&a=1&b=2', 'EXCEL'))
+        self.assertNotEqual(key, ReportCache.key('http://server/ReportServer?/Report&a=1&b=2', 'PDF'))
+        self.assertNotEqual(key, ReportCache.key('http://server/ReportServer?/Report&a=1&b=2', 'EXCEL',
+                                                 {'print_view': True}))
+
+    def test_put_and_get(self):
+        cache = ReportCache(self.cache_dir)
+        self.assertIsNone(cache.get('missing'))
+        for key, source in (('chunks', [b'ab', b'cd']), ('file', BytesIO(b'abcd'))):
+            with cache.put(key, source) as cached_file:
+                self.assertEqual(cached_file.read(), b'abcd')
+            with cache.get(key) as cached_file:
+                self.assertEqual(cached_file.read(), b'abcd')
+        self.assertEqual([name for name in os.listdir(self.cache_dir) if not name.endswith(CACHE_FILE_EXT)], [])
+
+    def test_ttl(self):
+        cache = ReportCache(self.cache_dir, ttl=60)
+        cache.put('old', [b'data']).close()
+        os.utime(cache.get_path('old'), (time.time(), time.time() - 120))
+        self.assertIsNone(cache.get('old'))
+        cache.put('new', [b'data']).close()
+        self.assertFalse(os.path.exists(cache.get_path('old')))
+
+    def test_lru_eviction(self):
+        cache = ReportCache(self.cache_dir, max_size=250)
+        for number, key in enumerate(('first', 'second')):
+            cache.put(key, [b'x' * 100]).close()
+            os.utime(cache.get_path(key), (time.time() - 100 + number, time.time()))
+        # First file is used last, so second one is evicted
+        cache.get('first').close()
+        cache.put('third', [b'x' * 100]).close()
+        self.assertEqual(sorted(os.listdir(self.cache_dir)), sorted(
+            os.path.basename(cache.get_path(key)) for key in ('first', 'third')
+        ))
+        cache.clear()
+        self.assertEqual(os.listdir(self.cache_dir), [])
+
+
+class CachedReportTest(unittest.TestCase):
+
+    def setUp(self):
+        self.cache_dir = tempfile.mkdtemp()
+        self.stub = StubReportServer()
+        self.stub.start()
+
+    def tearDown(self):
+        self.stub.shutdown()
+        self.stub.server_close()
+        shutil.rmtree(self.cache_dir)
+
+    def test_report_is_fetched_once(self):
+        cache = ReportCache(self.cache_dir)
+        contents = []
+        for params in ({'a': 1, 'b': 2}, {'b': 2, 'a': 1}):
+            output_file = BytesIO()
+            report = SSRSReport(self.stub.url, '/Report/Path', params=params, cache=cache)
+            self.assertEqual(report.save_file(output_file), '')
+            contents.append(output_file.getvalue())
+        self.assertEqual(contents[0], contents[1])
+        self.assertIn(b'/Report/Path', contents[0])
+        self.assertEqual(self.stub.get_stats()['url_access'], 1)
+
+
+if __name__ == '__main__':
+    unittest.main()
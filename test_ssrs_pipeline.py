@@ -0,0 +1,84 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of fetch -> convert -> deliver pipeline against local stub of Reporting Services.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+"""
+import os
+import unittest
+
+from pyssrs import SSRSClient
+from report_metrics import Metrics
+from ssrs_pipeline import ReportPipeline, FETCH, CONVERT, DELIVER
+from ssrs_stub import StubReportServer
+from test_parse_xlsx_xml import WorkbookTestCase, read_workbook
+
+
+class ReportPipelineTest(WorkbookTestCase):
+
+    def setUp(self):
+        super(ReportPipelineTest, self).setUp()
+        with open(self.make_workbook(), 'rb') as report_file:
+            content = report_file.read()
+        self.stub = StubReportServer(reports=['/Report/Path'], renderer=lambda *args: content)
+        self.stub.start()
+        self.output_dir = os.path.join(self.temp_dir, 'output')
+        os.mkdir(self.output_dir)
+
+    def tearDown(self):
+        self.stub.shutdown()
+        self.stub.server_close()
+        super(ReportPipelineTest, self).tearDown()
+
+    def test_run(self):
+        jobs = [
+            {'name': 'converted.xlsx', 'report_path': '/Report/Path', 'options': {'streaming': True}},
+            {'name': 'raw.xlsx', 'report_path': '/Report/Path', 'params': {'item_id': 666}},
+            {'name': 'missing.xlsx', 'report_path': '/Missing'},
+        ]
+        jobs.append(dict(jobs[0], name='openxml.xlsx', output_format='EXCELOPENXML'))
+        metrics = Metrics()
+        with SSRSClient(self.stub.url, concurrency=2) as client:
+            pipeline = ReportPipeline(client, self.output_dir, fetch_workers=2, convert_workers=2, metrics=metrics)
+            results = dict((job['name'], (output_file, error)) for job, output_file, error in pipeline.run(jobs))
+
+        self.assertEqual(results['converted.xlsx'], (os.path.join(self.output_dir, 'converted.xlsx'), None))
+        self.assertEqual(read_workbook(results['converted.xlsx'][0])[0]['D2'][2], 'B2*C2')
+        self.assertEqual(read_workbook(results['openxml.xlsx'][0])[0]['D2'][2], 'B2*C2')
+        self.assertEqual(read_workbook(results['raw.xlsx'][0])[0]['D2'][1], '=RC[-2]*RC[-1]@0.00@')
+        self.assertIsNone(results['missing.xlsx'][0])
+        self.assertIn('404', str(results['missing.xlsx'][1]))
+        # Work directory is removed, failed report isn't delivered
+        self.assertEqual(sorted(os.listdir(self.output_dir)), ['converted.xlsx', 'openxml.xlsx', 'raw.xlsx'])
+
+        stats = pipeline.get_stats()
+        self.assertEqual((stats[FETCH]['done'], stats[FETCH]['errors']), (3, 1))
+        self.assertEqual(stats[DELIVER]['done'], 3)
+        stages = [labels['stage'] for name, _, labels in metrics.timings if name == 'stage']
+        self.assertEqual(sorted(set(stages)), sorted([FETCH, CONVERT, DELIVER]))
+        self.assertEqual(metrics.counters['formulas_converted'], 10)
+
+    def test_failed_jobs(self):
+        jobs = [
+            {'name': 'report.xlsx', 'report_path': '/Report/Path', 'options': {'streaming': True}},
+            {'name': 'report.xlsx', 'report_path': '/Report/Path'},
+            {'name': 'report.pdf', 'report_path': '/Report/Path', 'output_format': 'PDF',
+             'options': {'print_view': True}},
+        ]
+        with SSRSClient(self.stub.url) as client:
+            pipeline = ReportPipeline(client, self.output_dir, fetch_workers=1, convert_workers=1)
+            results = [(job, output_file, error) for job, output_file, error in pipeline.run(jobs)]
+
+        self.assertEqual(len(results), 3)
+        errors = dict((id(job), error) for job, _, error in results)
+        self.assertIsNone(errors[id(jobs[0])])
+        # Output of earlier job isn't overwritten by job with the same name
+        self.assertIsInstance(errors[id(jobs[1])], ValueError)
+        self.assertEqual(read_workbook(os.path.join(self.output_dir, 'report.xlsx'))[0]['D2'][2], 'B2*C2')
+        # Options of format which isn't xlsx aren't dropped silently
+        self.assertIn('not xlsx', str(errors[id(jobs[2])]))
+        self.assertEqual(os.listdir(self.output_dir), ['report.xlsx'])
+
+
+if __name__ == '__main__':
+    unittest.main()
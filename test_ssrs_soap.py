@@ -0,0 +1,87 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of ReportExecution2005 SOAP client against local stub of Reporting Services.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+"""
+from __future__ import unicode_literals
+
+import json
+import unittest
+from io import BytesIO
+
+import requests
+
+from report_metrics import Metrics
+from ssrs_soap import ReportExecutionClient, ReportExecution, ReportExecutionError
+from ssrs_stub import StubReportServer
+
+# Credentials are utf-8 as SSRSReport takes them
+AUTH = (b'user', 'пароль'.encode('utf-8'))
+
+
+class ReportExecutionClientTest(unittest.TestCase):
+
+    def setUp(self):
+        self.stub = StubReportServer(reports=['/Report/Path'], auth=AUTH)
+        self.stub.start()
+        self.client = ReportExecutionClient(self.stub.url, AUTH, multiparams_divider=',')
+
+    def tearDown(self):
+        self.client.close()
+        self.stub.shutdown()
+        self.stub.server_close()
+
+    def test_load_and_render(self):
+        execution = self.client.load_report('/Report/Path', {'item_id': 666, 'contractor_id': '9899,12775'})
+        self.assertEqual(execution.info['ReportPath'], '/Report/Path')
+        self.assertEqual(sorted(item['Name'] for item in execution.info['Parameters']), ['contractor_id', 'item_id'])
+
+        content, render_info = execution.render('EXCELOPENXML')
+        self.assertEqual(json.loads(content)['params'], {'item_id': ['666'], 'contractor_id': ['9899', '12775']})
+        self.assertEqual(render_info['Extension'], 'xlsx')
+        output_file = BytesIO()
+        self.assertEqual(execution.render('PDF', output_file, start_page=2)[0], None)
+        self.assertEqual(json.loads(output_file.getvalue())['device_info'],
+                         '<DeviceInfo><EndPage>2</EndPage><StartPage>2</StartPage></DeviceInfo>')
+        self.assertEqual(execution.refresh_info()['NumPages'], '3')
+        # Renders of session reuse its snapshot
+        stats = self.stub.get_stats()
+        self.assertEqual((stats['report_runs'], stats['Render'], stats['LoadReport']), (1, 2, 1))
+
+    def test_set_parameters(self):
+        execution = self.client.load_report('/Report/Path')
+        execution.render('CSV')
+        execution.set_parameters({'item_id': [1, 2]})
+        self.assertEqual(json.loads(execution.render('CSV')[0])['params'], {'item_id': ['1', '2']})
+        self.assertEqual(self.stub.get_stats()['report_runs'], 2)
+
+    def test_faults(self):
+        with self.assertRaises(ReportExecutionError) as context:
+            self.client.load_report('/Missing')
+        self.assertEqual(context.exception.error_code, 'rsItemNotFound')
+        self.assertEqual(context.exception.fault_code, 'soap:Server')
+
+        execution = self.client.load_report('/Report/Path')
+        with self.assertRaises(ReportExecutionError) as context:
+            execution.render('UNKNOWN')
+        self.assertEqual(context.exception.error_code, 'rsRenderingExtensionNotFound')
+        expired = ReportExecution(self.client, '/Report/Path', {'ExecutionID': 'expired'})
+        with self.assertRaises(ReportExecutionError) as context:
+            expired.render('PDF')
+        self.assertEqual(context.exception.error_code, 'rsExecutionNotFound')
+
+    def test_http_errors(self):
+        with ReportExecutionClient(self.stub.url, (b'user', b'wrong')) as client:
+            self.assertRaises(requests.HTTPError, client.load_report, '/Report/Path')
+
+    def test_metrics(self):
+        metrics = Metrics()
+        with ReportExecutionClient(self.stub.url, AUTH, metrics=metrics) as client:
+            client.load_report('/Report/Path').render('PDF')
+        actions = sorted(labels['action'] for name, _, labels in metrics.timings if name == 'soap_call')
+        self.assertEqual(actions, ['LoadReport', 'Render'])
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,156 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of resident worker: job queue, callbacks, socket and spool directory.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+"""
+import json
+import logging
+import os
+import threading
+import time
+import unittest
+
+from ssrs_worker import (ReportWorker, WorkerServer, send_job, watch_spool_dir, DONE, ERROR, QUEUED, REJECTED,
+                         REQUEUED, JOB_FILE_EXT, RESULT_FILE_EXT)
+from ssrs_stub import StubReportServer
+from test_parse_xlsx_xml import WorkbookTestCase, read_workbook
+
+
+class ReportWorkerTest(WorkbookTestCase):
+
+    def setUp(self):
+        super(ReportWorkerTest, self).setUp()
+        self.worker = None
+
+    def tearDown(self):
+        if self.worker is not None:
+            self.worker.close()
+        super(ReportWorkerTest, self).tearDown()
+
+    def convert_job(self, **job):
+        """ Job converting new workbook to output file """
+        file_name = self.make_workbook(name='report{0}.xlsx'.format(len(os.listdir(self.temp_dir))))
+        return dict({'action': 'convert', 'file_name': file_name, 'output_file': file_name + '.out.xlsx'}, **job)
+
+    def test_convert(self):
+        self.worker = ReportWorker(workers=1)
+        job = self.convert_job()
+        status = self.worker.wait(self.worker.submit(job)['id'], timeout=30)
+        self.assertEqual(status['status'], DONE)
+        self.assertEqual(read_workbook(job['output_file'])[0]['D3'][2], 'B3*C3')
+        self.assertEqual(status['counters']['formulas_converted'], 5)
+
+    def test_error(self):
+        self.worker = ReportWorker(workers=1)
+        status = self.worker.submit({'action': 'convert', 'file_name': os.path.join(self.temp_dir, 'missing.xlsx')})
+        status = self.worker.wait(status['id'], timeout=30)
+        self.assertEqual(status['status'], ERROR)
+        self.assertIn('Source file not found', status['error'])
+
+    def test_fetch(self):
+        with open(self.make_workbook(), 'rb') as report_file:
+            content = report_file.read()
+        stub = StubReportServer(renderer=lambda *args: content)
+        stub.start()
+        try:
+            self.worker = ReportWorker(workers=1)
+            output_file = os.path.join(self.temp_dir, 'fetched.xlsx')
+            job = {'action': 'fetch', 'server': stub.url, 'report_path': '/Report/Path', 'output_file': output_file,
+                   'options': {'streaming': True}}
+            for output_format in ('EXCEL', 'EXCELOPENXML'):
+                status = self.worker.submit(dict(job, output_format=output_format))
+                self.assertEqual(self.worker.wait(status['id'], timeout=30)['status'], DONE)
+                self.assertEqual(read_workbook(output_file)[0]['D2'][2], 'B2*C2')
+                os.remove(output_file)
+            # Options of format which isn't xlsx aren't dropped silently
+            status = self.worker.submit(dict(job, output_format='PDF'))
+            status = self.worker.wait(status['id'], timeout=30)
+            self.assertEqual(status['status'], ERROR)
+            self.assertIn('not xlsx', status['error'])
+            self.assertFalse(os.path.exists(output_file))
+        finally:
+            stub.shutdown()
+            stub.server_close()
+
+    def test_failed_callback_keeps_worker_running(self):
+        self.worker = ReportWorker(workers=1)
+
+        def on_finish(status):
+            raise RuntimeError('Callback failed')
+
+        logger = logging.getLogger('ssrs_worker')
+        logger.disabled = True
+        try:
+            first = self.worker.submit(self.convert_job(), on_finish=on_finish)
+            second = self.worker.submit(self.convert_job())
+            self.assertEqual(self.worker.wait(second['id'], timeout=30)['status'], DONE)
+        finally:
+            logger.disabled = False
+        self.assertEqual(self.worker.get_status(first['id'])['status'], DONE)
+
+    def test_full_queue(self):
+        # Worker without threads doesn't take jobs from queue
+        self.worker = ReportWorker(workers=0, max_queue=1)
+        self.assertEqual(self.worker.submit(self.convert_job())['status'], QUEUED)
+        self.assertEqual(self.worker.submit(self.convert_job(), requeue=True)['status'], REQUEUED)
+        self.assertEqual(self.worker.submit(self.convert_job())['status'], REJECTED)
+        stats = self.worker.get_stats()
+        self.assertEqual((stats[QUEUED], stats[REQUEUED], stats[REJECTED]), (1, 1, 1))
+
+    def test_socket(self):
+        self.worker = ReportWorker(workers=1)
+        socket_path = os.path.join(self.temp_dir, 'worker.sock')
+        server = WorkerServer(socket_path, self.worker)
+        thread = threading.Thread(target=server.serve_forever)
+        thread.daemon = True
+        thread.start()
+        try:
+            job = self.convert_job()
+            self.assertEqual(send_job(socket_path, job)['status'], DONE)
+            self.assertEqual(send_job(socket_path, {'action': 'stats'})[DONE], 1)
+        finally:
+            server.shutdown()
+            server.server_close()
+        self.assertTrue(os.path.exists(job['output_file']))
+
+    def test_spool_dir(self):
+        self.worker = ReportWorker(workers=1)
+        spool_dir = os.path.join(self.temp_dir, 'spool')
+        os.mkdir(spool_dir)
+        job = self.convert_job()
+        with open(os.path.join(spool_dir, 'first' + JOB_FILE_EXT), 'w') as job_file:
+            json.dump(job, job_file)
+        with open(os.path.join(spool_dir, 'broken' + JOB_FILE_EXT), 'w') as job_file:
+            job_file.write('{')
+        # Job of worker which was killed while running it
+        with open(os.path.join(spool_dir, 'interrupted' + JOB_FILE_EXT + '.running'), 'w') as job_file:
+            json.dump(self.convert_job(), job_file)
+
+        stop_event = threading.Event()
+        logger = logging.getLogger('ssrs_worker')
+        logger.disabled = True
+        thread = threading.Thread(target=watch_spool_dir, args=(spool_dir, self.worker, 0.05, stop_event))
+        thread.start()
+        try:
+            result_paths = [os.path.join(spool_dir, name + RESULT_FILE_EXT) for name in ('first', 'interrupted')]
+            deadline = time.time() + 30
+            while not all(os.path.exists(path) for path in result_paths) and time.time() < deadline:
+                time.sleep(0.05)
+        finally:
+            stop_event.set()
+            thread.join()
+            logger.disabled = False
+
+        for result_path in result_paths:
+            with open(result_path) as result_file:
+                self.assertEqual(json.load(result_file)['status'], DONE)
+        with open(os.path.join(spool_dir, 'broken' + RESULT_FILE_EXT)) as result_file:
+            self.assertEqual(json.load(result_file)['status'], ERROR)
+        self.assertEqual(sorted(os.listdir(spool_dir)), [
+            name + RESULT_FILE_EXT for name in ('broken', 'first', 'interrupted')
+        ])
+
+
+if __name__ == '__main__':
+    unittest.main()
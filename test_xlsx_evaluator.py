@@ -0,0 +1,111 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of evaluator of cached values of converted formulas.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+"""
+from __future__ import unicode_literals
+
+import unittest
+
+from xlsx_evaluator import SheetEvaluator, UnsupportedFormula, CellError, UNKNOWN_TEXT, parse_formula
+from xlsx_rc_convertor import split_address
+from test_parse_xlsx_xml import WorkbookTestCase, REPORT_SHEET
+
+
+def evaluate(values, formulas, **kwargs):
+    """ Results of formulas {address: A1-formula} of sheet with values {address: value} """
+    evaluator = SheetEvaluator(**kwargs)
+    for address, value in values.items():
+        evaluator.add_value(address, value)
+    for address, formula in formulas.items():
+        evaluator.add_formula(address, formula)
+    stats = evaluator.evaluate()
+
+    return dict((address, evaluator.results.get(split_address(address))) for address in formulas), stats
+
+
+class ParseFormulaTest(unittest.TestCase):
+
+    def test_precedence(self):
+        self.assertEqual(parse_formula('=1+2*3^2'), (
+            'op', '+', ('number', 1.0), ('op', '*', ('number', 2.0), ('op', '^', ('number', 3.0), ('number', 2.0)))
+        ))
+        self.assertEqual(parse_formula('-A1&"x"'), ('op', '&', ('neg', ('ref', (1, 1))), ('string', 'x')))
+        self.assertEqual(parse_formula('SUM($B$2:A3)'), ('func', 'SUM', [('range', (2, 1, 3, 2))]))
+
+    def test_unsupported(self):
+        for formula in ('VLOOKUP(A1,B1:C3,2)', 'Sheet2!A1', 'SUM(A1', 'IF(A1)', '1+'):
+            self.assertRaises(UnsupportedFormula, parse_formula, formula)
+
+
+class SheetEvaluatorTest(unittest.TestCase):
+
+    def test_arithmetic(self):
+        results, stats = evaluate({'A1': 2.0, 'A2': 3.0, 'A3': 'text'}, {
+            'B1': 'A1*A2+1', 'B2': 'A1/0', 'B3': '(A1+A2)^2', 'B4': 'A3+1', 'B5': '-A1&"!"', 'B6': 'A1=2',
+            'B7': 'A9+1',
+        })
+        self.assertEqual(results, {
+            'B1': 7.0, 'B2': CellError('#DIV/0!'), 'B3': 25.0, 'B4': CellError('#VALUE!'), 'B5': '-2!', 'B6': True,
+            'B7': 1.0,
+        })
+        self.assertEqual(stats, {'evaluated': 7, 'unsupported': 0, 'cyclic': 0})
+
+    def test_functions(self):
+        values = {'A1': 1.0, 'A2': 'text', 'A3': 5.0, 'A4': True}
+        results, _ = evaluate(values, {
+            'B1': 'SUM(A1:A4)', 'B2': 'AVERAGE(A1:A4)', 'B3': 'COUNT(A1:A4,7)', 'B4': 'MAX(A1:A4)',
+            'B5': 'MIN(A5:A9)', 'B6': 'IF(A3>A1,"more","less")', 'B7': 'IF(A1>A3,1)', 'B8': 'AVERAGE(A5:A9)',
+        })
+        self.assertEqual(results, {
+            'B1': 6.0, 'B2': 3.0, 'B3': 3.0, 'B4': 5.0, 'B5': 0.0, 'B6': 'more', 'B7': False,
+            'B8': CellError('#DIV/0!'),
+        })
+
+    def test_dependencies(self):
+        # Running total refers to formulas of next rows' cells and previous ones
+        results, stats = evaluate({'A1': 1.0, 'A2': 2.0, 'A3': 3.0}, {
+            'C1': 'B3*2', 'B1': 'A1', 'B2': 'B1+A2', 'B3': 'SUM($A$1:A3)', 'B4': 'SUM(B1:B3)',
+        })
+        self.assertEqual(results, {'C1': 12.0, 'B1': 1.0, 'B2': 3.0, 'B3': 6.0, 'B4': 10.0})
+        self.assertEqual(stats['evaluated'], 5)
+
+    def test_cycles_and_unsupported(self):
+        results, stats = evaluate({'A1': UNKNOWN_TEXT}, {
+            'B1': 'B2+1', 'B2': 'B1+1', 'B3': 'B2*2', 'C1': 'ROUND(1.5,0)', 'C2': 'C1+1', 'C3': 'A1&"x"',
+        })
+        self.assertEqual(results, dict.fromkeys(('B1', 'B2', 'B3', 'C1', 'C2', 'C3')))
+        self.assertEqual(stats, {'evaluated': 0, 'unsupported': 3, 'cyclic': 3})
+
+    def test_range_budget(self):
+        values = dict(('A{0}'.format(row), 1.0) for row in range(1, 101))
+        formulas = dict(('B{0}'.format(row), 'SUM($A$1:A{0})'.format(row)) for row in range(1, 101))
+        results, stats = evaluate(values, formulas, max_range_cells=1000)
+        # Ranges of first rows fit the budget, the rest is left to Excel
+        self.assertEqual(results['B10'], 10.0)
+        self.assertIsNone(results['B100'])
+        self.assertEqual(stats['evaluated'] + stats['unsupported'], 100)
+        self.assertTrue(0 < stats['evaluated'] < 100)
+
+
+class EvaluateFormulasTest(WorkbookTestCase):
+
+    def test_cached_values(self):
+        file_name = self.make_workbook([REPORT_SHEET + [('F2', '=RC[-2]+1')]])
+        for options in ({}, {'streaming': True}):
+            cells = self.parse(file_name, evaluate_formulas=True, **options)[0]
+            self.assertEqual(cells['D2'][:3], ('n', '6', 'B2*C2'))
+            self.assertEqual(cells['D3'][:3], ('n', '0', 'B3*C3'))
+            self.assertEqual(cells['D4'][:3], ('e', '#DIV/0!', 'B4*C4'))
+            self.assertEqual(cells['F2'][:3], ('n', '7', 'D2+1'))
+            # Texts of shared strings aren't known
+            self.assertEqual(cells['E5'][:3], ('n', None, '$A$1'))
+
+    def test_without_evaluation(self):
+        cells = self.parse(self.make_workbook())[0]
+        self.assertEqual(cells['D2'][:3], ('n', None, 'B2*C2'))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,72 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of streaming export of workbook's sheets to CSV and NDJSON.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+"""
+from __future__ import unicode_literals
+
+import csv
+import json
+import os
+import unittest
+
+from xlsx_export import export_workbook
+from test_parse_xlsx_xml import WorkbookTestCase, REPORT_SHEET
+
+# Formula referring to shared string and texts of other cells
+TEXT_FORMULAS = [('F2', '=IF(R[-1]C[-5]="NAME";RC[-5];"-")'), ('G2', '=R[3]C[-6]')]
+
+
+class ExportWorkbookTest(WorkbookTestCase):
+
+    def export(self, sheets=(REPORT_SHEET,), inline=False, **options):
+        """ Export workbook, returns [(sheet name, output file name)] """
+        output_dir = os.path.join(self.temp_dir, 'export')
+        os.mkdir(output_dir)
+        return export_workbook(self.make_workbook(sheets, inline=inline), output_dir, **options)
+
+    def read_ndjson(self, file_name):
+        with open(file_name, 'rb') as ndjson_file:
+            return [json.loads(line) for line in ndjson_file]
+
+    def test_csv(self):
+        exported = self.export([REPORT_SHEET, [('A2', 'Second')]])
+        self.assertEqual([sheet_name for sheet_name, _ in exported], ['Sheet1', 'Sheet2'])
+        with open(exported[0][1], 'rb') as csv_file:
+            rows = list(csv.reader(csv_file))
+        self.assertEqual(rows[0], ['Name', 'Price', 'Count', 'Total'])
+        self.assertEqual(rows[2], ['Pears', '2.25', '0', ''])
+        self.assertEqual(rows[3], ['Plums', '#DIV/0!', '2', ''])
+        with open(exported[1][1], 'rb') as csv_file:
+            self.assertEqual(list(csv.reader(csv_file)), [[], ['Second']])
+
+    def test_csv_formulas(self):
+        exported = self.export(formulas=True)
+        with open(exported[0][1], 'rb') as csv_file:
+            rows = list(csv.reader(csv_file))
+        self.assertEqual(rows[1], ['Apples', '1.5', '4', '=B2*C2'])
+        self.assertEqual(rows[4], ['Total', '', '', '=SUM(D$2:D4)', '=$A$1'])
+
+    def test_ndjson(self):
+        for inline in (False, True):
+            rows = self.read_ndjson(self.export(output_format='ndjson', formulas=True, inline=inline)[0][1])
+            self.assertEqual(rows[1], {'row': 2, 'cells': {'A': 'Apples', 'B': 1.5, 'C': 4, 'D': None},
+                                       'formulas': {'D': '=B2*C2'}})
+            self.assertEqual(rows[3]['cells']['B'], '#DIV/0!')
+            os.rename(os.path.join(self.temp_dir, 'export'), os.path.join(self.temp_dir, 'export{0}'.format(inline)))
+
+    def test_evaluated_formulas(self):
+        for inline in (False, True):
+            rows = self.read_ndjson(self.export(
+                [REPORT_SHEET + TEXT_FORMULAS], output_format='ndjson', evaluate_formulas=True, inline=inline
+            )[0][1])
+            self.assertEqual(rows[1]['cells'], {'A': 'Apples', 'B': 1.5, 'C': 4, 'D': 6, 'F': 'Apples',
+                                                'G': 'Total'})
+            self.assertEqual(rows[3]['cells']['D'], '#DIV/0!')
+            self.assertEqual(rows[4]['cells'], {'A': 'Total', 'D': '#DIV/0!', 'E': 'Name'})
+            os.rename(os.path.join(self.temp_dir, 'export'), os.path.join(self.temp_dir, 'export{0}'.format(inline)))
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,68 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of merge of workbooks rendered for chunks of one report.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+"""
+from __future__ import unicode_literals
+
+import os
+import unittest
+from zipfile import ZipFile
+
+from lxml import etree
+
+from xlsx_merge import merge_workbooks, MERGE_SHEETS, WORKBOOK_FILE
+from test_parse_xlsx_xml import WorkbookTestCase, REPORT_SHEET, read_workbook
+
+# Chunk of report with other rows and one new shared string
+CHUNK_SHEET = [
+    ('A1', 'Name'), ('B1', 'Price'), ('C1', 'Count'), ('D1', 'Total'),
+    ('A2', 'Pears'), ('B2', 3), ('C2', 1), ('D2', '=RC[-2]*RC[-1]@0.00@'),
+    ('A3', 'Figs'), ('B3', 4), ('C3', 2), ('D3', '=RC[-2]*RC[-1]@0.00@'),
+]
+
+
+class MergeWorkbooksTest(WorkbookTestCase):
+
+    def merge(self, inline=False, **options):
+        """ Merge report without total row and its chunk, returns (output file name, cells of sheets) """
+        source_files = [
+            self.make_workbook([REPORT_SHEET[:-3]], name='first.xlsx', inline=inline),
+            self.make_workbook([CHUNK_SHEET], name='second.xlsx', inline=inline),
+        ]
+        output_file = os.path.join(self.temp_dir, 'merged.xlsx')
+        merge_workbooks(source_files, output_file, **options)
+        return output_file, read_workbook(output_file)
+
+    def test_rows(self):
+        for inline in (False, True):
+            cells = self.merge(inline=inline, header_rows=1)[1]
+            self.assertEqual(len(cells), 1)
+            self.assertEqual(cells[0]['A4'][1], 'Plums')
+            self.assertEqual(cells[0]['A5'][1], 'Pears')
+            self.assertEqual(cells[0]['A6'][1], 'Figs')
+            self.assertEqual(cells[0]['B6'][1], '4')
+            # R1C1-formula strings keep referring to cells of their rows
+            self.assertEqual(cells[0]['D6'][1], '=RC[-2]*RC[-1]@0.00@')
+            self.assertNotIn('A7', cells[0])
+            os.remove(os.path.join(self.temp_dir, 'merged.xlsx'))
+
+    def test_sheets(self):
+        output_file, cells = self.merge(mode=MERGE_SHEETS)
+        self.assertEqual(len(cells), 2)
+        self.assertEqual(cells[0]['A4'][1], 'Plums')
+        self.assertEqual(cells[1]['A3'][1], 'Figs')
+        self.assertEqual(cells[1]['A1'][1], 'Name')
+        with ZipFile(output_file) as output_zip:
+            workbook = etree.fromstring(output_zip.read(WORKBOOK_FILE))
+            self.assertIn('xl/worksheets/sheet2.xml', output_zip.read('[Content_Types].xml').decode('utf-8'))
+        self.assertEqual([sheet.get('name') for sheet in workbook.iter('{*}sheet')], ['Sheet1', 'Sheet1 (2)'])
+
+    def test_errors(self):
+        self.assertRaises(ValueError, merge_workbooks, [], os.path.join(self.temp_dir, 'merged.xlsx'))
+        self.assertRaises(ValueError, self.merge, mode='columns')
+
+
+if __name__ == '__main__':
+    unittest.main()
@@ -0,0 +1,81 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of R1C1-format formulae to A1-type converter.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+"""
+import unittest
+
+from xlsx_rc_convertor import (
+    MAX_COLUMNS, MAX_ROWS, check_range, col2int, col2str, convert_rc_formula, convert_rc_formulas,
+    get_cell_format, split_address,
+)
+
+
+class ConvertRCFormulaTest(unittest.TestCase):
+
+    def test_relative(self):
+        self.assertEqual(convert_rc_formula('=R[-1]C-R[-1]C[1]', 'G20'), '=G19-H19')
+        self.assertEqual(convert_rc_formula('=SUM(R2C:R[-1]C)', 'C10'), '=SUM(C$2:C9)')
+
+    def test_absolute(self):
+        self.assertEqual(convert_rc_formula('=R1C1+R3C[2]', 'B5'), '=$A$1+D$3')
+
+    def test_first_row(self):
+        self.assertEqual(convert_rc_formula('=R[-1]C', 'B2'), '=B1')
+        self.assertEqual(convert_rc_formula('=R1C2', 'D7'), '=$B$1')
+
+    def test_last_row(self):
+        self.assertEqual(convert_rc_formula('=R[1]C', 'A1048575'), '=A1048576')
+        self.assertEqual(convert_rc_formula('=R1048576C1', 'B2'), '=$A$1048576')
+
+    def test_first_column(self):
+        self.assertEqual(convert_rc_formula('=RC[-1]*2', 'B20'), '=A20*2')
+        self.assertEqual(convert_rc_formula('=R5C1', 'Z3'), '=$A$5')
+
+    def test_last_column(self):
+        self.assertEqual(convert_rc_formula('=RC[1]', 'XFC4'), '=XFD4')
+        self.assertEqual(convert_rc_formula('=R1C16384', 'A1'), '=$XFD$1')
+
+    def test_wrap_around(self):
+        # Excel wraps references out of sheet to its other side
+        self.assertEqual(convert_rc_formula('=RC[-1]', 'A5'), '=XFD5')
+        self.assertEqual(convert_rc_formula('=R[-1]C', 'C1'), '=C1048576')
+        self.assertEqual(convert_rc_formula('=R[1]C[1]', 'XFD1048576'), '=A1')
+
+    def test_texts_are_kept(self):
+        self.assertEqual(convert_rc_formula('=IF(RC[-1]>0,"R1C1","")', 'B2'), '=IF(A2>0,"R1C1","")')
+
+    def test_format_is_removed(self):
+        formula = '=R[-1]C*100@0.00%@'
+        self.assertEqual(get_cell_format(formula), '0.00%')
+        self.assertEqual(convert_rc_formula(formula, 'B3'), '=B2*100')
+
+    def test_batch(self):
+        pairs = [('=R[-1]C+1', 'A2'), ('=R[-1]C+1', 'A3'), ('=RC[-1]', 'B3')]
+        self.assertEqual(convert_rc_formulas(pairs), [convert_rc_formula(*pair) for pair in pairs])
+
+
+class ColumnsTest(unittest.TestCase):
+
+    def test_check_range(self):
+        self.assertEqual(check_range(1), 1)
+        self.assertEqual(check_range(MAX_ROWS), MAX_ROWS)
+        self.assertEqual(check_range(0), MAX_ROWS)
+        self.assertEqual(check_range(MAX_ROWS + 1), 1)
+        self.assertEqual(check_range(MAX_COLUMNS, mode=1), MAX_COLUMNS)
+        self.assertEqual(check_range(0, mode=1), MAX_COLUMNS)
+
+    def test_columns(self):
+        for num, name in ((1, 'A'), (26, 'Z'), (27, 'AA'), (703, 'AAA'), (MAX_COLUMNS, 'XFD')):
+            self.assertEqual(col2str(num, run=1), name)
+            self.assertEqual(col2int(name), num)
+        self.assertEqual(col2int('ab'), 28)
+
+    def test_split_address(self):
+        self.assertEqual(split_address('AB12'), (12, 28))
+        self.assertEqual(split_address('b3'), (3, 2))
+
+
+if __name__ == '__main__':
+    unittest.main()
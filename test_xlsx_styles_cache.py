@@ -0,0 +1,114 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of on-disk cache of styles.xml rewritten by ParseXlsx.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+"""
+from __future__ import unicode_literals
+
+import os
+import unittest
+from zipfile import ZipFile
+
+from parse_xlsx_xml import ParseXlsx, STYLES_FILE
+from report_metrics import Metrics
+from xlsx_styles_cache import StylesCache, CachedStyles, STYLES_CACHE_FILE_EXT
+from test_parse_xlsx_xml import WorkbookTestCase, REPORT_SHEET, STYLES_XML, read_workbook
+
+
+class StylesCacheTest(WorkbookTestCase):
+
+    def setUp(self):
+        super(StylesCacheTest, self).setUp()
+        self.cache_dir = os.path.join(self.temp_dir, 'styles_cache')
+
+    def parse_cached(self, file_name):
+        """ Parse workbook with styles cache, returns (styles.xml, sheet1.xml, counters) """
+        metrics = Metrics()
+        output_file = file_name + '.parsed.xlsx'
+        ParseXlsx(file_name, run=True, output_file=output_file, styles_cache_dir=self.cache_dir, metrics=metrics)
+        with ZipFile(output_file) as output_zip:
+            return output_zip.read(STYLES_FILE), output_zip.read('xl/worksheets/sheet1.xml'), metrics.counters
+
+    def test_hit_gives_same_workbook(self):
+        file_name = self.make_workbook()
+        ParseXlsx(file_name, run=True, output_file=file_name + '.expected.xlsx')
+        with ZipFile(file_name + '.expected.xlsx') as expected_zip:
+            expected = expected_zip.read(STYLES_FILE), expected_zip.read('xl/worksheets/sheet1.xml')
+
+        first = self.parse_cached(file_name)
+        second = self.parse_cached(file_name)
+        self.assertEqual(first[:2], expected)
+        self.assertEqual(second[:2], expected)
+        self.assertEqual(first[2]['styles_cache_misses'], 1)
+        self.assertEqual(second[2]['styles_cache_hits'], 1)
+
+    def check_cached_run(self, sheet, name):
+        """ Parse workbook with cache and without it, returns counters of cached run """
+        file_name = self.make_workbook([sheet], name=name)
+        ParseXlsx(file_name, run=True, output_file=file_name + '.expected.xlsx')
+        with ZipFile(file_name + '.expected.xlsx') as expected_zip:
+            expected = expected_zip.read(STYLES_FILE), expected_zip.read('xl/worksheets/sheet1.xml')
+
+        styles_xml, sheet_xml, counters = self.parse_cached(file_name)
+        self.assertEqual((styles_xml, sheet_xml), expected)
+        return counters
+
+    def test_other_formats(self):
+        self.parse_cached(self.make_workbook())
+        sheet = REPORT_SHEET + [('F2', '=RC[-1]@0.0%@'), ('G2', '=RC[-1]@#,##0@')]
+        counters = self.check_cached_run(sheet, 'more.xlsx')
+        self.assertEqual(counters['styles_cache_misses'], 1)
+        self.assertEqual(len([name for name in os.listdir(self.cache_dir) if name.endswith(STYLES_CACHE_FILE_EXT)]), 2)
+
+    def test_subset_of_cached_formats(self):
+        # Entry of workbook with more formats isn't used for workbook with part of them
+        self.parse_cached(self.make_workbook([[('A1', 1), ('B1', '=RC[-1]@0.00@'), ('B2', '=R[-1]C@0.000%@')]]))
+        counters = self.check_cached_run([('A1', 1), ('B2', '=R[-1]C@0.000%@')], 'subset.xlsx')
+        self.assertEqual(counters['styles_cache_misses'], 1)
+
+    def test_workers(self):
+        sheets = [REPORT_SHEET, [('A1', 1), ('B2', '=R[-1]C@0.000%@')]]
+        file_name = self.make_workbook(sheets)
+        expected = self.parse(file_name)
+        for _ in range(2):
+            output_file = file_name + '.workers.xlsx'
+            ParseXlsx(file_name, run=True, output_file=output_file, styles_cache_dir=self.cache_dir, workers=2)
+            self.assertEqual(read_workbook(output_file), expected)
+
+    def test_cached_styles(self):
+        cache = StylesCache(self.cache_dir)
+        formats = [('1', '0.00%'), (None, '0.0'), ('1', '0.00%')]
+        styles = CachedStyles(cache, STYLES_XML.encode('utf-8'), formats)
+        self.assertFalse(styles.is_cached)
+        style_ids = [styles.get_style(style_id, new_format) for style_id, new_format in formats]
+        styles_xml = styles.tostring()
+
+        cached = CachedStyles(cache, STYLES_XML.encode('utf-8'), formats)
+        self.assertTrue(cached.is_cached)
+        self.assertEqual([cached.get_style(style_id, new_format) for style_id, new_format in formats], style_ids)
+        self.assertEqual(cached.tostring(), styles_xml)
+        self.assertEqual(cached.added_count, 2)
+        # Formats in other order are other entry
+        self.assertFalse(CachedStyles(cache, STYLES_XML.encode('utf-8'), formats[1::-1]).is_cached)
+        # Format out of entry loads styles.xml, cached styles keep their ids
+        self.assertNotIn(cached.get_style('0', '0.000'), style_ids)
+        self.assertFalse(cached.is_cached)
+        self.assertEqual(cached.get_style('1', '0.00%'), style_ids[0])
+
+    def test_eviction(self):
+        pairs = [['1', '0.0', '2']]
+        cache = StylesCache(self.cache_dir, max_size=1)
+        cache.put('hash', pairs, b'<styleSheet/>', 1)
+        self.assertEqual(os.listdir(self.cache_dir), [])
+        cache = StylesCache(self.cache_dir)
+        cache.put('hash', pairs, b'<styleSheet/>', 1)
+        self.assertEqual(cache.get('hash', [('1', '0.0')])['added_count'], 1)
+        self.assertIsNone(cache.get('hash', [('1', '0.00')]))
+        self.assertIsNone(cache.get('other', pairs))
+        cache.clear()
+        self.assertIsNone(cache.get('hash', pairs))
+
+
+if __name__ == '__main__':
+    unittest.main()
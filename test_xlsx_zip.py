@@ -0,0 +1,118 @@
+# -*- coding: utf-8 -*-
+"""
+    Tests of zip-archive helpers: member copying and block-parallel compression.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: python -m unittest discover -p 'test_*.py'
+"""
+import random
+import unittest
+import zlib
+from io import BytesIO
+from multiprocessing.pool import ThreadPool
+from zipfile import ZipFile, ZIP_DEFLATED, ZIP_STORED
+
+from xlsx_zip import MemberCompressor, ZipMemberWriter, copy_zip_member, new_zip_info, write_compressed_member
+
+BLOCK_SIZE = 64 * 1024
+
+
+def make_data(size):
+    """ Compressible data like sheet's xml """
+    rnd = random.Random(size)
+    rows = []
+    length = 0
+    while length < size:
+        row = '<row r="{0}"><c r="A{0}"><v>{1}</v></c></row>'.format(len(rows) + 1, rnd.randint(0, 10 ** 6))
+        rows.append(row)
+        length += len(row)
+
+    return ''.join(rows)[:size]
+
+
+class MemberCompressorTest(unittest.TestCase):
+
+    def setUp(self):
+        self.pool = ThreadPool(2)
+
+    def tearDown(self):
+        self.pool.terminate()
+        self.pool.join()
+
+    def check_compressor(self, compressor, data):
+        """ Check that compressed chunks inflate to data """
+        self.assertEqual(zlib.decompress(b''.join(compressor.chunks), -15), data)
+        self.assertEqual(compressor.file_size, len(data))
+        self.assertEqual(compressor.compress_size, sum(len(chunk) for chunk in compressor.chunks))
+        self.assertEqual(compressor.CRC, zlib.crc32(data) & 0xffffffff)
+
+    def test_serial(self):
+        data = make_data(300 * 1024)
+        with MemberCompressor() as compressor:
+            compressor.write(data[:1000])
+            compressor.write(data[1000:])
+        self.check_compressor(compressor, data)
+
+    def test_single_large_write_is_split_to_blocks(self):
+        data = make_data(20 * BLOCK_SIZE + 100)
+        with MemberCompressor(pool=self.pool, block_size=BLOCK_SIZE) as compressor:
+            compressor.write(data)
+        # Each block is compressed by pool separately
+        self.assertEqual(len(compressor.chunks), 21)
+        self.check_compressor(compressor, data)
+
+    def test_small_writes(self):
+        data = make_data(5 * BLOCK_SIZE)
+        with MemberCompressor(pool=self.pool, block_size=BLOCK_SIZE) as compressor:
+            for position in range(0, len(data), 1000):
+                compressor.write(data[position:position + 1000])
+        self.check_compressor(compressor, data)
+
+    def test_small_member(self):
+        data = make_data(1000)
+        with MemberCompressor(pool=self.pool, block_size=BLOCK_SIZE) as compressor:
+            compressor.write(data)
+        self.assertEqual(len(compressor.chunks), 1)
+        self.check_compressor(compressor, data)
+
+    def test_stored(self):
+        with MemberCompressor(ZIP_STORED, pool=self.pool) as compressor:
+            compressor.write(b'image')
+        self.assertEqual(compressor.chunks, [b'image'])
+
+
+class ZipMembersTest(unittest.TestCase):
+
+    def test_write_and_copy_members(self):
+        pool = ThreadPool(2)
+        data = make_data(3 * BLOCK_SIZE + 10)
+        source_file = BytesIO()
+        try:
+            with ZipFile(source_file, 'w', ZIP_DEFLATED) as source_zip:
+                with ZipMemberWriter(source_zip, new_zip_info('xl/worksheets/sheet1.xml'), pool=pool,
+                                     block_size=BLOCK_SIZE) as member_file:
+                    member_file.write(data)
+                compressor = MemberCompressor()
+                compressor.write(data)
+                compressor.close()
+                write_compressed_member(source_zip, new_zip_info('xl/worksheets/sheet2.xml'), compressor)
+                source_zip.writestr('xl/styles.xml', '<styleSheet/>')
+        finally:
+            pool.terminate()
+            pool.join()
+
+        output_file = BytesIO()
+        with ZipFile(source_file, 'r') as source_zip:
+            self.assertIsNone(source_zip.testzip())
+            with ZipFile(output_file, 'w', ZIP_DEFLATED) as output_zip:
+                for zip_info in source_zip.infolist():
+                    copy_zip_member(source_zip, zip_info, output_zip)
+
+        with ZipFile(output_file, 'r') as output_zip:
+            self.assertIsNone(output_zip.testzip())
+            self.assertEqual(output_zip.read('xl/worksheets/sheet1.xml'), data)
+            self.assertEqual(output_zip.read('xl/worksheets/sheet2.xml'), data)
+            self.assertEqual(output_zip.read('xl/styles.xml'), '<styleSheet/>')
+
+
+if __name__ == '__main__':
+    unittest.main()
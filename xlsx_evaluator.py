@@ -0,0 +1,544 @@
+# -*- coding: utf-8 -*-
+"""
+    Evaluator of cached values of converted formulas.
+    Supports formulas Reporting Services reports emit: arithmetic, comparisons,
+    concatenation and SUM/AVERAGE/MIN/MAX/COUNT/IF over A1-references and ranges
+    of the same sheet. Formulas are evaluated in order of their dependencies.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: ParseXlsx(file_name, run=True, evaluate_formulas=True)
+    Notice: Formulas with other functions, references to other sheets, texts of
+            shared strings or cycles get no value, Excel calculates them on open.
+            Texts of shared strings are known in export only, see xlsx_export.
+"""
+import math
+import re
+from bisect import bisect_left, bisect_right
+from collections import deque
+
+from xlsx_rc_convertor import split_address, col2int, MAX_COLUMNS
+
+# Token of A1-formula: string literal, range, function's name, reference, boolean, number or operator
+TOKEN_RE = re.compile(r"""
+    \s*(?:
+    (?P<string>"(?:[^"]|"")*")
+    |(?P<range>\$?[A-Z]{1,3}\$?\d+:\$?[A-Z]{1,3}\$?\d+)(?![\w(!])
+    |(?P<func>[A-Z][A-Z0-9.]*)\(
+    |(?P<ref>\$?[A-Z]{1,3}\$?\d+)(?![\w(!:])
+    |(?P<bool>TRUE|FALSE)(?![\w(])
+    |(?P<number>(?:\d+(?:\.\d*)?|\.\d+)(?:E[+-]?\d+)?)
+    |(?P<op><>|<=|>=|[-+*/^&=<>(),])
+    )
+""", re.VERBOSE | re.IGNORECASE)
+REF_RE = re.compile(r'\$?([A-Z]+)\$?(\d+)', re.IGNORECASE)
+# Binary operators by precedence, lowest first
+BINARY_OPERATORS = (('=', '<>', '<', '>', '<=', '>='), ('&',), ('+', '-'), ('*', '/'), ('^',))
+AGGREGATE_FUNCTIONS = ('SUM', 'AVERAGE', 'MIN', 'MAX', 'COUNT')
+# Number of cells read from ranges of sheet's formulas, formulas over it are left to Excel,
+# eg. running totals SUM($A$2:A100000) are quadratic
+MAX_RANGE_CELLS = 2 * 1000 * 1000
+
+
+class UnsupportedFormula(Exception):
+    """ Formula or its operand can't be evaluated, cell gets no cached value """
+
+
+class CellError(object):
+    """ Error value of cell, eg. #DIV/0! """
+    __slots__ = ('code',)
+
+    def __init__(self, code):
+        self.code = code
+
+    def __eq__(self, other):
+        return isinstance(other, CellError) and other.code == self.code
+
+    def __ne__(self, other):
+        return not self == other
+
+    def __repr__(self):
+        return self.code
+
+
+# Value of text cell which text isn't known, eg. of shared string
+UNKNOWN_TEXT = object()
+DIV0_ERROR = CellError('#DIV/0!')
+VALUE_ERROR = CellError('#VALUE!')
+NUM_ERROR = CellError('#NUM!')
+
+
+def tokenize(formula):
+    """ Split A1-formula to (kind, text) tokens """
+    tokens = []
+    position = 0
+    formula = formula.rstrip()
+    while position < len(formula):
+        match = TOKEN_RE.match(formula, position)
+        if match is None or match.end() == position:
+            raise UnsupportedFormula(formula)
+        kind = match.lastgroup
+        tokens.append((kind, match.group(kind)))
+        position = match.end()
+
+    return tokens
+
+
+def parse_formula(formula):
+    """
+        Parse A1-formula to tree of tuples: ('number', value), ('string', text), ('bool', value),
+        ('ref', (row, col)), ('range', (row1, col1, row2, col2)), ('neg', operand),
+        ('op', operator, left, right), ('func', name, [args]). Raises UnsupportedFormula.
+    """
+    tokens = tokenize(formula.lstrip('='))
+    parser = FormulaParser(tokens)
+    tree = parser.parse_binary(0)
+    if parser.position != len(tokens):
+        raise UnsupportedFormula(formula)
+
+    return tree
+
+
+def parse_ref(ref):
+    """ (row, col) of A1-reference, eg. '$B3' = (3, 2) """
+    col, row = REF_RE.match(ref).groups()
+    return int(row), col2int(col.upper())
+
+
+class FormulaParser(object):
+    """ Recursive descent parser of tokens with Excel's operators precedence """
+
+    def __init__(self, tokens):
+        self.tokens = tokens
+        self.position = 0
+
+    def peek(self):
+        """ Current token, (None, None) at end """
+        return self.tokens[self.position] if self.position < len(self.tokens) else (None, None)
+
+    def take(self, text=None):
+        """ Take current token, which has to be operator text if it's set """
+        kind, value = self.peek()
+        if kind is None or text is not None and (kind != 'op' or value != text):
+            raise UnsupportedFormula(text)
+        self.position += 1
+        return kind, value
+
+    def parse_binary(self, level):
+        """ Parse operators of precedence level and higher ones """
+        if level == len(BINARY_OPERATORS):
+            return self.parse_unary()
+        left = self.parse_binary(level + 1)
+        while True:
+            kind, value = self.peek()
+            if kind != 'op' or value not in BINARY_OPERATORS[level]:
+                return left
+            self.position += 1
+            left = ('op', value, left, self.parse_binary(level + 1))
+
+    def parse_unary(self):
+        """ Parse unary minus and plus, which bind tighter than other operators """
+        kind, value = self.peek()
+        if kind == 'op' and value in ('-', '+'):
+            self.position += 1
+            operand = self.parse_unary()
+            return ('neg', operand) if value == '-' else operand
+
+        return self.parse_primary()
+
+    def parse_primary(self):
+        """ Parse operand: literal, reference, function call or expression in brackets """
+        kind, value = self.take()
+        if kind == 'number':
+            return 'number', float(value)
+        if kind == 'string':
+            return 'string', value[1:-1].replace('""', '"')
+        if kind == 'bool':
+            return 'bool', value.upper() == 'TRUE'
+        if kind == 'ref':
+            return 'ref', parse_ref(value)
+        if kind == 'range':
+            (row1, col1), (row2, col2) = [parse_ref(ref) for ref in value.split(':')]
+            return 'range', (min(row1, row2), min(col1, col2), max(row1, row2), max(col1, col2))
+        if kind == 'func':
+            name = value.upper()
+            if name not in AGGREGATE_FUNCTIONS and name != 'IF':
+                raise UnsupportedFormula(name)
+            args = []
+            if self.peek() != ('op', ')'):
+                args.append(self.parse_binary(0))
+                while self.peek() == ('op', ','):
+                    self.position += 1
+                    args.append(self.parse_binary(0))
+            self.take(')')
+            if name == 'IF' and not 2 <= len(args) <= 3 or not args:
+                raise UnsupportedFormula(name)
+            return 'func', name, args
+        if kind == 'op' and value == '(':
+            tree = self.parse_binary(0)
+            self.take(')')
+            return tree
+
+        raise UnsupportedFormula(value)
+
+
+def iter_references(tree):
+    """ Iterate over ('ref', (row, col)) and ('range', (...)) nodes of formula's tree """
+    kind = tree[0]
+    if kind in ('ref', 'range'):
+        yield tree
+    elif kind == 'neg':
+        for node in iter_references(tree[1]):
+            yield node
+    elif kind == 'op':
+        for operand in tree[2:]:
+            for node in iter_references(operand):
+                yield node
+    elif kind == 'func':
+        for arg in tree[2]:
+            for node in iter_references(arg):
+                yield node
+
+
+def format_number(value):
+    """ Text of number as Excel shows it in general format """
+    if value == int(value) and abs(value) < 1e15:
+        return str(int(value))
+    return '{0:.15g}'.format(value)
+
+
+def to_number(value):
+    """ Coerce operand of arithmetic to number """
+    if isinstance(value, CellError):
+        return value
+    if value is None:
+        return 0.0
+    if isinstance(value, bool):
+        return float(value)
+    if isinstance(value, float):
+        return value
+    if value is UNKNOWN_TEXT:
+        raise UnsupportedFormula('text')
+    try:
+        return float(value)
+    except ValueError:
+        return VALUE_ERROR
+
+
+def to_text(value):
+    """ Coerce operand of concatenation to text """
+    if value is None:
+        return ''
+    if isinstance(value, bool):
+        return 'TRUE' if value else 'FALSE'
+    if isinstance(value, float):
+        return format_number(value)
+    if value is UNKNOWN_TEXT:
+        raise UnsupportedFormula('text')
+    return value
+
+
+def to_bool(value):
+    """ Coerce condition of IF to boolean """
+    if isinstance(value, (bool, CellError)):
+        return value
+    if value is None:
+        return False
+    if isinstance(value, float):
+        return value != 0
+    if value is UNKNOWN_TEXT:
+        raise UnsupportedFormula('text')
+    if value.upper() in ('TRUE', 'FALSE'):
+        return value.upper() == 'TRUE'
+    return VALUE_ERROR
+
+
+def compare(operator, left, right):
+    """ Compare values as Excel does: numbers < texts < booleans, texts ignore case """
+    if left is UNKNOWN_TEXT or right is UNKNOWN_TEXT:
+        raise UnsupportedFormula('text')
+    # Empty cell is equal to 0, empty text and FALSE
+    if left is None:
+        left = '' if isinstance(right, basestring) else False if isinstance(right, bool) else 0.0
+    if right is None:
+        right = '' if isinstance(left, basestring) else False if isinstance(left, bool) else 0.0
+    left_key = (value_rank(left), left.lower() if isinstance(left, basestring) else left)
+    right_key = (value_rank(right), right.lower() if isinstance(right, basestring) else right)
+    if operator == '=':
+        return left_key == right_key
+    if operator == '<>':
+        return left_key != right_key
+    if operator == '<':
+        return left_key < right_key
+    if operator == '>':
+        return left_key > right_key
+    if operator == '<=':
+        return left_key <= right_key
+    return left_key >= right_key
+
+
+def value_rank(value):
+    """ Order of value's type in comparisons """
+    if isinstance(value, bool):
+        return 2
+    if isinstance(value, basestring):
+        return 1
+    return 0
+
+
+def calculate(operator, left, right):
+    """ Result of binary operator """
+    if operator in ('=', '<>', '<', '>', '<=', '>='):
+        for value in (left, right):
+            if isinstance(value, CellError):
+                return value
+        return compare(operator, left, right)
+    if operator == '&':
+        for value in (left, right):
+            if isinstance(value, CellError):
+                return value
+        return to_text(left) + to_text(right)
+
+    left, right = to_number(left), to_number(right)
+    for value in (left, right):
+        if isinstance(value, CellError):
+            return value
+    if operator == '+':
+        result = left + right
+    elif operator == '-':
+        result = left - right
+    elif operator == '*':
+        result = left * right
+    elif operator == '/':
+        if right == 0:
+            return DIV0_ERROR
+        result = left / right
+    else:
+        if left == 0 and right < 0:
+            return DIV0_ERROR
+        try:
+            result = left ** right
+        except (OverflowError, ValueError, ZeroDivisionError):
+            return NUM_ERROR
+        if isinstance(result, complex):
+            return NUM_ERROR
+
+    if math.isinf(result) or math.isnan(result):
+        return NUM_ERROR
+    return result
+
+
+class SheetEvaluator(object):
+    """
+        Values of sheet's cells and formulas converted to A1-type. evaluate() builds graph of
+        dependencies between formulas, orders them topologically and computes their values.
+        Formulas in cycles or depending on them get no value.
+    """
+
+    def __init__(self, max_range_cells=MAX_RANGE_CELLS):
+        self.max_range_cells = max_range_cells
+        self.range_cells = 0
+        # (row, col) -> value: float, bool, unicode, CellError or UNKNOWN_TEXT
+        self.values = {}
+        # (row, col) -> parsed formula, None if it isn't supported
+        self.formulas = {}
+        # (row, col) -> value of evaluated formula
+        self.results = {}
+        # col -> sorted rows of cells with value or formula, to find cells of range
+        self.columns = {}
+        # col -> sorted rows of formulas, to find dependencies of range
+        self.formula_columns = {}
+        self.stats = {'evaluated': 0, 'unsupported': 0, 'cyclic': 0}
+
+    def add_value(self, address, value):
+        """ Add value of cell without formula """
+        if value is not None:
+            self.values[split_address(address)] = value
+
+    def add_formula(self, address, formula):
+        """ Add cell's A1-formula """
+        try:
+            tree = parse_formula(formula)
+        except UnsupportedFormula:
+            tree = None
+        self.formulas[split_address(address)] = tree
+
+    @staticmethod
+    def index_columns(positions):
+        """ col -> sorted rows of (row, col) positions """
+        columns = {}
+        for row, col in positions:
+            columns.setdefault(col, []).append(row)
+        for rows in columns.values():
+            rows.sort()
+
+        return columns
+
+    def iter_range_cells(self, area, columns=None):
+        """
+            Known cells of range's area (row1, col1, row2, col2) in order of rows, only formulas
+            if formula_columns are passed. Raises UnsupportedFormula over max_range_cells.
+        """
+        row1, col1, row2, col2 = area
+        columns = self.columns if columns is None else columns
+        bounds = []
+        for col in range(col1, min(col2, MAX_COLUMNS) + 1):
+            rows = columns.get(col)
+            if rows:
+                bounds.append((col, rows, bisect_left(rows, row1), bisect_right(rows, row2)))
+        self.range_cells += sum(end - start for _, _, start, end in bounds)
+        if self.range_cells > self.max_range_cells:
+            raise UnsupportedFormula('range')
+        cells = []
+        for col, rows, start, end in bounds:
+            cells.extend((row, col) for row in rows[start:end])
+
+        return sorted(cells) if len(bounds) > 1 else cells
+
+    def evaluate(self):
+        """ Evaluate formulas in order of dependencies, returns stats: evaluated, unsupported and cyclic """
+        self.columns = self.index_columns(self.values.keys() + self.formulas.keys())
+        self.formula_columns = self.index_columns(self.formulas)
+
+        # Formula -> formulas which depend on it
+        dependents = {}
+        pending = {}
+        # Formulas of first rows are kept if ranges are over max_range_cells
+        for position in sorted(self.formulas):
+            tree = self.formulas[position]
+            if tree is None:
+                continue
+            depends_on = set()
+            try:
+                for node in iter_references(tree):
+                    if node[0] == 'ref':
+                        if node[1] in self.formulas:
+                            depends_on.add(node[1])
+                    else:
+                        depends_on.update(self.iter_range_cells(node[1], self.formula_columns))
+            except UnsupportedFormula:
+                self.formulas[position] = None
+                continue
+            pending[position] = len(depends_on)
+            for cell in depends_on:
+                dependents.setdefault(cell, []).append(position)
+
+        # Ranges of supported formulas fit max_range_cells, they're read again by evaluation
+        self.range_cells = 0
+        # Kahn's algorithm: formula is evaluated after all formulas it refers to
+        ready = deque(sorted(position for position, count in pending.items() if not count))
+        ready.extend(sorted(position for position, tree in self.formulas.items() if tree is None))
+        while ready:
+            position = ready.popleft()
+            tree = self.formulas[position]
+            if tree is not None:
+                try:
+                    value = self.evaluate_tree(tree)
+                    if value is UNKNOWN_TEXT:
+                        raise UnsupportedFormula('text')
+                    self.results[position] = 0.0 if value is None else value
+                    self.stats['evaluated'] += 1
+                except UnsupportedFormula:
+                    self.stats['unsupported'] += 1
+            else:
+                self.stats['unsupported'] += 1
+            for dependent in dependents.get(position, ()):
+                pending[dependent] -= 1
+                if not pending[dependent]:
+                    ready.append(dependent)
+
+        self.stats['cyclic'] = sum(1 for count in pending.values() if count)
+        return self.stats
+
+    def get_cell(self, position):
+        """ Value of cell for formula, raises UnsupportedFormula for formula without value """
+        if position in self.formulas:
+            if position not in self.results:
+                raise UnsupportedFormula('reference')
+            return self.results[position]
+
+        return self.values.get(position)
+
+    def evaluate_tree(self, tree):
+        """ Value of parsed formula """
+        kind = tree[0]
+        if kind in ('number', 'string', 'bool'):
+            return tree[1]
+        if kind == 'ref':
+            return self.get_cell(tree[1])
+        if kind == 'neg':
+            value = to_number(self.evaluate_tree(tree[1]))
+            return value if isinstance(value, CellError) else -value
+        if kind == 'op':
+            return calculate(tree[1], self.evaluate_tree(tree[2]), self.evaluate_tree(tree[3]))
+        if kind == 'func':
+            if tree[1] == 'IF':
+                return self.evaluate_if(tree[2])
+            return self.evaluate_aggregate(tree[1], tree[2])
+        # Range outside of function
+        raise UnsupportedFormula(kind)
+
+    def evaluate_if(self, args):
+        """ IF(condition, value if true, value if false), only chosen branch is evaluated """
+        condition = to_bool(self.evaluate_tree(args[0]))
+        if isinstance(condition, CellError):
+            return condition
+        if condition:
+            value = self.evaluate_tree(args[1])
+        elif len(args) > 2:
+            value = self.evaluate_tree(args[2])
+        else:
+            return False
+
+        return 0.0 if value is None else value
+
+    def evaluate_aggregate(self, name, args):
+        """ SUM, AVERAGE, MIN, MAX or COUNT of arguments, texts and booleans of references are skipped """
+        numbers = []
+        for arg in args:
+            if arg[0] in ('ref', 'range'):
+                cells = [arg[1]] if arg[0] == 'ref' else self.iter_range_cells(arg[1])
+                for position in cells:
+                    value = self.get_cell(position)
+                    if isinstance(value, CellError):
+                        if name != 'COUNT':
+                            return value
+                    elif isinstance(value, float):
+                        numbers.append(value)
+            else:
+                value = to_number(self.evaluate_tree(arg))
+                if isinstance(value, CellError):
+                    if name != 'COUNT':
+                        return value
+                else:
+                    numbers.append(value)
+
+        if name == 'COUNT':
+            return float(len(numbers))
+        if name == 'SUM':
+            return math.fsum(numbers)
+        if name == 'AVERAGE':
+            return math.fsum(numbers) / len(numbers) if numbers else DIV0_ERROR
+        if not numbers:
+            return 0.0
+        return min(numbers) if name == 'MIN' else max(numbers)
+
+    def set_cached_value(self, c_tag, ns=''):
+        """ Add value of evaluated formula to its c-tag, which has no value tag """
+        value = self.results.get(split_address(c_tag.get('r')))
+        if value is None:
+            return False
+        if isinstance(value, bool):
+            c_tag.attrib['t'] = 'b'
+            text = '1' if value else '0'
+        elif isinstance(value, float):
+            text = repr(value)[:-2] if repr(value).endswith('.0') else repr(value)
+        elif isinstance(value, CellError):
+            c_tag.attrib['t'] = 'e'
+            text = value.code
+        else:
+            c_tag.attrib['t'] = 'str'
+            text = value
+        v_tag = c_tag.makeelement(ns + 'v', {})
+        v_tag.text = text
+        c_tag.append(v_tag)
+
+        return True
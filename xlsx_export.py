@@ -0,0 +1,243 @@
+# -*- coding: utf-8 -*-
+"""
+    Streaming export of workbook's sheets to CSV or NDJSON.
+    Sheets are read row by row and transformed by ParseXlsx's transforms, so
+    shared and inline strings are resolved, NaN values are fixed and R1C1-formula
+    strings are converted, without writing and re-reading post-processed xlsx.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: export_workbook('report.xlsx', '/data/export', output_format='ndjson', formulas=True)
+    Notice: NDJSON line is a row: {"row": 3, "cells": {"A": 1.5, "B": "text"}, "formulas": {"D": "=D2+C3"}},
+            cells keep types of values: numbers, strings, booleans, errors as strings.
+            CSV has formulas' A1-text instead of their values if formulas are exported.
+            Formulas have values only with evaluate_formulas option, see xlsx_evaluator.
+"""
+import argparse
+import csv
+import json
+import math
+import os
+import re
+import time
+from zipfile import ZipFile
+
+from lxml import etree
+
+from parse_xlsx_xml import ParseXlsx, SHARED_STRINGS_FILE
+from xlsx_merge import WorkbookMerger
+from xlsx_rc_convertor import split_address, col2str
+from xlsx_transforms import Cell, apply_format
+
+EXPORT_CSV = 'csv'
+EXPORT_NDJSON = 'ndjson'
+EXPORT_FORMATS = (EXPORT_CSV, EXPORT_NDJSON)
+# Characters which can't be in file name of sheet's export
+FILE_NAME_RE = re.compile(r'[\\/:*?"<>|\x00-\x1f]')
+# Encoder of json-strings, keeping non-ascii characters
+encode_json_string = json.JSONEncoder(ensure_ascii=False).encode
+
+
+def export_workbook(file_name, output_dir, output_format=EXPORT_CSV, formulas=False, **parse_options):
+    """
+        Export each sheet of workbook to output_dir as '<sheet name>.csv' or '.ndjson'.
+        parse_options are ParseXlsx's ones, eg. transforms or evaluate_formulas.
+        Returns [(sheet name, output file name)] in workbook's order.
+    """
+    return WorkbookExporter(file_name, output_format, formulas, **parse_options).export(output_dir)
+
+
+class WorkbookExporter(object):
+    """ Writes rows of workbook's sheets to CSV or NDJSON files as they are read """
+
+    def __init__(self, file_name, output_format=EXPORT_CSV, formulas=False, **parse_options):
+        if output_format not in EXPORT_FORMATS:
+            raise ValueError('Unknown export format: {0}'.format(output_format))
+        self.output_format = output_format
+        # Export formulas as A1-text
+        self.formulas = formulas
+        self.parser = ParseXlsx(file_name, **parse_options)
+        # Shared formulas have text in first cell of run only and number formats aren't exported
+        self.parser.shared_formulas = False
+        self.parser.transforms = [transform for transform in self.parser.transforms if transform is not apply_format]
+        self.metrics = self.parser.metrics
+
+    def export(self, output_dir):
+        """ Export each sheet to file in output_dir, see export_workbook """
+        extension = '.' + self.output_format
+        exported = []
+        with ZipFile(self.parser.file_name, 'r') as source_zip:
+            self.load_strings(source_zip)
+            file_names = set()
+            for sheet_name, sheet_file_name in WorkbookMerger.get_sheets(source_zip):
+                if sheet_file_name not in source_zip.NameToInfo:
+                    continue
+                base_name = FILE_NAME_RE.sub('_', sheet_name).strip() or 'Sheet'
+                output_name = base_name
+                number = 1
+                while output_name.lower() in file_names:
+                    number += 1
+                    output_name = '{0} ({1})'.format(base_name, number)
+                file_names.add(output_name.lower())
+                output_file_name = os.path.join(output_dir, output_name + extension)
+                with open(output_file_name, 'wb') as output_file:
+                    self.export_sheet(source_zip, sheet_file_name, output_file)
+                exported.append((sheet_name, output_file_name))
+        self.metrics.flush()
+
+        return exported
+
+    def load_strings(self, source_zip):
+        """ Load texts of shared strings, formula strings keep their indexes as they aren't pruned """
+        self.parser.reset()
+        self.parser.source_zip = source_zip
+        if SHARED_STRINGS_FILE in source_zip.NameToInfo:
+            with self.metrics.timer('load_shared_strings'):
+                self.parser.load_shared_strings(source_zip, keep_texts=True)
+            self.parser.removed_strings = []
+
+    def export_sheet(self, source_zip, sheet_file_name, output_file):
+        """ Write rows of sheet to output_file, strings have to be loaded by load_strings """
+        start = time.time()
+        parser = self.parser
+        if parser.evaluate_formulas:
+            # Formulas may refer to cells of next rows, so values are evaluated before rows are written
+            with source_zip.open(sheet_file_name) as source_file:
+                parser.formula_values = parser.evaluate_sheet(parser.iter_sheet_cells(source_file), sheet_file_name)
+        writer = csv.writer(output_file) if self.output_format == EXPORT_CSV else None
+        cell = None
+        last_row = 0
+        rows = 0
+        with source_zip.open(sheet_file_name) as source_file:
+            for event, row in etree.iterparse(source_file, tag='{*}row'):
+                if cell is None:
+                    cell = Cell(parser.get_namespace(row))
+                row_number = int(row.get('r') or last_row + 1)
+                # (col, value) of cells in order of columns
+                values = []
+                formulas = []
+                col = 0
+                for c_tag in row.iterchildren(cell.ns + 'c'):
+                    parser.transform_cell(cell.reset(c_tag))
+                    col = split_address(c_tag.get('r'))[1] if c_tag.get('r') else col + 1
+                    value, formula = self.get_cell_value(c_tag, cell.ns)
+                    if value is not None or formula is not None:
+                        values.append((col, value))
+                    if formula is not None and self.formulas:
+                        formulas.append((col, '=' + formula))
+                if writer is not None:
+                    # Empty rows keep rows of CSV aligned with sheet's ones
+                    for _ in range(last_row + 1, row_number):
+                        writer.writerow([])
+                    self.write_csv_row(writer, values, formulas)
+                else:
+                    self.write_ndjson_row(output_file, row_number, values, formulas)
+                last_row = row_number
+                rows += 1
+                row.clear()
+                while row.getprevious() is not None:
+                    del row.getparent()[0]
+        parser.formula_values = None
+        self.metrics.count('rows_exported', rows)
+        self.metrics.timing('export_sheet', time.time() - start, sheet=sheet_file_name)
+
+    def get_cell_value(self, c_tag, ns):
+        """ (value, A1-formula) of transformed cell, value is None for empty cell """
+        cell_type = c_tag.get('t', 'n')
+        f_tag = c_tag.find(ns + 'f')
+        formula = f_tag.text if f_tag is not None and f_tag.text else None
+        if cell_type == 'inlineStr':
+            is_tag = c_tag.find(ns + 'is')
+            if is_tag is None:
+                return None, formula
+            t_tag = is_tag.find(ns + 't')
+            if t_tag is not None:
+                return t_tag.text or '', formula
+            return ''.join(t.text or '' for t in is_tag.iterfind(ns + 'r/' + ns + 't')), formula
+
+        v_tag = c_tag.find(ns + 'v')
+        if v_tag is None or v_tag.text is None:
+            return None, formula
+        text = v_tag.text
+        if cell_type == 's':
+            return self.parser.shared_strings[int(text)], formula
+        if cell_type == 'b':
+            return text == '1', formula
+        if cell_type in ('str', 'e', 'd'):
+            return text, formula
+        try:
+            value = float(text)
+        except ValueError:
+            return text, formula
+        if math.isinf(value) or math.isnan(value):
+            # Isn't a number in json
+            return text, formula
+        if value == int(value) and not any(char in text for char in '.eE'):
+            return int(text), formula
+
+        return value, formula
+
+    @staticmethod
+    def format_csv_value(value):
+        """ Text of value in CSV """
+        if value is None:
+            return b''
+        if isinstance(value, bool):
+            return b'TRUE' if value else b'FALSE'
+        if isinstance(value, float):
+            return repr(value)
+        if isinstance(value, (int, long)):
+            return str(value)
+
+        return value.encode('utf-8')
+
+    def write_csv_row(self, writer, values, formulas):
+        """ Write row's values, formulas replace values of their cells """
+        cells = dict(values)
+        cells.update(formulas)
+        writer.writerow([self.format_csv_value(cells.get(col)) for col in range(1, max(cells or [0]) + 1)])
+
+    @staticmethod
+    def format_json_value(value):
+        """ Json-text of value """
+        if value is None:
+            return 'null'
+        if isinstance(value, bool):
+            return 'true' if value else 'false'
+        if isinstance(value, float):
+            return repr(value)
+        if isinstance(value, (int, long)):
+            return str(value)
+
+        return encode_json_string(value)
+
+    def write_ndjson_row(self, output_file, row_number, values, formulas):
+        """ Write row as json-line with cells by column's letters, keys are written in order of columns """
+        parts = ['{"row":', str(row_number), ',"cells":{']
+        parts.append(','.join(
+            u'"{0}":{1}'.format(col2str(col, run=1), self.format_json_value(value)) for col, value in values
+        ))
+        if formulas:
+            parts.append('},"formulas":{')
+            parts.append(','.join(
+                u'"{0}":{1}'.format(col2str(col, run=1), encode_json_string(formula)) for col, formula in formulas
+            ))
+        parts.append('}}\n')
+        data = ''.join(parts)
+        output_file.write(data.encode('utf-8') if isinstance(data, unicode) else data)
+
+
+def main():
+    parser = argparse.ArgumentParser(description=__doc__.strip().splitlines()[0])
+    parser.add_argument('file_name', help='xlsx file rendered by Reporting Services')
+    parser.add_argument('output_dir', help='directory of exported sheets')
+    parser.add_argument('--format', choices=EXPORT_FORMATS, default=EXPORT_CSV, help='export format')
+    parser.add_argument('--formulas', action='store_true', help='export formulas as A1-text')
+    parser.add_argument('--evaluate-formulas', action='store_true', help="export values of formulas")
+    args = parser.parse_args()
+
+    for sheet_name, output_file_name in export_workbook(args.file_name, args.output_dir, args.format,
+                                                        args.formulas, evaluate_formulas=args.evaluate_formulas):
+        print('{0} -> {1}'.format(sheet_name.encode('utf-8'), output_file_name))
+
+
+if __name__ == '__main__':
+    main()
@@ -0,0 +1,411 @@
+# -*- coding: utf-8 -*-
+"""
+    Merge of xlsx-workbooks rendered by Reporting Services for chunks of one report.
+    Rows of chunks are appended to sheets of the first workbook, or sheets of
+    chunks are added to it as new sheets. Shared strings and cell styles are merged.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: merge_workbooks([chunk1_file, chunk2_file], 'report.xlsx', mode='rows', header_rows=3)
+    Notice: Workbooks have to be merged before ParseXlsx, so R1C1-formula strings
+            still refer to right cells after rows are moved. Drawings, hyperlinks
+            and defined names of all workbooks except the first one are dropped.
+"""
+from __future__ import unicode_literals
+
+import posixpath
+import re
+from zipfile import ZipFile, ZIP_DEFLATED
+
+from lxml import etree
+
+from xlsx_styles import StyleRegistry
+from xlsx_zip import ZipMemberWriter, copy_zip_member, new_zip_info
+
+WORKBOOK_FILE = 'xl/workbook.xml'
+WORKBOOK_RELS_FILE = 'xl/_rels/workbook.xml.rels'
+CONTENT_TYPES_FILE = '[Content_Types].xml'
+SHARED_STRINGS_FILE = 'xl/sharedStrings.xml'
+STYLES_FILE = 'xl/styles.xml'
+
+NS_MAIN = 'http://schemas.openxmlformats.org/spreadsheetml/2006/main'
+NS_RELS = 'http://schemas.openxmlformats.org/officeDocument/2006/relationships'
+NS_PACKAGE_RELS = 'http://schemas.openxmlformats.org/package/2006/relationships'
+NS_CONTENT_TYPES = 'http://schemas.openxmlformats.org/package/2006/content-types'
+WORKSHEET_REL_TYPE = NS_RELS + '/worksheet'
+SHARED_STRINGS_REL_TYPE = NS_RELS + '/sharedStrings'
+WORKSHEET_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.worksheet+xml'
+SHARED_STRINGS_CONTENT_TYPE = 'application/vnd.openxmlformats-officedocument.spreadsheetml.sharedStrings+xml'
+
+# Merge modes: rows of chunks are appended to first workbook's sheets or chunks' sheets are added
+MERGE_ROWS = 'rows'
+MERGE_SHEETS = 'sheets'
+# Tags of sheet which follow mergeCells tag, it's inserted before them
+MERGE_CELLS_FOLLOWERS = (
+    'phoneticPr', 'conditionalFormatting', 'dataValidations', 'hyperlinks', 'printOptions', 'pageMargins',
+    'pageSetup', 'headerFooter', 'rowBreaks', 'colBreaks', 'customProperties', 'cellWatches',
+    'ignoredErrors', 'smartTags', 'drawing', 'legacyDrawing', 'legacyDrawingHF', 'picture', 'oleObjects',
+    'controls', 'webPublishItems', 'tableParts', 'extLst',
+)
+# Tags of sheet referring to sheet's relationships, they're dropped from added sheets
+RELATED_TAGS = (
+    'hyperlinks', 'drawing', 'legacyDrawing', 'legacyDrawingHF', 'picture', 'oleObjects', 'controls',
+    'tableParts',
+)
+MAX_SHEET_NAME_LENGTH = 31
+SHEET_NUMBER_RE = re.compile(r'sheet(\d+)\.xml$')
+CELL_ADDRESS_RE = re.compile(r'^(\$?[A-Z]+)(\$?)(\d+)$')
+
+
+def merge_workbooks(source_files, output_file, mode=MERGE_ROWS, header_rows=0):
+    """
+        Merge workbooks of source_files (file names or file objects) into output_file.
+        With mode='rows' first header_rows rows of each next workbook are skipped.
+    """
+    if mode not in (MERGE_ROWS, MERGE_SHEETS):
+        raise ValueError('Unknown merge mode {0!r}'.format(mode))
+    if not source_files:
+        raise ValueError('No workbooks to merge')
+
+    source_zips = []
+    try:
+        for source_file in source_files:
+            source_zips.append(ZipFile(source_file, 'r'))
+        with ZipFile(output_file, 'w', ZIP_DEFLATED, allowZip64=True) as output_zip:
+            WorkbookMerger(source_zips, mode, header_rows).write(output_zip)
+    finally:
+        for source_zip in source_zips:
+            source_zip.close()
+    if hasattr(output_file, 'seek'):
+        output_file.seek(0)
+
+
+def get_namespace(elem):
+    """ Namespace prefix of element's tag, eg. '{http://...}' """
+    return elem.tag[:elem.tag.index('}') + 1] if elem.tag[0] == '{' else ''
+
+
+def shift_address(address, offset):
+    """ Move A1-address down by offset rows """
+    match = CELL_ADDRESS_RE.match(address)
+    if not match:
+        return address
+    return '{0}{1}{2}'.format(match.group(1), match.group(2), int(match.group(3)) + offset)
+
+
+def get_address_row(address):
+    """ Row number of A1-address, 0 if it has no row """
+    match = CELL_ADDRESS_RE.match(address)
+    return int(match.group(3)) if match else 0
+
+
+class MergedStrings(object):
+    """ sharedStrings.xml of merged workbook, equal strings of next workbooks are reused """
+
+    def __init__(self, base_zip):
+        if SHARED_STRINGS_FILE in base_zip.NameToInfo:
+            with base_zip.open(SHARED_STRINGS_FILE) as source_file:
+                self.root = etree.parse(source_file).getroot()
+            self.is_new = False
+        else:
+            self.root = etree.Element('{%s}sst' % NS_MAIN, nsmap={None: NS_MAIN})
+            self.is_new = True
+        self.ns = get_namespace(self.root)
+        # Serialized si-tag -> its index
+        self.string_ids = {}
+        for index, si_tag in enumerate(self.root.iterchildren(self.ns + 'si')):
+            self.string_ids.setdefault(etree.tostring(si_tag), str(index))
+        self.count = int(self.root.get('count', len(self.string_ids)))
+        self.added = False
+
+    def merge(self, source_zip):
+        """ Add strings of workbook, returns dict: its string index -> merged index """
+        string_map = {}
+        if SHARED_STRINGS_FILE not in source_zip.NameToInfo:
+            return string_map
+        with source_zip.open(SHARED_STRINGS_FILE) as source_file:
+            for index, (event, si_tag) in enumerate(etree.iterparse(source_file, tag='{*}si')):
+                key = etree.tostring(si_tag)
+                if key not in self.string_ids:
+                    self.string_ids[key] = str(len(self.root))
+                    self.root.append(etree.fromstring(key))
+                    self.added = True
+                string_map[str(index)] = self.string_ids[key]
+                si_tag.clear()
+        self.count += len(string_map)
+
+        return string_map
+
+    def tostring(self):
+        """ Serialize sharedStrings.xml, count of references is estimated for merged strings """
+        self.root.attrib['count'] = str(max(self.count, len(self.root)))
+        self.root.attrib['uniqueCount'] = str(len(self.root))
+        return etree.tostring(self.root, xml_declaration=True, encoding='UTF-8', standalone=True)
+
+
+class WorkbookMerger(object):
+    """ Writes first workbook of source_zips with sheets or rows of next ones merged into it """
+
+    def __init__(self, source_zips, mode=MERGE_ROWS, header_rows=0):
+        self.base_zip = source_zips[0]
+        self.chunk_zips = source_zips[1:]
+        self.mode = mode
+        self.header_rows = header_rows
+        # Parsed package files of first workbook which are changed by merge
+        self.package_trees = {}
+
+        self.styles = StyleRegistry(self.base_zip.open(STYLES_FILE))
+        self.strings = MergedStrings(self.base_zip)
+        # Maps of each next workbook's style and string ids to merged ones
+        self.style_maps = [self.styles.merge(chunk_zip.open(STYLES_FILE)) for chunk_zip in self.chunk_zips]
+        self.string_maps = [self.strings.merge(chunk_zip) for chunk_zip in self.chunk_zips]
+
+        self.base_sheets = self.get_sheets(self.base_zip)
+        self.chunk_sheets = [self.get_sheets(chunk_zip) for chunk_zip in self.chunk_zips]
+
+    def write(self, output_zip):
+        """ Write merged workbook to output_zip """
+        base_sheet_files = set(file_name for _, file_name in self.base_sheets)
+        new_sheets = self.add_sheets() if self.mode == MERGE_SHEETS else []
+        if self.strings.is_new and self.strings.added:
+            self.add_shared_strings()
+
+        # Changed members are written in place of first workbook's ones, added ones at the end
+        for zip_info in self.base_zip.infolist():
+            file_name = zip_info.filename
+            if self.mode == MERGE_ROWS and file_name in base_sheet_files:
+                self.write_tree(output_zip, file_name, self.merge_rows(file_name), zip_info)
+            elif file_name in self.package_trees:
+                self.write_tree(output_zip, file_name, self.package_trees[file_name].getroot(), zip_info)
+            elif file_name == STYLES_FILE:
+                output_zip.writestr(new_zip_info(file_name, zip_info), self.styles.tostring())
+            elif file_name == SHARED_STRINGS_FILE:
+                output_zip.writestr(new_zip_info(file_name, zip_info), self.strings.tostring())
+            else:
+                copy_zip_member(self.base_zip, zip_info, output_zip)
+
+        for file_name, sheet in new_sheets:
+            self.write_tree(output_zip, file_name, sheet)
+        if self.strings.is_new and self.strings.added:
+            output_zip.writestr(new_zip_info(SHARED_STRINGS_FILE), self.strings.tostring())
+
+    @staticmethod
+    def write_tree(output_zip, file_name, root, source_info=None):
+        """ Write xml tree as member of output_zip """
+        with ZipMemberWriter(output_zip, new_zip_info(file_name, source_info)) as output_file:
+            output_file.write(etree.tostring(root, xml_declaration=True, encoding='UTF-8', standalone=True))
+
+    def get_tree(self, file_name):
+        """ Parse package file of first workbook, which is written to output after merge """
+        if file_name not in self.package_trees:
+            with self.base_zip.open(file_name) as source_file:
+                self.package_trees[file_name] = etree.parse(source_file)
+        return self.package_trees[file_name]
+
+    @staticmethod
+    def get_sheets(source_zip):
+        """ (name, file name) of workbook's sheets in workbook's order """
+        if WORKBOOK_FILE not in source_zip.NameToInfo or WORKBOOK_RELS_FILE not in source_zip.NameToInfo:
+            file_names = sorted(
+                (int(SHEET_NUMBER_RE.search(name).group(1)), name) for name in source_zip.namelist()
+                if name.startswith('xl/worksheets/') and SHEET_NUMBER_RE.search(name)
+            )
+            return [('Sheet{0}'.format(number), name) for number, name in file_names]
+
+        with source_zip.open(WORKBOOK_RELS_FILE) as rels_file:
+            targets = dict(
+                (rel.get('Id'), rel.get('Target')) for rel in etree.parse(rels_file).getroot()
+            )
+        sheets = []
+        with source_zip.open(WORKBOOK_FILE) as workbook_file:
+            for sheet in etree.parse(workbook_file).getroot().iterfind('{*}sheets/{*}sheet'):
+                target = targets.get(sheet.get('{%s}id' % NS_RELS))
+                if not target:
+                    continue
+                if target.startswith('/'):
+                    file_name = target[1:]
+                else:
+                    file_name = posixpath.normpath(posixpath.join(posixpath.dirname(WORKBOOK_FILE), target))
+                sheets.append((sheet.get('name'), file_name))
+
+        return sheets
+
+    @staticmethod
+    def remap_ids(sheet, string_map, style_map):
+        """ Renumber shared strings and styles of next workbook's sheet in place """
+        ns = get_namespace(sheet)
+        if style_map:
+            for tag_name in ('row', 'c'):
+                for elem in sheet.iter(ns + tag_name):
+                    style_id = elem.get('s')
+                    if style_id is not None:
+                        elem.attrib['s'] = style_map.get(style_id, style_id)
+            for col in sheet.iter(ns + 'col'):
+                style_id = col.get('style')
+                if style_id is not None:
+                    col.attrib['style'] = style_map.get(style_id, style_id)
+        if string_map:
+            for c_tag in sheet.iter(ns + 'c'):
+                if c_tag.get('t') == 's':
+                    v_tag = c_tag.find(ns + 'v')
+                    if v_tag is not None and v_tag.text:
+                        v_tag.text = string_map.get(v_tag.text, v_tag.text)
+
+    @staticmethod
+    def parse_sheet(source_zip, file_name):
+        """ Parse sheet of workbook """
+        with source_zip.open(file_name) as source_file:
+            return etree.parse(source_file).getroot()
+
+    def merge_rows(self, file_name):
+        """ Append rows of next workbooks' sheets to first workbook's sheet """
+        index = [name for _, name in self.base_sheets].index(file_name)
+        sheet = self.parse_sheet(self.base_zip, file_name)
+        ns = get_namespace(sheet)
+        sheet_data = sheet.find(ns + 'sheetData')
+        last_row = 0
+        for row in sheet_data.iterchildren(ns + 'row'):
+            last_row = int(row.get('r', last_row + 1))
+        merge_refs = []
+
+        for chunk_zip, chunk_sheets, string_map, style_map in zip(
+                self.chunk_zips, self.chunk_sheets, self.string_maps, self.style_maps):
+            if index >= len(chunk_sheets):
+                continue
+            chunk_sheet = self.parse_sheet(chunk_zip, chunk_sheets[index][1])
+            self.remap_ids(chunk_sheet, string_map, style_map)
+            chunk_ns = get_namespace(chunk_sheet)
+            offset = last_row - self.header_rows
+            row_number = 0
+            for row in list(chunk_sheet.find(chunk_ns + 'sheetData').iterchildren(chunk_ns + 'row')):
+                row_number = int(row.get('r', row_number + 1))
+                if row_number <= self.header_rows:
+                    continue
+                last_row = row_number + offset
+                row.attrib['r'] = str(last_row)
+                for c_tag in row.iterchildren(chunk_ns + 'c'):
+                    if c_tag.get('r'):
+                        c_tag.attrib['r'] = shift_address(c_tag.get('r'), offset)
+                sheet_data.append(row)
+            for merge_cell in chunk_sheet.iterfind(chunk_ns + 'mergeCells/' + chunk_ns + 'mergeCell'):
+                refs = merge_cell.get('ref', '').split(':')
+                if get_address_row(refs[0]) > self.header_rows:
+                    merge_refs.append(':'.join(shift_address(ref, offset) for ref in refs))
+
+        if merge_refs:
+            self.add_merge_cells(sheet, merge_refs)
+        dimension = sheet.find(ns + 'dimension')
+        if dimension is not None:
+            refs = dimension.get('ref', '').split(':')
+            if len(refs) == 2 and CELL_ADDRESS_RE.match(refs[1]):
+                dimension.attrib['ref'] = '{0}:{1}'.format(
+                    refs[0], shift_address(refs[1], last_row - get_address_row(refs[1]))
+                )
+
+        return sheet
+
+    @staticmethod
+    def add_merge_cells(sheet, merge_refs):
+        """ Add merged ranges to sheet's mergeCells, which is created if sheet has none """
+        ns = get_namespace(sheet)
+        merge_cells = sheet.find(ns + 'mergeCells')
+        if merge_cells is None:
+            merge_cells = etree.Element(ns + 'mergeCells')
+            followers = [
+                sheet.index(child) for child in sheet
+                if isinstance(child.tag, basestring) and etree.QName(child).localname in MERGE_CELLS_FOLLOWERS
+            ]
+            sheet.insert(followers[0] if followers else len(sheet), merge_cells)
+        for ref in merge_refs:
+            etree.SubElement(merge_cells, ns + 'mergeCell', {'ref': ref})
+        merge_cells.attrib['count'] = str(len(merge_cells))
+
+    def add_sheets(self):
+        """ Register sheets of next workbooks in first workbook, returns [(file name, sheet)] """
+        workbook = self.get_tree(WORKBOOK_FILE).getroot()
+        rels = self.get_tree(WORKBOOK_RELS_FILE).getroot()
+        content_types = self.get_tree(CONTENT_TYPES_FILE).getroot()
+        ns = get_namespace(workbook)
+        sheets_tag = workbook.find(ns + 'sheets')
+
+        sheet_names = set(sheet.get('name').lower() for sheet in sheets_tag)
+        sheet_id = max([int(sheet.get('sheetId', 0)) for sheet in sheets_tag] or [0])
+        rel_ids = set(rel.get('Id') for rel in rels)
+        sheet_number = max([
+            int(SHEET_NUMBER_RE.search(name).group(1)) for name in self.base_zip.namelist()
+            if name.startswith('xl/worksheets/') and SHEET_NUMBER_RE.search(name)
+        ] or [0])
+
+        new_sheets = []
+        for chunk_number, (chunk_zip, chunk_sheets, string_map, style_map) in enumerate(zip(
+                self.chunk_zips, self.chunk_sheets, self.string_maps, self.style_maps), 2):
+            for name, file_name in chunk_sheets:
+                sheet = self.parse_sheet(chunk_zip, file_name)
+                self.remap_ids(sheet, string_map, style_map)
+                self.drop_related_tags(sheet)
+
+                sheet_id += 1
+                sheet_number += 1
+                new_file_name = 'xl/worksheets/sheet{0}.xml'.format(sheet_number)
+                rel_id = 'rId{0}'.format(len(rel_ids) + 1)
+                while rel_id in rel_ids:
+                    rel_id += '_'
+                rel_ids.add(rel_id)
+                new_name = self.get_sheet_name(name, chunk_number, sheet_names)
+                sheet_names.add(new_name.lower())
+
+                etree.SubElement(sheets_tag, ns + 'sheet', {
+                    'name': new_name,
+                    'sheetId': str(sheet_id),
+                    '{%s}id' % NS_RELS: rel_id,
+                })
+                etree.SubElement(rels, '{%s}Relationship' % NS_PACKAGE_RELS, {
+                    'Id': rel_id,
+                    'Type': WORKSHEET_REL_TYPE,
+                    'Target': posixpath.relpath(new_file_name, posixpath.dirname(WORKBOOK_FILE)),
+                })
+                etree.SubElement(content_types, '{%s}Override' % NS_CONTENT_TYPES, {
+                    'PartName': '/' + new_file_name,
+                    'ContentType': WORKSHEET_CONTENT_TYPE,
+                })
+                new_sheets.append((new_file_name, sheet))
+
+        return new_sheets
+
+    @staticmethod
+    def get_sheet_name(name, chunk_number, sheet_names):
+        """ Unique name of chunk's sheet, eg. 'Sheet1 (2)' """
+        suffix = ' ({0})'.format(chunk_number)
+        new_name = name[:MAX_SHEET_NAME_LENGTH - len(suffix)] + suffix
+        copy_number = 1
+        while new_name.lower() in sheet_names:
+            copy_number += 1
+            suffix = ' ({0}.{1})'.format(chunk_number, copy_number)
+            new_name = name[:MAX_SHEET_NAME_LENGTH - len(suffix)] + suffix
+        return new_name
+
+    @staticmethod
+    def drop_related_tags(sheet):
+        """ Remove tags referring to relationships of sheet, which aren't copied, and tab selection """
+        ns = get_namespace(sheet)
+        for tag_name in RELATED_TAGS:
+            for elem in sheet.findall(ns + tag_name):
+                sheet.remove(elem)
+        for sheet_view in sheet.iterfind(ns + 'sheetViews/' + ns + 'sheetView'):
+            sheet_view.attrib.pop('tabSelected', None)
+
+    def add_shared_strings(self):
+        """ Register sharedStrings.xml in first workbook which was written with inline strings """
+        rels = self.get_tree(WORKBOOK_RELS_FILE).getroot()
+        content_types = self.get_tree(CONTENT_TYPES_FILE).getroot()
+        rel_ids = set(rel.get('Id') for rel in rels)
+        rel_id = 'rId{0}'.format(len(rel_ids) + 1)
+        while rel_id in rel_ids:
+            rel_id += '_'
+        etree.SubElement(rels, '{%s}Relationship' % NS_PACKAGE_RELS, {
+            'Id': rel_id,
+            'Type': SHARED_STRINGS_REL_TYPE,
+            'Target': posixpath.relpath(SHARED_STRINGS_FILE, posixpath.dirname(WORKBOOK_FILE)),
+        })
+        etree.SubElement(content_types, '{%s}Override' % NS_CONTENT_TYPES, {
+            'PartName': '/' + SHARED_STRINGS_FILE,
+            'ContentType': SHARED_STRINGS_CONTENT_TYPE,
+        })
@@ -7,11 +7,58 @@
 """
 
 import re
+from itertools import product
+from string import ascii_uppercase, digits
+
+# Cell's address in A1-notation, eg. 'AB12'
+ADDRESS_RE = re.compile(r'(?P<col>[A-Z]+)(?P<row>[0-9]+)')
+# Cell's format in formula, eg. '@0.00@'
+FORMAT_RE = re.compile(r'@.*@')
+# R1C1-reference (eg. 'R[-1]C', 'RC1', 'R2C[3]') or text which mustn't be converted:
+# string literal or quoted sheet's name
+RC_TOKEN_RE = re.compile(r"""
+    (?P<text>"(?:[^"]|"")*"|'(?:[^']|'')*')
+    |
+    (?<![A-Z0-9_.$])
+    R(?:\[(?P<row_offset>-?\d+)]|(?P<row>\d+))?
+    C(?:\[(?P<col_offset>-?\d+)]|(?P<col>\d+))?
+    (?![A-Z0-9_(!\[])
+""", re.VERBOSE | re.IGNORECASE)
+# Parsed R1C1-formulae by formula's text, SSRS repeats the same formula in each row of column
+RC_TEMPLATE_CACHE = {}
+RC_TEMPLATE_CACHE_SIZE = 10000
+# Parsed cells' addresses, eg. 'B3' -> (3, 2)
+ADDRESS_CACHE = {}
+ADDRESS_CACHE_SIZE = 100000
+# Bounds of Excel's sheet
+MAX_COLUMNS = 16384
+MAX_ROWS = 1048576
+
+
+def build_column_names(count):
+    """ List of columns' literals, index is column's number, eg. [..., 'Z', 'AA', ...] """
+    names = ['']
+    length = 0
+    while len(names) <= count:
+        length += 1
+        for letters in product(ascii_uppercase, repeat=length):
+            names.append(''.join(letters))
+            if len(names) > count:
+                break
+
+    return names
+
+
+# Literals of all columns of sheet and their numbers
+COLUMN_NAMES = build_column_names(MAX_COLUMNS)
+COLUMN_NUMBERS = dict((name, num) for num, name in enumerate(COLUMN_NAMES) if name)
 
 
 def col2str(num, run=0):
     """ Converts column number to literal format (eg. 27 = 'AA') """
-    if run:
+    if run and isinstance(num, (int, long)) and 0 <= num <= MAX_COLUMNS:
+        res = COLUMN_NAMES[num]
+    elif run:
         inum = num
         res = ''
 
@@ -28,6 +75,10 @@ def col2str(num, run=0):
 
 def col2int(colstr):
     """ Converts column literal to number (eg. 'AA' = 27, 'AAA' = 703 etc.) """
+    res = COLUMN_NUMBERS.get(colstr)
+    if res is not None:
+        return res
+
     res = 0
     for i, s in enumerate(colstr.upper()[::-1]):
         res += (ord(s)-64)*(26**i)
@@ -36,11 +87,11 @@ def col2int(colstr):
 
 
 def check_range(value, mode=0):
-    """ Validate ranges of column (mode=1) or row (mode=0) """
+    """ Validate ranges of column (mode=1) or row (mode=0), numbers out of sheet wrap around as in Excel """
     if not isinstance(value, int):
         value = int(value)
-    bound = 16384 if mode else 1048756
-    value %= bound
+    bound = MAX_COLUMNS if mode else MAX_ROWS
+    value = (value - 1) % bound + 1
 
     return value
 
@@ -50,87 +101,111 @@ def convert_rc_formula(formula, address):
     assert isinstance(formula, (str, unicode))
     assert isinstance(address, (str, unicode))
 
+    row, col = split_address(address)
+
+    return render_rc_template(get_rc_template(formula), row, col)
+
+
+def convert_rc_formulas(pairs):
+    """ Converts iterable of (formula, address) pairs, returns list of A1-typed formulae """
+    templates = {}
+    result = []
+    for formula, address in pairs:
+        template = templates.get(formula)
+        if template is None:
+            template = templates[formula] = get_rc_template(formula)
+        row, col = split_address(address)
+        result.append(render_rc_template(template, row, col))
+
+    return result
+
+
+def split_address(address):
+    """ Convert cell's string-address to tuple like as (row, col), eg. 'B3' = (3, 2) """
+    position = ADDRESS_CACHE.get(address)
+    if position is None:
+        col = address.rstrip(digits)
+        if col in COLUMN_NUMBERS and len(col) < len(address):
+            # Plain address like 'AB12' doesn't need regex
+            position = int(address[len(col):]), COLUMN_NUMBERS[col]
+        else:
+            addr = ADDRESS_RE.search(address.upper())
+            position = int(addr.group('row')), col2int(addr.group('col'))
+        if len(ADDRESS_CACHE) >= ADDRESS_CACHE_SIZE:
+            ADDRESS_CACHE.clear()
+        ADDRESS_CACHE[address] = position
+
+    return position
+
+
+def get_rc_template(formula):
+    """ Get cached template of R1C1-typed formula, see parse_rc_formula """
+    template = RC_TEMPLATE_CACHE.get(formula)
+    if template is None:
+        if len(RC_TEMPLATE_CACHE) >= RC_TEMPLATE_CACHE_SIZE:
+            RC_TEMPLATE_CACHE.clear()
+        template = RC_TEMPLATE_CACHE[formula] = parse_rc_formula(clean_rc_formula(formula))
+
+    return template
+
+
+def clean_rc_formula(formula):
+    """ Prepare R1C1-typed formula to parsing: replace separators, remove spaces and format """
     formula = formula.replace(';', ',')
     # Excluding for formulae with sheet links
     if '!' not in formula:
         formula = formula.upper().replace(' ', '')
 
     # Delete format from formula
-    format_re = re.compile(r'@.*@')
-    formula = re.sub(format_re, '', formula)
-
-    address = address.upper()
-
-    # Convert cell's string-address to tuple like as (row, col)
-    addr_re = re.compile(r'(?P<col>[A-Z]+)(?P<row>[0-9]+)')
-    addr = addr_re.search(address)
-    address = (
-        int(
-            addr.group('row')
-        ),
-        col2int(
-            addr.group('col')
-        ),
-    )
-
-    # Get cell offsets from formula
-    # TODO: '=R[1]C-RC1'
-    form_re = re.compile(r'(?P<row_offset>R\[?\-?\d*]?)(?P<col_offset>C\[?\-?\d*]?)')
-    form = form_re.findall(formula)
-    # Parse rows and columns
-    replace_list = []
-    part_re = re.compile(r'(?P<offset>[RC]\[\-?\d+]?)|(?P<abs>[RC]\d*)')
-    for part in form:
-        res_part = []
-        for i, item in enumerate(part):
-            srch = part_re.search(item).groupdict()
-            if srch.get('abs'):
-                res_part.append(
-                    col2str(
-                        check_range(
-                            srch.get('abs')[1:] or address[i],
-                            mode=i
-                        ),
-                        run=i
-                    )
-                )
-            elif srch.get('offset'):
-                try:
-                    res_part.append(
-                        col2str(
-                            check_range(
-                                int(srch.get('offset')[2:-1]) + address[i],
-                                mode=i
-                            ),
-                            run=i
-                        )
-                    )
-                except:
-                    raise BaseException
-                    exit(1)
-
-
-        # Write parts to list
-        replace_list.append(
-            (
-                '{0}{1}'.format(*part),
-                '{1}{0}'.format(*res_part),
-            )
-        )
-
-    # Replace formula and return
-    for repl in replace_list:
-        formula = formula.replace(repl[0], repl[1], 1)
-
-    return formula
+    return FORMAT_RE.sub('', formula)
+
+
+def parse_rc_formula(formula):
+    """
+        Split R1C1-typed formula to template: list of text parts and references.
+        Reference is tuple (row, is_row_offset, col, is_col_offset), eg. R[-1]C2 = (-1, True, 2, False)
+    """
+    template = []
+    position = 0
+    for token in RC_TOKEN_RE.finditer(formula):
+        if token.group('text'):
+            # Leave string literals and quoted sheet names as is
+            continue
+        template.append(formula[position:token.start()])
+        row_offset, row, col_offset, col = token.group('row_offset', 'row', 'col_offset', 'col')
+        template.append((
+            int(row_offset or row or 0), row is None,
+            int(col_offset or col or 0), col is None,
+        ))
+        position = token.end()
+    template.append(formula[position:])
+
+    return tuple(template)
+
+
+def render_rc_template(template, row, col):
+    """ Build A1-typed formula from template of parse_rc_formula for cell (row, col) """
+    parts = []
+    for part in template:
+        if isinstance(part, tuple):
+            ref_row, is_row_offset, ref_col, is_col_offset = part
+            parts.append('{0}{1}{2}{3}'.format(
+                '' if is_col_offset else '$',
+                COLUMN_NAMES[check_range(ref_col + col if is_col_offset else ref_col, mode=1)],
+                '' if is_row_offset else '$',
+                check_range(ref_row + row if is_row_offset else ref_row, mode=0),
+            ))
+        else:
+            parts.append(part)
+
+    return ''.join(parts)
 
 
 def get_cell_format(formula):
     """ Get format from formula to set to formula's cell """
     assert isinstance(formula, (str, unicode))
-    format_reg = re.compile(r'(?P<format>@.*@)')
-    fmt_search = format_reg.search(formula)
-    ex_format = fmt_search.group('format') if fmt_search else ''
+    fmt_search = FORMAT_RE.search(formula)
+    ex_format = fmt_search.group() if fmt_search else ''
 
     # Return string without @ and '
     return ex_format[1:-1]
@@ -0,0 +1,162 @@
+# -*- coding: utf-8 -*-
+"""
+    Workbook styles registry for xlsx post-processing.
+    Adds cell formats to styles.xml, reusing already added ones.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Notice: Custom number formats ids start from 164, lower ids are built-in
+            formats of Excel.
+"""
+from __future__ import unicode_literals
+
+from copy import deepcopy
+from lxml import etree
+
+# Locale prefix of number formats added to workbook
+FORMAT_LOCALE = '[$-010419]'
+# First id of custom number format
+FIRST_CUSTOM_FORMAT_ID = 164
+
+
+def style_key(style_id, new_format):
+    """ Key of added cell style: id of base style and number format """
+    return str(style_id or 0), new_format
+
+
+class StyleRegistry(object):
+    """ styles.xml of workbook with indexes of number formats and added cell styles """
+
+    def __init__(self, styles_file):
+        """ Load styles.xml from file name or file object """
+        self.style_list = etree.parse(styles_file)
+        root = self.style_list.getroot()
+        self.cell_xfs = root.xpath("*[local-name()='cellXfs']")[0]
+        self.xf_tags = self.cell_xfs.xpath("*[local-name()='xf']")
+        self.base_count = len(self.xf_tags)
+
+        num_fmts = root.xpath("*[local-name()='numFmts']")
+        if num_fmts:
+            self.num_fmts = num_fmts[0]
+        else:
+            # numFmts has to be the first tag of styleSheet
+            self.num_fmts = etree.Element(etree.QName(root, 'numFmts'), {'count': '0'})
+            root.insert(0, self.num_fmts)
+
+        # formatCode -> numFmtId
+        self.format_ids = {}
+        self.next_format_id = FIRST_CUSTOM_FORMAT_ID
+        for num_fmt in self.num_fmts.xpath("*[local-name()='numFmt']"):
+            self.format_ids.setdefault(num_fmt.get('formatCode'), num_fmt.get('numFmtId'))
+            self.next_format_id = max(self.next_format_id, int(num_fmt.get('numFmtId')) + 1)
+
+        # (style_id, format) -> id of added xf
+        self.added_styles = {}
+
+    @property
+    def added_count(self):
+        """ Number of cell styles added to workbook """
+        return len(self.xf_tags) - self.base_count
+
+    def get_style(self, style_id, new_format):
+        """ Get id of cell style which is style_id's style with new_format number format """
+        key = style_key(style_id, new_format)
+        style_id = key[0]
+        if key not in self.added_styles:
+            format_id = self.get_format_id(new_format)
+            if self.xf_tags[int(style_id)].get('numFmtId') == format_id:
+                # Base style already has this format
+                self.added_styles[key] = style_id
+            else:
+                new_xf = deepcopy(self.xf_tags[int(style_id)])
+                new_xf.attrib['numFmtId'] = format_id
+                self.cell_xfs.append(new_xf)
+                self.xf_tags.append(new_xf)
+                self.cell_xfs.attrib['count'] = str(len(self.xf_tags))
+                self.added_styles[key] = str(len(self.xf_tags) - 1)
+
+        return self.added_styles[key]
+
+    def get_format_id(self, new_format):
+        """ Get id of number format, adding it to numFmts if it doesn't exist """
+        return self.add_format_code('{0}{1}'.format(FORMAT_LOCALE, new_format.replace("'", '"')))
+
+    def add_format_code(self, format_code):
+        """ Get id of number format code, adding it to numFmts if it doesn't exist """
+        if format_code not in self.format_ids:
+            format_id = str(self.next_format_id)
+            self.next_format_id += 1
+            etree.SubElement(self.num_fmts, etree.QName(self.num_fmts, 'numFmt'), {
+                'numFmtId': format_id,
+                'formatCode': format_code,
+            })
+            self.num_fmts.attrib['count'] = str(int(self.num_fmts.get('count', 0)) + 1)
+            self.format_ids[format_code] = format_id
+
+        return self.format_ids[format_code]
+
+    def merge(self, styles_file):
+        """
+            Add cell styles of other workbook's styles.xml with their fonts, fills, borders
+            and number formats, reusing equal ones. Returns dict: other workbook's style id ->
+            style id in this workbook. Differential and named styles aren't merged.
+        """
+        other_root = etree.parse(styles_file).getroot()
+        id_maps = {
+            'fontId': self.merge_items(other_root, 'fonts'),
+            'fillId': self.merge_items(other_root, 'fills'),
+            'borderId': self.merge_items(other_root, 'borders'),
+            'numFmtId': dict(
+                (num_fmt.get('numFmtId'), self.add_format_code(num_fmt.get('formatCode')))
+                for num_fmt in other_root.xpath("*[local-name()='numFmts']/*[local-name()='numFmt']")
+            ),
+        }
+        id_maps['xfId'] = self.merge_items(other_root, 'cellStyleXfs', id_maps)
+
+        return self.merge_items(other_root, 'cellXfs', id_maps)
+
+    def merge_items(self, other_root, list_name, id_maps=None):
+        """ Add items of other styles.xml's list, eg. fonts, returns dict: other item's id -> item's id """
+        root = self.style_list.getroot()
+        items = root.xpath("*[local-name()=$name]", name=list_name)
+        other_items = other_root.xpath("*[local-name()=$name]", name=list_name)
+        if not items or not other_items:
+            return {}
+        items = items[0]
+        # Serialized item -> its id, equal items of other workbook are reused
+        item_ids = {}
+        for index, item in enumerate(items):
+            item_ids.setdefault(etree.tostring(item), str(index))
+
+        item_map = {}
+        for index, item in enumerate(other_items[0]):
+            item = deepcopy(item)
+            for attr_name, id_map in (id_maps or {}).items():
+                if item.get(attr_name) in id_map:
+                    item.attrib[attr_name] = id_map[item.get(attr_name)]
+            key = etree.tostring(item)
+            if key not in item_ids:
+                items.append(item)
+                if items is self.cell_xfs:
+                    self.xf_tags.append(item)
+                item_ids[key] = str(len(items) - 1)
+                items.attrib['count'] = str(len(items))
+            item_map[str(index)] = item_ids[key]
+
+        return item_map
+
+    def tostring(self):
+        """ Serialize styles.xml """
+        return etree.tostring(self.style_list, xml_declaration=True, encoding='UTF-8', standalone=True)
+
+
+class StyleMapping(object):
+    """
+        Read-only view of styles added by StyleRegistry, used by process pool's workers.
+        All (style_id, format) pairs of workbook have to be added to registry before.
+    """
+
+    def __init__(self, added_styles):
+        self.added_styles = added_styles
+
+    def get_style(self, style_id, new_format):
+        """ Get id of cell style which is style_id's style with new_format number format """
+        return self.added_styles[style_key(style_id, new_format)]
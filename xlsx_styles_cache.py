@@ -0,0 +1,198 @@
+# -*- coding: utf-8 -*-
+"""
+    On-disk cache of styles.xml with cell formats added by ParseXlsx.
+    Entry is keyed by hash of original styles.xml and list of (style_id, format)
+    pairs in order of use, it keeps rewritten styles.xml and ids of added cell styles,
+    so next renders of the same report skip loading and rewriting of styles.xml.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Usage: ParseXlsx(file_name, run=True, styles_cache_dir='/var/cache/xlsx_styles')
+    Notice: ParseXlsx collects formats of all sheets before parsing, so entry is used
+            only if workbook's formats are exactly entry's ones and styles.xml is the
+            same as uncached run writes. Otherwise original styles.xml is rewritten.
+"""
+import hashlib
+import json
+import os
+from io import BytesIO
+from tempfile import mkstemp
+
+from xlsx_styles import StyleRegistry, style_key
+
+# Extension of cache entries' files
+STYLES_CACHE_FILE_EXT = '.styles.json'
+
+
+class StylesCache(object):
+    """ Directory of styles.xml entries with LRU eviction over max_size bytes """
+
+    def __init__(self, cache_dir, max_size=64 * 1024 * 1024):
+        self.cache_dir = cache_dir
+        self.max_size = max_size
+        if not os.path.isdir(cache_dir):
+            try:
+                os.makedirs(cache_dir)
+            except OSError:
+                # Created by another process
+                if not os.path.isdir(cache_dir):
+                    raise
+
+    @staticmethod
+    def key(styles_hash, pairs):
+        """ Key of entry: hash of original styles.xml and hash of list of (style_id, format, ...) pairs """
+        pairs_string = json.dumps([[style_id, new_format] for style_id, new_format in (pair[:2] for pair in pairs)])
+        return '{0}.{1}'.format(styles_hash, hashlib.sha1(pairs_string.encode('utf-8')).hexdigest())
+
+    def get(self, styles_hash, pairs):
+        """
+            Entry of original styles.xml and (style_id, format) pairs, None if it isn't cached.
+            Entry is dict: {'pairs': [[style_id, format, new style_id], ...], 'added_count': ..., 'styles_xml': ...}
+        """
+        path = os.path.join(self.cache_dir, self.key(styles_hash, pairs) + STYLES_CACHE_FILE_EXT)
+        try:
+            with open(path, 'rb') as entry_file:
+                entry = json.load(entry_file)
+            # Access time is last use time for LRU
+            os.utime(path, None)
+        except (IOError, OSError, ValueError):
+            # Not cached, evicted by another process or broken
+            return None
+
+        return entry
+
+    def put(self, styles_hash, pairs, styles_xml, added_count):
+        """
+            Save rewritten styles.xml of original styles.xml, its [(style_id, format, new style_id)]
+            pairs and number of cell styles added to it
+        """
+        fd, temp_path = mkstemp(suffix='.tmp', dir=self.cache_dir)
+        try:
+            with os.fdopen(fd, 'wb') as temp_file:
+                json.dump({
+                    'pairs': pairs,
+                    'added_count': added_count,
+                    'styles_xml': styles_xml.decode('utf-8'),
+                }, temp_file)
+            path = os.path.join(self.cache_dir, self.key(styles_hash, pairs) + STYLES_CACHE_FILE_EXT)
+            try:
+                os.rename(temp_path, path)
+            except OSError:
+                # Windows doesn't replace existing file, which is written by another process then
+                os.remove(temp_path)
+        except Exception:
+            if os.path.exists(temp_path):
+                os.remove(temp_path)
+            raise
+
+        self.evict()
+
+    def evict(self):
+        """ Remove least recently used entries over max_size """
+        files = []
+        for file_name in os.listdir(self.cache_dir):
+            if not file_name.endswith(STYLES_CACHE_FILE_EXT):
+                continue
+            path = os.path.join(self.cache_dir, file_name)
+            try:
+                stat = os.stat(path)
+            except OSError:
+                # Removed by another process
+                continue
+            files.append((stat.st_atime, stat.st_size, path))
+
+        total_size = sum(size for _, size, _ in files)
+        for _, size, path in sorted(files):
+            if total_size <= self.max_size:
+                break
+            try:
+                os.remove(path)
+            except OSError:
+                pass
+            total_size -= size
+
+    def clear(self):
+        """ Remove all entries """
+        for file_name in os.listdir(self.cache_dir):
+            if file_name.endswith(STYLES_CACHE_FILE_EXT):
+                try:
+                    os.remove(os.path.join(self.cache_dir, file_name))
+                except OSError:
+                    pass
+
+
+class CachedStyles(object):
+    """
+        Workbook's styles with formats (style_id, format) in order of use, which are given
+        from StylesCache entry of its styles.xml and formats. Otherwise StyleRegistry is
+        loaded and formats are added to it in the same order.
+    """
+
+    def __init__(self, cache, styles_xml, formats=()):
+        self.cache = cache
+        self.styles_xml = styles_xml
+        self.styles_hash = hashlib.sha1(styles_xml).hexdigest()
+        # Unique (style_id, format) keys in order of use, cell styles are added in this order
+        self.pairs = []
+        for style_id, new_format in formats:
+            key = style_key(style_id, new_format)
+            if key not in self.pairs:
+                self.pairs.append(key)
+        self.entry = cache.get(self.styles_hash, self.pairs) if self.pairs else None
+        # (style_id, format) -> id of added xf, from entry
+        self.cached_styles = {}
+        if self.entry:
+            for style_id, new_format, new_style_id in self.entry['pairs']:
+                self.cached_styles[style_key(style_id, new_format)] = new_style_id
+        self.registry = None
+        if self.entry is None:
+            self.load_registry()
+
+    @property
+    def is_cached(self):
+        """ Whether styles are given from cache without loading styles.xml """
+        return self.registry is None and self.entry is not None
+
+    @property
+    def added_styles(self):
+        """ (style_id, format) -> id of added xf, see StyleRegistry """
+        return self.registry.added_styles if self.registry is not None else self.cached_styles
+
+    @property
+    def added_count(self):
+        """ Number of cell styles added to workbook """
+        if self.registry is not None:
+            return self.registry.added_count
+        return self.entry['added_count']
+
+    def get_style(self, style_id, new_format):
+        """ Get id of cell style which is style_id's style with new_format number format """
+        key = style_key(style_id, new_format)
+        if self.registry is None:
+            new_style_id = self.cached_styles.get(key)
+            if new_style_id is not None:
+                return new_style_id
+            self.load_registry()
+        if key not in self.pairs:
+            self.pairs.append(key)
+
+        return self.registry.get_style(style_id, new_format)
+
+    def load_registry(self):
+        """ Load original styles.xml and add formats in order of use, so they get the same ids """
+        self.registry = StyleRegistry(BytesIO(self.styles_xml))
+        for style_id, new_format in self.pairs:
+            self.registry.get_style(style_id, new_format)
+
+    def tostring(self):
+        """ Serialize styles.xml, saving it to cache if it was rewritten """
+        if self.registry is None:
+            return self.entry['styles_xml'].encode('utf-8')
+
+        styles_xml = self.registry.tostring()
+        if self.pairs:
+            pairs = [
+                [style_id, new_format, self.registry.added_styles[(style_id, new_format)]]
+                for style_id, new_format in self.pairs
+            ]
+            self.cache.put(self.styles_hash, pairs, styles_xml, self.registry.added_count)
+
+        return styles_xml
@@ -0,0 +1,67 @@
+# -*- coding: utf-8 -*-
+"""
+    Transforms of worksheet's cells for xlsx post-processing.
+    Transform is a callable transform(parser, cell), which changes cell's c-tag.
+    ParseXlsx applies its transforms in order to each c-tag of sheet in one pass.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Notice: Transforms are passed to process pool's workers, so with workers > 1
+            they have to be module-level functions.
+"""
+from __future__ import unicode_literals
+
+from xlsx_rc_convertor import get_cell_format
+
+
+class Cell(object):
+    """ c-tag being transformed with namespace of sheet and results of previous transforms """
+    __slots__ = ('tag', 'ns', 'formula')
+
+    def __init__(self, ns=''):
+        # Namespace prefix of sheet's tags, eg. '{http://...}'
+        self.ns = ns
+        self.tag = None
+        # R1C1-formula string of cell, set by convert_formula
+        self.formula = None
+
+    def reset(self, c_tag):
+        """ Start transforming next c-tag """
+        self.tag = c_tag
+        self.formula = None
+        return self
+
+    def find(self, name):
+        """ Find child tag of cell by its local name """
+        return self.tag.find(self.ns + name)
+
+
+def fix_nan(parser, cell):
+    """ Replace NaN values by 0 """
+    v_tag = cell.find('v')
+    if v_tag is not None and v_tag.text == 'NaN':
+        parser.metrics.count('nan_values')
+        v_tag.text = '0'
+
+
+def convert_formula(parser, cell):
+    """ Renumber cell's shared string and replace R1C1-formula string by A1-formula """
+    parser.convert_cell(cell)
+
+
+def apply_format(parser, cell):
+    """ Set number format written after formula as '@format@' to formula's cell """
+    if cell.formula and '@' in cell.formula[1:]:
+        cell.tag.attrib['s'] = parser.set_format(cell.tag.get('s'), get_cell_format(cell.formula[1:]))
+
+
+def blank_errors(parser, cell):
+    """ Remove values of error cells, eg. #DIV/0!. Not used by default """
+    if cell.tag.get('t') == 'e':
+        v_tag = cell.find('v')
+        if v_tag is not None:
+            cell.tag.remove(v_tag)
+        del cell.tag.attrib['t']
+        parser.metrics.count('errors_blanked')
+
+
+# Transforms of ParseXlsx if others aren't set
+DEFAULT_TRANSFORMS = (fix_nan, convert_formula, apply_format)
@@ -0,0 +1,275 @@
+# -*- coding: utf-8 -*-
+"""
+    Zip-archive helpers for xlsx post-processing.
+    Copies members between archives without recompression and writes
+    members incrementally, so workbook is rebuilt without a temp directory.
+    ~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~~
+    Notice: zipfile of Python 2 has no API to copy raw member data or to open
+            member for writing, so both are done with ZipFile's own file object.
+            Large members are deflated by independent blocks on thread pool,
+            zlib releases GIL while it compresses.
+"""
+import os
+import struct
+import time
+import zlib
+from collections import deque
+from zipfile import (ZipInfo, LargeZipFile, ZIP_DEFLATED, ZIP_STORED, ZIP64_LIMIT, sizeFileHeader,
+                     structFileHeader)
+
+# Size of chunk used for copying and compressing members
+CHUNK_SIZE = 64 * 1024
+# Members are compressed on thread pool by blocks of this size
+PARALLEL_BLOCK_SIZE = 1024 * 1024
+# Number of compressed blocks waiting to be written, so memory is bounded
+MAX_PENDING_BLOCKS = 16
+# Extensions of already compressed members, they're stored
+STORED_EXTENSIONS = ('.png', '.jpg', '.jpeg', '.gif', '.tif', '.tiff', '.zip', '.gz')
+# Streamed member gets ZIP64 header if its source is larger, as its size is unknown beforehand
+ZIP64_SIZE_HINT = ZIP64_LIMIT // 2
+
+
+class CompressionPolicy(object):
+    """
+        Compression of output workbook's members: deflate level, members which are
+        stored and number of threads compressing large members by blocks
+    """
+
+    def __init__(self, level=zlib.Z_DEFAULT_COMPRESSION, threads=1, block_size=PARALLEL_BLOCK_SIZE,
+                 stored_extensions=STORED_EXTENSIONS, allow_zip64=True):
+        self.level = level
+        self.threads = threads
+        self.block_size = block_size
+        self.stored_extensions = stored_extensions
+        self.allow_zip64 = allow_zip64
+
+    def compress_type(self, file_name):
+        """ ZIP_STORED for already compressed members, ZIP_DEFLATED for others """
+        if os.path.splitext(file_name)[1].lower() in self.stored_extensions:
+            return ZIP_STORED
+        return ZIP_DEFLATED
+
+    def zip_info(self, file_name, source_info=None):
+        """ Create ZipInfo for output member, see new_zip_info """
+        return new_zip_info(file_name, source_info, self.compress_type(file_name))
+
+    def zip64(self, source_info=None):
+        """ Whether streamed member, which is made of source_info's member, gets ZIP64 header """
+        return self.allow_zip64 and source_info is not None and source_info.file_size > ZIP64_SIZE_HINT
+
+
+def compress_block(data, level, final):
+    """
+        Deflate block of member independently of previous ones. Blocks but the last one
+        end with sync flush, so their raw streams are concatenated into one stream.
+    """
+    compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+    return compressor.compress(data) + compressor.flush(zlib.Z_FINISH if final else zlib.Z_SYNC_FLUSH)
+
+
+def new_zip_info(file_name, source_info=None, compress_type=ZIP_DEFLATED):
+    """ Create ZipInfo for output member, keeping date and attributes of source member """
+    if source_info is not None:
+        zip_info = ZipInfo(file_name, source_info.date_time)
+        zip_info.external_attr = source_info.external_attr
+        zip_info.create_system = source_info.create_system
+    else:
+        zip_info = ZipInfo(file_name, time.localtime(time.time())[:6])
+        zip_info.external_attr = 0o600 << 16
+    zip_info.compress_type = compress_type
+
+    return zip_info
+
+
+def copy_zip_member(source_zip, source_info, output_zip):
+    """ Copy member's compressed bytes from source_zip to output_zip without inflating them """
+    source_fp = source_zip.fp
+    source_fp.seek(source_info.header_offset)
+    file_header = struct.unpack(structFileHeader, source_fp.read(sizeFileHeader))
+    # Skip file name and extra field of local file header
+    source_fp.seek(file_header[10] + file_header[11], 1)
+
+    zip_info = new_zip_info(source_info.filename, source_info, source_info.compress_type)
+    zip_info.flag_bits = source_info.flag_bits & ~0x08
+    zip_info.CRC = source_info.CRC
+    zip_info.compress_size = source_info.compress_size
+    zip_info.file_size = source_info.file_size
+
+    output_fp = output_zip.fp
+    zip_info.header_offset = output_fp.tell()
+    output_fp.write(zip_info.FileHeader())
+    left = source_info.compress_size
+    while left > 0:
+        chunk = source_fp.read(min(CHUNK_SIZE, left))
+        if not chunk:
+            raise IOError('Unexpected end of member {0}'.format(source_info.filename))
+        output_fp.write(chunk)
+        left -= len(chunk)
+
+    register_zip_member(output_zip, zip_info)
+
+
+def register_zip_member(output_zip, zip_info):
+    """ Add written member to output_zip's central directory """
+    output_zip.filelist.append(zip_info)
+    output_zip.NameToInfo[zip_info.filename] = zip_info
+    output_zip._didModify = True
+
+
+def write_compressed_member(output_zip, zip_info, compressor):
+    """ Write data compressed by MemberCompressor to output_zip """
+    zip_info.flag_bits = 0
+    zip_info.CRC = compressor.CRC
+    zip_info.file_size = compressor.file_size
+    zip_info.compress_size = compressor.compress_size
+    zip_info.header_offset = output_zip.fp.tell()
+    output_zip.fp.write(zip_info.FileHeader())
+    for chunk in compressor.chunks:
+        output_zip.fp.write(chunk)
+
+    register_zip_member(output_zip, zip_info)
+
+
+class MemberCompressor(object):
+    """
+        File-like object which compresses data written to it as data of zip member.
+        Compressed data is kept in memory, so it can be prepared in another process
+        and written to archive with write_compressed_member. With thread pool data
+        over block_size is compressed by blocks in pool's threads.
+    """
+
+    def __init__(self, compress_type=ZIP_DEFLATED, level=zlib.Z_DEFAULT_COMPRESSION, pool=None,
+                 block_size=PARALLEL_BLOCK_SIZE):
+        self.compress_type = compress_type
+        self.level = level
+        self.CRC = 0
+        self.file_size = 0
+        self.compress_size = 0
+        self.chunks = []
+        if compress_type == ZIP_DEFLATED:
+            self._compressor = zlib.compressobj(level, zlib.DEFLATED, -15)
+        else:
+            self._compressor = None
+            pool = None
+        self._pool = pool
+        self._block_size = block_size
+        # Data of block being filled and blocks being compressed by pool in order
+        self._block = []
+        self._block_length = 0
+        self._pending_blocks = deque()
+        self.closed = False
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, exc_type, exc_val, exc_tb):
+        self.close()
+
+    def __getstate__(self):
+        """ Only result of compression is passed between processes """
+        state = self.__dict__.copy()
+        state['_compressor'] = None
+        state['_pool'] = None
+        return state
+
+    def write(self, data):
+        """ Compress data """
+        if not data:
+            return
+        self.file_size += len(data)
+        self.CRC = zlib.crc32(data, self.CRC) & 0xffffffff
+        if self._pool is not None:
+            # Large writes, eg. whole serialized sheet, are split to blocks too
+            position = 0
+            while position < len(data):
+                length = min(len(data) - position, self._block_size - self._block_length)
+                self._block.append(data[position:position + length] if length < len(data) else data)
+                self._block_length += length
+                position += length
+                if self._block_length >= self._block_size:
+                    self._compress_block(False)
+            return
+        if self._compressor:
+            data = self._compressor.compress(data)
+        self._write_raw(data)
+
+    def _compress_block(self, final):
+        """ Pass filled block to pool and write blocks which are compressed already """
+        data = b''.join(self._block)
+        self._block = []
+        self._block_length = 0
+        if final and not self._pending_blocks:
+            # Member fits into one block, it's compressed as usual
+            self._write_raw(self._compressor.compress(data) + self._compressor.flush())
+            return
+        self._pending_blocks.append(self._pool.apply_async(compress_block, (data, self.level, final)))
+        while self._pending_blocks and (
+                final or self._pending_blocks[0].ready() or len(self._pending_blocks) > MAX_PENDING_BLOCKS):
+            self._write_raw(self._pending_blocks.popleft().get())
+
+    def flush(self):
+        """ Data is flushed on close only """
+
+    def close(self):
+        """ Finish compression """
+        if self.closed:
+            return
+        self.closed = True
+        if self._pool is not None:
+            self._compress_block(True)
+        elif self._compressor:
+            self._write_raw(self._compressor.flush())
+        self._compressor = None
+        self._pool = None
+
+    def _write_raw(self, data):
+        """ Save already compressed data """
+        if data:
+            self.compress_size += len(data)
+            self.chunks.append(data)
+
+
+class ZipMemberWriter(MemberCompressor):
+    """
+        File-like object which compresses data written to it straight into
+        new member of output_zip. Output archive's file has to be seekable.
+        Local header is rewritten when member is closed, so ZIP64 member has
+        to be opened with zip64=True to have place for ZIP64 sizes.
+    """
+
+    def __init__(self, output_zip, zip_info, level=zlib.Z_DEFAULT_COMPRESSION, pool=None,
+                 block_size=PARALLEL_BLOCK_SIZE, zip64=False):
+        super(ZipMemberWriter, self).__init__(zip_info.compress_type, level, pool, block_size)
+        self.output_zip = output_zip
+        self.zip_info = zip_info
+        self.zip64 = zip64
+        self.zip_info.flag_bits = 0
+        self.zip_info.CRC = 0
+        self.zip_info.file_size = 0
+        self.zip_info.compress_size = 0
+        self.zip_info.header_offset = output_zip.fp.tell()
+        output_zip.fp.write(self.zip_info.FileHeader(zip64))
+
+    def close(self):
+        """ Finish member and rewrite its local header with real CRC and sizes """
+        if self.closed:
+            return
+        super(ZipMemberWriter, self).close()
+        self.zip_info.CRC = self.CRC
+        self.zip_info.file_size = self.file_size
+        self.zip_info.compress_size = self.compress_size
+        if not self.zip64 and (self.file_size > ZIP64_LIMIT or self.compress_size > ZIP64_LIMIT):
+            raise LargeZipFile('Filesize would require ZIP64 extensions')
+
+        output_fp = self.output_zip.fp
+        position = output_fp.tell()
+        output_fp.seek(self.zip_info.header_offset)
+        output_fp.write(self.zip_info.FileHeader(self.zip64))
+        output_fp.seek(position)
+        register_zip_member(self.output_zip, self.zip_info)
+
+    def _write_raw(self, data):
+        """ Write already compressed data to archive """
+        if data:
+            self.compress_size += len(data)
+            self.output_zip.fp.write(data)